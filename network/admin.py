@@ -1,8 +1,204 @@
-from django.contrib import admin
+from collections import defaultdict
+
+from django.contrib import admin, messages
+from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.db import transaction
+from django.db.models import Count
+from django.utils.text import Truncator
+
 from .models import User, Post, Follow, Like
+from .caching import feed_changed, posts_changed, profiles_changed
+from .counters import REPAIR_BATCH_SIZE, repair_counters
+from .jobs import enqueue_many
+from .pagination import EstimatedCountPaginator
+from .trending import record_likes
+
+"""
+ADMIN
+
+    The Post, Like and Follow tables grow to millions of rows, so their
+    change lists avoid what the default ModelAdmin does per page:
+
+    - no COUNT(*) of the whole table (EstimatedCountPaginator, and
+      show_full_result_count off)
+    - the users and posts a row points to are loaded in the same query
+      (list_select_related) or not at all, and are picked by ID on the change
+      form rather than from a <select> of every row (raw_id_fields)
+    - filters and sorting only on indexed columns: the user by exact
+      username, and the post date
+    - deleting runs a few set-based queries instead of loading and listing
+      every object it deletes, and keeps the counters, caches and timelines
+      right, as the views do
+
+"""
+class UsernameFilter(admin.SimpleListFilter):
+    # A text box taking a username, for a foreign key to User; subclasses set
+    # title and parameter_name to the field's name
+    template = "admin/network/username_filter.html"
+
+    def lookups(self, request, model_admin):
+        # Needed for the filter to be shown; the choice is typed in
+        return ()
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        # Only the "all" link, plus the other filters to keep in the form
+        params = changelist.get_filters_params()
+        yield {
+            "selected": self.value() is None,
+            "query_string": changelist.get_query_string(remove=[self.parameter_name]),
+            "hidden": [
+                (name, value)
+                for name, values in params.items() if name != self.parameter_name
+                for value in (values if isinstance(values, list) else [values])
+            ],
+        }
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{f"{self.parameter_name}__username": self.value()})
+        return queryset
+
+
+def username_filter(field):
+    return type(f"{field.title()}Filter", (UsernameFilter,), {"title": field, "parameter_name": field})
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+    sortable_by = ()
+
+    # The default action loads every object it would delete, and everything
+    # they cascade to, to list them on its confirmation page
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.pop("delete_selected", None)
+        return actions
+
+
+# Delete likes, and fix the counters and trending scores of their posts
+def delete_likes(likes):
+    posts_by_count = defaultdict(list)
+    for post_id, count in likes.order_by().values_list("post").annotate(Count("id")):
+        posts_by_count[count].append(post_id)
+    deleted, _ = likes.delete()
+
+    post_ids = sorted(post_id for post_ids in posts_by_count.values() for post_id in post_ids)
+    repair_counters(post_ids=post_ids)
+    for count, post_ids_with_count in posts_by_count.items():
+        for start in range(0, len(post_ids_with_count), REPAIR_BATCH_SIZE):
+            record_likes(post_ids_with_count[start:start + REPAIR_BATCH_SIZE], -count)
+    posts_changed(post_ids)
+    return deleted
+
+
+# Delete posts; their likes, timeline entries and trending scores go with them
+def delete_posts(posts):
+    posts = list(posts.values_list("id", "poster"))
+    post_ids = [post_id for post_id, _ in posts]
+    deleted = 0
+    for start in range(0, len(post_ids), REPAIR_BATCH_SIZE):
+        deleted += Post.objects.filter(id__in=post_ids[start:start + REPAIR_BATCH_SIZE]).delete()[1].get(
+            "network.Post", 0
+        )
+    posts_changed(post_ids)
+    for poster_id in {poster_id for _, poster_id in posts}:
+        feed_changed(poster_id)
+    return deleted
+
+
+# Delete every post and like of users (e.g. spammers); returns (posts, likes)
+def delete_content(user_ids):
+    user_ids = list(user_ids)
+    with transaction.atomic():
+        # The likes on their own posts go with the posts
+        likes = delete_likes(Like.objects.filter(liker__in=user_ids).exclude(post__poster__in=user_ids))
+        posts = delete_posts(Post.objects.filter(poster__in=user_ids))
+    return posts, likes
+
+
+# Django's user admin, for its password hashing forms, with the change list
+# of a large table
+@admin.register(User)
+class UserAdmin(LargeTableAdmin, BaseUserAdmin):
+    list_display = ("id", "username", "email", "followers_count", "following_count", "is_staff", "date_joined")
+    list_filter = ()
+    search_fields = ("username__exact",)
+    ordering = ("id",)
+    sortable_by = ("id", "username")
+    actions = ["delete_users_content"]
+
+    @admin.action(description="Delete the posts and likes of the selected users", permissions=["delete"])
+    def delete_users_content(self, request, queryset):
+        posts, likes = delete_content(queryset.values_list("id", flat=True))
+        self.message_user(request, f"Deleted {posts} post(s) and {likes} like(s).", messages.SUCCESS)
+
+
+@admin.register(Post)
+class PostAdmin(LargeTableAdmin):
+    list_display = ("id", "poster", "body_preview", "timestamp", "likes_count", "edited")
+    list_select_related = ("poster",)
+    list_filter = (username_filter("poster"), "timestamp")
+    raw_id_fields = ("poster",)
+    ordering = ("-timestamp", "-id")
+    sortable_by = ("timestamp",)
+    actions = ["delete_selected_posts", "delete_posters_content"]
+
+    @admin.display(description="body")
+    def body_preview(self, post):
+        return Truncator(post.body).chars(80)
+
+    @admin.action(description="Delete the selected posts", permissions=["delete"])
+    def delete_selected_posts(self, request, queryset):
+        with transaction.atomic():
+            deleted = delete_posts(queryset)
+        self.message_user(request, f"Deleted {deleted} post(s).", messages.SUCCESS)
+
+    @admin.action(description="Delete every post and like of the selected posts' posters", permissions=["delete"])
+    def delete_posters_content(self, request, queryset):
+        posts, likes = delete_content(queryset.values_list("poster", flat=True).distinct())
+        self.message_user(request, f"Deleted {posts} post(s) and {likes} like(s).", messages.SUCCESS)
+
+
+@admin.register(Like)
+class LikeAdmin(LargeTableAdmin):
+    list_display = ("id", "liker", "post_id")
+    list_select_related = ("liker",)
+    list_filter = (username_filter("liker"),)
+    raw_id_fields = ("liker", "post")
+    ordering = ("-id",)
+    actions = ["delete_selected_likes"]
+
+    @admin.action(description="Delete the selected likes", permissions=["delete"])
+    def delete_selected_likes(self, request, queryset):
+        with transaction.atomic():
+            deleted = delete_likes(queryset)
+        self.message_user(request, f"Deleted {deleted} like(s).", messages.SUCCESS)
+
+
+@admin.register(Follow)
+class FollowAdmin(LargeTableAdmin):
+    list_display = ("id", "follower", "follows")
+    list_select_related = ("follower", "follows")
+    list_filter = (username_filter("follower"), username_filter("follows"))
+    raw_id_fields = ("follower", "follows")
+    ordering = ("-id",)
+    actions = ["delete_selected_follows"]
 
-# Register your models here.
-admin.site.register(User)
-admin.site.register(Post)
-admin.site.register(Follow)
-admin.site.register(Like)
+    @admin.action(description="Delete the selected follows", permissions=["delete"])
+    def delete_selected_follows(self, request, queryset):
+        with transaction.atomic():
+            pairs = list(queryset.values_list("follower", "follows"))
+            deleted, _ = queryset.delete()
+            user_ids = sorted({user_id for pair in pairs for user_id in pair})
+            repair_counters(user_ids=user_ids)
+            profiles_changed(user_ids)
+            # As for an unfollow: take the posts out of the timelines, and
+            # recompute the followers' suggestions
+            enqueue_many("remove_from_timeline", [{"owner": owner, "unfollowed": user_id} for owner, user_id in pairs])
+            enqueue_many("refresh_suggestions", [{"user": owner} for owner in sorted({owner for owner, _ in pairs})])
+        self.message_user(request, f"Deleted {deleted} follow(s).", messages.SUCCESS)
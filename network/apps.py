@@ -1,5 +1,13 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class NetworkConfig(AppConfig):
     name = 'network'
+
+    def ready(self):
+        # Registers the static file reference check, and the signal handlers
+        # that drop cached users
+        from . import assets, auth  # noqa: F401
+        from .sqlite import configure_connection
+        connection_created.connect(configure_connection, dispatch_uid="network.sqlite.configure_connection")
@@ -0,0 +1,252 @@
+import gzip
+import mimetypes
+import os
+import re
+
+import django
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.checks import Error, Warning, register
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse, HttpResponse
+from django.template import engines
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+"""
+STATIC ASSET PIPELINE
+
+    With NETWORK_STATIC_PRODUCTION on, collectstatic writes every file to
+    STATIC_ROOT under a name with a hash of its content (network.3f2a9c.js),
+    plus gzip and, if the brotli package is installed, brotli copies of the
+    text files. {% static %} then resolves to the hashed names through the
+    manifest, so a changed file gets a new URL and browsers can keep the old
+    one forever.
+
+    StaticAssetMiddleware serves STATIC_ROOT from the web process itself, for
+    WSGI and ASGI workers without a separate file server in front:
+
+    - hashed names are sent with Cache-Control: max-age=one year, immutable;
+      anything else is revalidated after NETWORK_STATIC_MAX_AGE seconds
+    - the brotli or gzip copy is sent to browsers that accept it
+    - ETag and Last-Modified answer revalidations with a 304
+    - files up to NETWORK_STATIC_MEMORY_LIMIT bytes are read into memory at
+      startup, so serving them does not touch the disk
+
+    Run collectstatic before starting the server, and runserver with
+    --nostatic, so the staticfiles app leaves the requests to the middleware.
+
+"""
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".json", ".map", ".svg", ".txt", ".xml", ".html", ".ico"}
+
+# Only keep a compressed copy that saves at least this share of the size
+MIN_SAVING = 0.05
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+def production_static():
+    return getattr(settings, "NETWORK_STATIC_PRODUCTION", False)
+
+
+def compress(data):
+    variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = brotli.compress(data, quality=11)
+    return {
+        suffix: compressed for suffix, compressed in variants.items()
+        if len(compressed) <= len(data) * (1 - MIN_SAVING)
+    }
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in sorted(set(self.hashed_files) | set(self.hashed_files.values())):
+            if os.path.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS and self.exists(name):
+                self.write_compressed(name)
+
+    def write_compressed(self, name):
+        with self.open(name) as file:
+            data = file.read()
+        variants = compress(data)
+        for _, suffix in ENCODINGS:
+            path = self.path(name + suffix)
+            if suffix in variants:
+                with open(path, "wb") as file:
+                    file.write(variants[suffix])
+            elif os.path.exists(path):
+                os.remove(path)
+
+
+class StaticFile:
+
+    def __init__(self, path, immutable, memory_limit):
+        self.path = path
+        stat = os.stat(path)
+        self.size = stat.st_size
+        self.last_modified = int(stat.st_mtime)
+        self.etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.immutable = immutable
+        self.data = None
+        if self.size <= memory_limit:
+            with open(path, "rb") as file:
+                self.data = file.read()
+        # {encoding: StaticFile} of the compressed copies
+        self.encoded = {}
+
+    def response(self, request):
+        response = get_conditional_response(request, etag=self.etag, last_modified=self.last_modified)
+        if response is None:
+            if request.method == "HEAD":
+                response = HttpResponse()
+            elif self.data is not None:
+                response = HttpResponse(self.data)
+            else:
+                response = FileResponse(open(self.path, "rb"))
+            response["Content-Length"] = str(self.size)
+        response["ETag"] = self.etag
+        response["Last-Modified"] = http_date(self.last_modified)
+        return response
+
+
+def accepted_encodings(request):
+    accepted = set()
+    for part in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if not re.fullmatch(r"\s*q\s*=\s*0(\.0*)?\s*", params):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticAssetMiddleware:
+
+    def __init__(self, get_response):
+        if not production_static() or not settings.STATIC_ROOT or not os.path.isdir(settings.STATIC_ROOT):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL if settings.STATIC_URL.startswith("/") else "/" + settings.STATIC_URL
+        self.max_age = getattr(settings, "NETWORK_STATIC_MAX_AGE", 60)
+        self.files = self.scan(
+            settings.STATIC_ROOT, getattr(settings, "NETWORK_STATIC_MEMORY_LIMIT", 512 * 1024)
+        )
+
+    # Index every file under root by its name, with its compressed copies
+    def scan(self, root, memory_limit):
+        hashed = set(getattr(staticfiles_storage, "hashed_files", {}).values())
+        suffixes = tuple(suffix for _, suffix in ENCODINGS)
+        files = {}
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, root).replace(os.sep, "/")
+                if name.endswith(suffixes):
+                    continue
+                static_file = StaticFile(path, name in hashed, memory_limit)
+                for encoding, suffix in ENCODINGS:
+                    if os.path.exists(path + suffix):
+                        static_file.encoded[encoding] = StaticFile(path + suffix, name in hashed, memory_limit)
+                files[name] = static_file
+        return files
+
+    def __call__(self, request):
+        if not request.path.startswith(self.prefix) or request.method not in ("GET", "HEAD"):
+            return self.get_response(request)
+        static_file = self.files.get(request.path[len(self.prefix):])
+        if static_file is None:
+            return self.get_response(request)
+
+        sent = static_file
+        if static_file.encoded:
+            accepted = accepted_encodings(request)
+            for encoding, _ in ENCODINGS:
+                if encoding in static_file.encoded and encoding in accepted:
+                    sent = static_file.encoded[encoding]
+                    break
+        response = sent.response(request)
+        response["Content-Type"] = static_file.content_type
+        if sent is not static_file:
+            response["Content-Encoding"] = next(
+                encoding for encoding, variant in static_file.encoded.items() if variant is sent
+            )
+        if static_file.encoded:
+            response["Vary"] = "Accept-Encoding"
+        if static_file.immutable:
+            response["Cache-Control"] = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+        else:
+            response["Cache-Control"] = f"public, max-age={self.max_age}"
+        return response
+
+
+"""
+TEMPLATE CHECK
+
+    Templates must link to static files with {% static %}, so the links get the
+    hashed names; a hard-coded /static/ URL would keep pointing at the
+    unhashed file. Every name given to {% static %} must exist, or, in the
+    production mode, be in the manifest, where a missing name fails the page.
+"""
+STATIC_TAG = re.compile(r"""{%\s*static\s+['"]([^'"]+)['"]""")
+
+
+# The project's templates, leaving out Django's own (e.g. the admin's)
+def template_sources():
+    django_dir = os.path.dirname(django.__file__)
+    for engine in engines.all():
+        for directory in getattr(engine, "template_dirs", []):
+            if str(directory).startswith(django_dir):
+                continue
+            for root, _, filenames in os.walk(directory):
+                for filename in filenames:
+                    if filename.endswith((".html", ".txt", ".xml")):
+                        path = os.path.join(root, filename)
+                        with open(path, encoding="utf-8") as file:
+                            yield path, file.read()
+
+
+# Return the names passed to {% static %} and the hard-coded static URLs in a template
+def static_references(source, static_url):
+    hard_coded = re.findall(r"""(?:src|href)\s*=\s*['"](%s[^'"]*)['"]""" % re.escape(static_url), source)
+    return STATIC_TAG.findall(source), hard_coded
+
+
+@register("staticfiles")
+def check_static_references(app_configs=None, **kwargs):
+    messages = []
+    # Before collectstatic has run, the manifest is empty and the names are
+    # looked up in the source directories instead
+    manifest = None
+    if production_static() and isinstance(staticfiles_storage, ManifestStaticFilesStorage):
+        manifest = staticfiles_storage.hashed_files or None
+    for path, source in template_sources():
+        names, hard_coded = static_references(source, settings.STATIC_URL)
+        for url in hard_coded:
+            messages.append(Warning(
+                f"{path} links to {url} directly, which bypasses the hashed file names.",
+                hint="Use {% static %} instead.",
+                id="network.W001",
+            ))
+        for name in names:
+            if manifest:
+                missing = name not in manifest
+            else:
+                missing = finders.find(name) is None
+            if missing:
+                messages.append(Error(
+                    f"{path} uses the static file {name!r}, which does not exist"
+                    + (" in the manifest; run collectstatic." if manifest else "."),
+                    id="network.E001",
+                ))
+    return messages
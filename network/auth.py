@@ -0,0 +1,76 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.signals import user_logged_out
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import User
+
+"""
+CACHED USER LOOKUP
+
+    AuthenticationMiddleware loads request.user from the database on every
+    request that uses it, by the ID in the session. CachedModelBackend keeps
+    the loaded users in the cache named by NETWORK_CACHE_ALIAS for
+    NETWORK_USER_CACHE_TIMEOUT seconds (0 turns the cache off), which saves
+    that query on every AJAX request. Together with a cached session engine
+    (NETWORK_SESSION_ENGINE, see project4/settings.py), a request needs no
+    database query to know who is logged in.
+
+    Django still checks the cached user's password hash against the session,
+    so the cached copy is dropped whenever the user is saved (e.g. a password
+    or is_active change) or deleted, and when they log out. Follow counter
+    changes drop it too (see caching.profiles_changed); the counters are
+    updated in bulk, without saving the user.
+
+    The cache must be shared by all processes (file or redis) for a password
+    change in one process to log the user out in the others at once; with
+    locmem, the other processes notice within the timeout.
+
+"""
+def _cache():
+    return caches[getattr(settings, "NETWORK_CACHE_ALIAS", "default")]
+
+
+def user_timeout():
+    return getattr(settings, "NETWORK_USER_CACHE_TIMEOUT", 0)
+
+
+def user_key(user_id):
+    return f"network:user:{user_id}"
+
+
+class CachedModelBackend(ModelBackend):
+
+    def get_user(self, user_id):
+        if not user_timeout():
+            return super().get_user(user_id)
+        user = _cache().get(user_key(user_id))
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                _cache().set(user_key(user_id), user, user_timeout())
+        return user
+
+
+# Drop the cached users once the transaction commits, so no request can cache
+# the old row again in between
+def users_changed(user_ids):
+    if isinstance(user_ids, int):
+        user_ids = [user_ids]
+    keys = [user_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: _cache().delete_many(keys))
+
+
+@receiver(post_save, sender=User, dispatch_uid="network.auth.user_saved")
+@receiver(post_delete, sender=User, dispatch_uid="network.auth.user_deleted")
+def _user_changed(sender, instance, **kwargs):
+    users_changed(instance.pk)
+
+
+@receiver(user_logged_out, dispatch_uid="network.auth.user_logged_out")
+def _user_logged_out(sender, request, user, **kwargs):
+    if user is not None:
+        users_changed(user.pk)
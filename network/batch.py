@@ -0,0 +1,122 @@
+from django.db import transaction
+
+from .models import User, Post, Follow, Like
+from .counters import repair_counters
+from .caching import posts_changed, profiles_changed
+from .events import likes_changed
+from .jobs import enqueue, enqueue_many
+from .trending import record_likes
+
+MAX_BATCH_OPERATIONS = 100
+
+# IDs are 64-bit signed integers; a bigger one would overflow in the query
+MAX_ID = 2 ** 63 - 1
+
+"""
+BATCHED WRITE FUNCTIONS
+
+    The /batch endpoint takes a list of operations from one user, e.g.
+
+        {"operations": [{"op": "like", "post": 12}, {"op": "unlike", "post": 7},
+                        {"op": "follow", "user": 3}, {"op": "unfollow", "user": 5}]}
+
+    Operations on the same post or user are coalesced: only the last one
+    counts, so a like quickly followed by an unlike writes nothing. The rest
+    are applied idempotently in a single transaction, with one bulk insert
+    and one delete per table, and the counters of every touched row are
+    recounted from the Like and Follow tables.
+
+"""
+OPERATIONS = {"like": "post", "unlike": "post", "follow": "user", "unfollow": "user"}
+
+
+class InvalidBatch(ValueError):
+    pass
+
+
+# Validate the operations and coalesce them into ({post_id: like?}, {user_id: follow?})
+def parse_operations(operations):
+    if not isinstance(operations, list) or not operations:
+        raise InvalidBatch("Expected a non-empty list of operations.")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise InvalidBatch(f"At most {MAX_BATCH_OPERATIONS} operations can be sent at once.")
+
+    likes, follows = {}, {}
+    for operation in operations:
+        op = operation.get("op") if isinstance(operation, dict) else None
+        if op not in OPERATIONS:
+            raise InvalidBatch(f"Unknown operation: {op!r}.")
+        target = operation.get(OPERATIONS[op])
+        if not isinstance(target, int) or isinstance(target, bool) or not 0 < target <= MAX_ID:
+            raise InvalidBatch(f"The {op} operation needs a positive integer {OPERATIONS[op]} ID.")
+        if OPERATIONS[op] == "post":
+            likes[target] = op == "like"
+        else:
+            follows[target] = op == "follow"
+    return likes, follows
+
+
+# Apply coalesced operations for user, and return the resulting state of every
+# post and user they name
+def apply_operations(user, likes, follows):
+    if user.id in follows:
+        raise InvalidBatch("Users cannot follow themselves.")
+
+    with transaction.atomic():
+        post_ids = set(Post.objects.filter(id__in=likes).values_list("id", flat=True))
+        user_ids = set(User.objects.filter(id__in=follows).values_list("id", flat=True))
+        liked = set(Like.objects.filter(liker=user, post__in=post_ids).values_list("post_id", flat=True))
+        followed = set(Follow.objects.filter(follower=user, follows__in=user_ids).values_list("follows_id", flat=True))
+
+        to_like = sorted(post_id for post_id in post_ids if likes[post_id] and post_id not in liked)
+        to_unlike = sorted(post_id for post_id in post_ids if not likes[post_id] and post_id in liked)
+        to_follow = sorted(user_id for user_id in user_ids if follows[user_id] and user_id not in followed)
+        to_unfollow = sorted(user_id for user_id in user_ids if not follows[user_id] and user_id in followed)
+
+        if to_like:
+            Like.objects.bulk_create([Like(liker=user, post_id=post_id) for post_id in to_like], ignore_conflicts=True)
+        if to_unlike:
+            Like.objects.filter(liker=user, post__in=to_unlike).delete()
+        if to_follow:
+            Follow.objects.bulk_create(
+                [Follow(follower=user, follows_id=user_id) for user_id in to_follow], ignore_conflicts=True
+            )
+            enqueue_many("backfill_timeline", [{"owner": user.id, "followed": user_id} for user_id in to_follow])
+        if to_unfollow:
+            Follow.objects.filter(follower=user, follows__in=to_unfollow).delete()
+            enqueue_many("remove_from_timeline", [{"owner": user.id, "unfollowed": user_id} for user_id in to_unfollow])
+
+        # Recount rather than apply +1/-1, so the counters stay right even if a
+        # concurrent request wrote the same rows between the reads and the writes
+        changed_posts = to_like + to_unlike
+        changed_users = to_follow + to_unfollow
+        if changed_posts or changed_users:
+            repair_counters(post_ids=changed_posts, user_ids=changed_users + [user.id])
+        if changed_posts:
+            posts_changed(changed_posts)
+            record_likes(to_like, 1)
+            record_likes(to_unlike, -1)
+        if changed_users:
+            profiles_changed(changed_users + [user.id])
+            enqueue("refresh_suggestions", user=user.id)
+        for post_id in to_like:
+            likes_changed(post_id, 1, user)
+        for post_id in to_unlike:
+            likes_changed(post_id, -1, user)
+
+    posts = {
+        post_id: {"likes_count": likes_count, "user_liked": likes[post_id]}
+        for post_id, likes_count in Post.objects.filter(id__in=post_ids).values_list("id", "likes_count")
+    }
+    users = {
+        user_id: {"follower_count": followers_count, "activeUserFollows": follows[user_id]}
+        for user_id, followers_count in User.objects.filter(id__in=user_ids).values_list("id", "followers_count")
+    }
+    return {
+        "posts": posts,
+        "users": users,
+        "not_found": {
+            "posts": sorted(set(likes) - post_ids),
+            "users": sorted(set(follows) - user_ids),
+        },
+    }
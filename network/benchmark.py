@@ -0,0 +1,162 @@
+import json
+import random
+import time
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .models import User, Post, Follow, Like
+from .perf import percentile
+from .trending import TRENDING_ORDERING, aggregate_trending, trending_posts
+
+"""
+ENDPOINT BENCHMARK HARNESS
+
+    Drives the feed, profile, like and follow endpoints through the Django test
+    client as a sample of logged in users, and reports the latency percentiles
+    and query counts of each endpoint. Run it with the benchmark_network command
+    against a database filled by seed_network, before and after a change.
+
+    Like/unlike and follow/unfollow are measured in pairs, so the database is
+    left as it was found. The rate limits are off while it runs, and any
+    error response stops it, so no throttled or failed request is counted as
+    a sample or breaks a pair. trending_scan and trending_aggregate read the posts
+    of the first trending page directly, from the stored scores and from the
+    Like table respectively.
+
+"""
+AJAX = {"HTTP_X_REQUESTED_WITH": "XMLHttpRequest"}
+
+
+def summarize(samples):
+    timings = sorted(ms for ms, _ in samples)
+    queries = [count for _, count in samples]
+    return {
+        "requests": len(samples),
+        "p50_ms": round(percentile(timings, 50), 2),
+        "p95_ms": round(percentile(timings, 95), 2),
+        "p99_ms": round(percentile(timings, 99), 2),
+        "max_ms": round(timings[-1], 2),
+        "avg_queries": round(sum(queries) / len(queries), 1),
+        "max_queries": max(queries),
+    }
+
+
+class Benchmark:
+
+    def __init__(self, requests=50, viewers=20, cold=False, seed=None, log=None):
+        self.requests = requests
+        self.num_viewers = viewers
+        # clear the cache before every request, to measure the database paths
+        self.cold = cold
+        self.random = random.Random(seed)
+        self.log = log or (lambda message: None)
+        self.client = Client()
+        self.samples = {}
+
+    def measure(self, name, method, url, data=None, **extra):
+        if self.cold:
+            cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(self.client, method)(url, data, **extra)
+            elapsed = (time.perf_counter() - start) * 1000
+        if response.status_code >= 400:
+            raise RuntimeError(f"{name} returned {response.status_code} for {url}")
+        self.samples.setdefault(name, []).append((elapsed, len(queries)))
+        return response
+
+    # Measure a function called directly rather than an endpoint
+    def measure_call(self, name, function):
+        if self.cold:
+            cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            result = function()
+            elapsed = (time.perf_counter() - start) * 1000
+        self.samples.setdefault(name, []).append((elapsed, len(queries)))
+        return result
+
+    def run(self):
+        with override_settings(NETWORK_RATE_LIMITS={}):
+            return self.run_rounds()
+
+    def run_rounds(self):
+        viewers = list(User.objects.filter(following_count__gt=0).order_by("?")[:self.num_viewers])
+        if not viewers:
+            viewers = list(User.objects.order_by("?")[:self.num_viewers])
+        # Popular profiles and hot posts are where the load concentrates
+        profiles = list(User.objects.order_by("-followers_count").values_list("id", flat=True)[:50])
+        hot_posts = list(Post.objects.order_by("-likes_count").values_list("id", flat=True)[:50])
+        if not viewers or not hot_posts:
+            raise ValueError("The database has no users or posts; run seed_network first.")
+
+        for i in range(self.requests):
+            viewer = self.random.choice(viewers)
+            self.client.force_login(viewer)
+
+            self.measure("index", "get", "/", **AJAX)
+            first_page = self.measure("index_cursor", "get", "/", {"cursor": ""}, **AJAX).json()
+            next_cursor = first_page[-1]["next_cursor"]
+            if next_cursor:
+                self.measure("index_next_page", "get", "/", {"cursor": next_cursor}, **AJAX)
+            self.measure("following", "get", "/", {"following": "true", "cursor": ""}, **AJAX)
+            self.measure("trending", "get", "/", {"trending": "true", "cursor": ""}, **AJAX)
+            self.measure_call("trending_scan", lambda: list(
+                trending_posts().select_related("poster").order_by(*[f"-{field}" for field in TRENDING_ORDERING])[:10]
+            ))
+            self.measure_call("trending_aggregate", lambda: aggregate_trending(10))
+            self.measure("profile", "get", f"/profile/{self.random.choice(profiles)}", {"cursor": ""}, **AJAX)
+
+            post_id = self.random.choice(hot_posts)
+            if Like.objects.filter(liker=viewer, post=post_id).exists():
+                self.measure("unlike_post", "post", f"/unlike/{post_id}")
+                self.measure("like_post", "post", f"/like/{post_id}")
+            else:
+                self.measure("like_post", "post", f"/like/{post_id}")
+                self.measure("unlike_post", "post", f"/unlike/{post_id}")
+
+            user_id = self.random.choice(profiles)
+            if user_id != viewer.id:
+                if Follow.objects.filter(follower=viewer, follows=user_id).exists():
+                    self.measure("unfollow_user", "post", f"/unfollow/{user_id}")
+                    self.measure("follow_user", "post", f"/follow/{user_id}")
+                else:
+                    self.measure("follow_user", "post", f"/follow/{user_id}")
+                    self.measure("unfollow_user", "post", f"/unfollow/{user_id}")
+
+            if (i + 1) % 10 == 0:
+                self.log(f"{i + 1}/{self.requests} rounds done")
+
+        return {name: summarize(samples) for name, samples in self.samples.items()}
+
+
+# Format results as a table, with the change from a baseline if given
+def format_results(results, baseline=None):
+    columns = ["requests", "p50_ms", "p95_ms", "p99_ms", "max_ms", "avg_queries", "max_queries"]
+    lines = [f"{'endpoint':<18}" + "".join(f"{column:>13}" for column in columns)]
+    for name, result in results.items():
+        line = f"{name:<18}" + "".join(f"{result[column]:>13}" for column in columns)
+        lines.append(line)
+        if baseline and name in baseline:
+            changes = []
+            for column in columns:
+                before = baseline[name].get(column)
+                if column == "requests" or not before:
+                    changes.append(f"{'':>13}")
+                else:
+                    changes.append(f"{(result[column] - before) / before:>+13.0%}")
+            lines.append(f"{'  vs baseline':<18}" + "".join(changes))
+    return "\n".join(lines)
+
+
+def save_results(results, path):
+    with open(path, "w") as output:
+        json.dump(results, output, indent=2)
+
+
+def load_results(path):
+    with open(path) as baseline:
+        return json.load(baseline)
@@ -0,0 +1,212 @@
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .auth import users_changed
+from .perf import timer
+from .routers import replica_reads
+
+"""
+FEED AND PROFILE CACHE
+
+    Caches the parts of the feed and profile responses that are the same for
+    every viewer, in the cache named by NETWORK_CACHE_ALIAS:
+
+    - each serialized post (Post.serialize(), including likes_count)
+    - the list of post IDs on each page of the all posts and profile feeds
+    - each profile header (userName, numFollowers, numFollows)
+
+    Per-viewer state (user_liked, activeUserFollows) is never cached; the views
+    look it up for the page and overlay it on the cached data.
+
+    Invalidation is targeted:
+    - a new post bumps the generation of the all posts feed and of its poster's
+      profile feed, so their cached page lists are no longer used (pages after
+      a cursor are unaffected by new posts and are not tied to the generation)
+    - editing, liking or unliking a post drops that post's cached entry
+    - following or unfollowing drops both users' cached profile headers
+    All invalidations run once the write's transaction has committed, and
+    misses are always loaded from the primary database, never from a read
+    replica that may not have the write yet.
+
+    A page cached from a generation read before a new post's bump is under
+    the old generation's key, so it is never served afterwards. Dropped post
+    and profile entries have no such guard: a reader that missed and loaded
+    the old values just before the commit can store them again just after
+    the delete, and they are then served until they expire, after at most
+    NETWORK_CACHE_TIMEOUT seconds.
+
+    Hits and misses are counted per process and shown by stats().
+
+"""
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, "NETWORK_CACHE_ALIAS", "default")]
+
+
+def _timeout():
+    return getattr(settings, "NETWORK_CACHE_TIMEOUT", 300)
+
+
+def _count(kind, hit, amount=1):
+    with _stats_lock:
+        _stats[f"{kind}_{'hits' if hit else 'misses'}"] += amount
+
+
+# Return the hit/miss counters of this process
+def stats():
+    with _stats_lock:
+        counters = dict(_stats)
+    for kind in ("page", "post", "profile"):
+        hits = counters.setdefault(f"{kind}_hits", 0)
+        misses = counters.setdefault(f"{kind}_misses", 0)
+        counters[f"{kind}_hit_rate"] = round(hits / (hits + misses), 3) if hits + misses else None
+    return counters
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+# Each post is cached once per wire format (see network/wire.py)
+def _post_key(post_id, compact=False):
+    if compact:
+        return f"network:post:compact:{post_id}"
+    return f"network:post:{post_id}"
+
+
+def _serialize(post, compact):
+    return post.serialize_compact() if compact else post.serialize()
+
+
+def _profile_key(user_id):
+    return f"network:profile:{user_id}"
+
+
+def _generation_key(feed):
+    return f"network:feed-generation:{feed}"
+
+
+# Return the current generation of a feed. A missing generation (never set,
+# or evicted) starts from the clock so it cannot match older cached pages
+def _generation(cache, feed):
+    key = _generation_key(feed)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, time.time_ns() // 1000, None)
+        generation = cache.get(key)
+    return generation
+
+
+def feed_name(userID=None):
+    return "all" if userID is None else f"user:{userID}"
+
+
+"""
+CACHED READS
+"""
+# Return (serialized_posts, next_cursor) for a page of a feed.
+# load_page() is called on a miss and returns (posts, next_cursor) from the
+# database; load_posts(ids) returns the Post objects for post IDs whose
+# entries have dropped out of the cache. With compact, the posts are
+# serialized with Post.serialize_compact() instead of Post.serialize().
+def get_feed_page(feed, page, cursor, load_page, load_posts, compact=False):
+    cache = _cache()
+
+    # New posts only ever appear before a cursor, so the pages after a
+    # cursor do not change when the feed's generation is bumped
+    if cursor:
+        page_key = f"network:page:{feed}:cursor:{cursor}"
+    else:
+        generation = _generation(cache, feed)
+        mode = "page" if cursor is None else "first"
+        page_key = f"network:page:{feed}:{generation}:{mode}:{page}"
+
+    cached_page = cache.get(page_key)
+    if cached_page is None:
+        _count("page", hit=False)
+        with replica_reads(False):
+            posts, next_cursor = load_page()
+        with timer("serialize"):
+            serialized_posts = [_serialize(post, compact) for post in posts]
+        cache.set_many({_post_key(post["id"], compact): post for post in serialized_posts}, _timeout())
+        cache.set(
+            page_key,
+            {"ids": [post["id"] for post in serialized_posts], "next_cursor": next_cursor},
+            _timeout(),
+        )
+        return serialized_posts, next_cursor
+
+    _count("page", hit=True)
+    ids = cached_page["ids"]
+    found = cache.get_many([_post_key(post_id, compact) for post_id in ids])
+    missing = [post_id for post_id in ids if _post_key(post_id, compact) not in found]
+    _count("post", hit=True, amount=len(ids) - len(missing))
+    if missing:
+        _count("post", hit=False, amount=len(missing))
+        with replica_reads(False):
+            loaded = {post.id: _serialize(post, compact) for post in load_posts(missing)}
+        cache.set_many({_post_key(post_id, compact): post for post_id, post in loaded.items()}, _timeout())
+        found.update({_post_key(post_id, compact): post for post_id, post in loaded.items()})
+
+    # Posts deleted since the page was cached are left out
+    serialized_posts = [
+        found[_post_key(post_id, compact)] for post_id in ids if _post_key(post_id, compact) in found
+    ]
+    return serialized_posts, cached_page["next_cursor"]
+
+
+# Return the profile header of a user; load_header() is called on a miss
+def get_profile_header(user_id, load_header):
+    cache = _cache()
+    header = cache.get(_profile_key(user_id))
+    if header is None:
+        _count("profile", hit=False)
+        with replica_reads(False):
+            header = load_header()
+        cache.set(_profile_key(user_id), header, _timeout())
+    else:
+        _count("profile", hit=True)
+    return header
+
+
+"""
+INVALIDATION
+"""
+# A post was added to a feed: stop using the cached pages of the all posts
+# feed and of the poster's profile feed
+def feed_changed(poster_id):
+    def bump():
+        cache = _cache()
+        for feed in (feed_name(), feed_name(poster_id)):
+            _generation(cache, feed)
+            try:
+                cache.incr(_generation_key(feed))
+            except ValueError:
+                # evicted in between; a new generation is started on next read
+                pass
+    transaction.on_commit(bump)
+
+
+# A post's body or likes changed: drop its cached entry
+def posts_changed(post_ids):
+    if isinstance(post_ids, int):
+        post_ids = [post_ids]
+    transaction.on_commit(lambda: _cache().delete_many(
+        [_post_key(post_id, compact) for post_id in post_ids for compact in (False, True)]
+    ))
+
+
+# A user's follower or following counts changed: drop their cached headers,
+# and their cached User rows (see network/auth.py)
+def profiles_changed(user_ids):
+    transaction.on_commit(lambda: _cache().delete_many([_profile_key(user_id) for user_id in user_ids]))
+    users_changed(user_ids)
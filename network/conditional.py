@@ -0,0 +1,48 @@
+import hashlib
+
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
+
+from .perf import timer
+from .wire import compact_response
+
+"""
+CONDITIONAL GET HELPER FUNCTIONS
+
+    The feed and profile JSON responses carry an ETag, and a request sending
+    it back (If-None-Match) gets an empty 304 when nothing has changed,
+    skipping JSON encoding and the transfer.
+
+    The ETag is a hash of the response data, which the views build mostly from
+    the feed cache, so a 304 still costs the cache reads and the per-viewer
+    queries of the page. There is no Last-Modified: posts carry no "last
+    changed" time (likes change them too), and a page can go back to an
+    earlier state (a like and an unlike), which a date cannot express.
+
+"""
+def data_etag(data):
+    # repr() of the lists and dicts the views return is deterministic and much
+    # cheaper than encoding them to JSON
+    return hashlib.md5(repr(data).encode()).hexdigest()
+
+
+# Return a JsonResponse of data, or a 304 if the client's copy is current.
+# With compact, data is sent in the compact wire format (see network/wire.py)
+def conditional_json(request, data, compact=False, **kwargs):
+    etag = quote_etag(data_etag(data))
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        with timer("serialize"):
+            if compact:
+                response = compact_response(data)
+            else:
+                response = JsonResponse(data, **kwargs)
+
+    response["ETag"] = etag
+    # The data depends on the logged in user, and must be revalidated on each use
+    patch_cache_control(response, private=True, no_cache=True)
+    # The format can be asked for in the Accept header
+    patch_vary_headers(response, ["Cookie", "Accept"])
+    return response
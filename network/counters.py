@@ -0,0 +1,77 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import User, Post, Follow, Like
+
+REPAIR_BATCH_SIZE = 500
+
+"""
+COUNTER HELPER FUNCTIONS
+
+    Post.likes_count, User.followers_count and User.following_count are stored
+    so the feed and profile pages never have to count the Like and Follow tables.
+
+    The change_* functions apply an atomic F() increment and must be called
+    inside the same transaction as the Like / Follow insert or delete they
+    account for. repair_counters() recomputes everything from the source tables.
+
+"""
+def change_likes_count(post_ids, delta):
+    # post_ids may be a single ID or a list of IDs
+    if isinstance(post_ids, int):
+        post_ids = [post_ids]
+    Post.objects.filter(pk__in=post_ids).update(likes_count=F('likes_count') + delta)
+
+
+def change_follow_counts(follower_id, follows_id, delta):
+    User.objects.filter(pk=follows_id).update(followers_count=F('followers_count') + delta)
+    User.objects.filter(pk=follower_id).update(following_count=F('following_count') + delta)
+
+
+# Build a subquery counting the rows of model that point at the outer row
+def _count_of(model, field):
+    rows = (
+        model.objects.filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+
+# Recompute the stored counters from the Like and Follow tables.
+# post_ids / user_ids restrict the repair to those rows; by default every row
+# is checked. Returns the number of posts and users whose counters had drifted.
+def repair_counters(post_ids=None, user_ids=None):
+    posts = Post.objects.all()
+    if post_ids is not None:
+        posts = posts.filter(pk__in=post_ids)
+    users = User.objects.all()
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+
+    likes = _count_of(Like, 'post')
+    followers = _count_of(Follow, 'follows')
+    following = _count_of(Follow, 'follower')
+
+    drifted_posts = posts.annotate(actual=likes).exclude(likes_count=F('actual'))
+    drifted_users = (
+        users.annotate(actual_followers=followers, actual_following=following)
+        .exclude(followers_count=F('actual_followers'), following_count=F('actual_following'))
+    )
+    drifted_post_ids = list(drifted_posts.values_list('pk', flat=True))
+    drifted_user_ids = list(drifted_users.values_list('pk', flat=True))
+
+    # Repair only the rows that drifted, in batches that stay under the
+    # database's limit on query parameters
+    for start in range(0, len(drifted_post_ids), REPAIR_BATCH_SIZE):
+        batch = drifted_post_ids[start:start + REPAIR_BATCH_SIZE]
+        Post.objects.filter(pk__in=batch).update(likes_count=likes)
+    for start in range(0, len(drifted_user_ids), REPAIR_BATCH_SIZE):
+        batch = drifted_user_ids[start:start + REPAIR_BATCH_SIZE]
+        User.objects.filter(pk__in=batch).update(
+            followers_count=followers, following_count=following
+        )
+
+    return len(drifted_post_ids), len(drifted_user_ids)
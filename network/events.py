@@ -0,0 +1,173 @@
+import asyncio
+import json
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+"""
+LIVE UPDATE EVENTS
+
+    The views publish an event once a write has committed:
+
+    - {"type": "post", "id", "poster_id", "poster"}  a new post
+    - {"type": "likes", "post_id", "delta", "liker_id"}  a post was liked (+1) or unliked (-1)
+    - {"type": "edit", "post_id", "body", "edited_timestamp"}  a post was edited
+
+    and the event stream view (views.live_events) sends them on to the pages that
+    show the feed or the post, as server-sent events.
+
+    The broker is named by NETWORK_EVENT_BROKER. LocalBroker delivers events
+    within this process only, which is enough for a single ASGI server; with
+    several processes, a broker with the same publish()/subscribe() methods
+    over a shared channel (e.g. Redis pub/sub) replaces it. Every subscriber
+    gets every event; filtering is up to the subscriber.
+
+    Who liked a post is not shown anywhere else, so the liker's ID only serves
+    to keep the event from the liker's own pages (which already show the count
+    the like request returned), and is not sent to the browser.
+
+"""
+# How many undelivered events a slow subscriber may have before new ones are dropped
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class Subscription:
+
+    def __init__(self, broker):
+        self.broker = broker
+        # Events arrive from the publishing thread, and are handed to the
+        # subscriber's event loop
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def deliver(self, event):
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = set()
+
+    # Must be called from a coroutine; events are delivered to its event loop
+    def subscribe(self):
+        subscription = Subscription(self)
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    # Safe to call from any thread
+    def publish(self, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.deliver(event)
+            except RuntimeError:
+                # The subscriber's event loop has closed
+                self.unsubscribe(subscription)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(getattr(settings, "NETWORK_EVENT_BROKER", "network.events.LocalBroker"))()
+        return _broker
+
+
+def _publish_on_commit(event):
+    transaction.on_commit(lambda: get_broker().publish(event))
+
+
+def post_created(post):
+    _publish_on_commit({
+        "type": "post",
+        "id": post.id,
+        "poster_id": post.poster_id,
+        "poster": post.poster.username,
+    })
+
+
+def likes_changed(post_id, delta, liker):
+    _publish_on_commit({"type": "likes", "post_id": post_id, "delta": delta, "liker_id": liker.id})
+
+
+def post_edited(post):
+    _publish_on_commit({
+        "type": "edit",
+        "post_id": post.id,
+        "body": post.body,
+        "edited_timestamp": post.edited_timestamp,
+    })
+
+
+"""
+EVENT STREAM
+"""
+# Fields of an event that are only used to filter it, and never sent
+PRIVATE_FIELDS = ("liker_id",)
+
+
+# Decide whether a subscriber showing the given feed and posts wants an event.
+# feed is "all", "following", "trending" or "search" (no new posts) or
+# "user:<id>"; followed is the set of user IDs the viewer follows (only needed
+# for the following feed), and user_id the viewer's own ID
+def wants_event(event, feed, post_ids, followed=frozenset(), user_id=None):
+    if event["type"] == "post":
+        if feed == "all":
+            return True
+        if feed == "following":
+            return event["poster_id"] in followed
+        return feed == f"user:{event['poster_id']}"
+    if user_id is not None and event.get("liker_id") == user_id:
+        return False
+    return event["post_id"] in post_ids
+
+
+def format_event(event):
+    data = json.dumps(
+        {name: value for name, value in event.items() if name not in PRIVATE_FIELDS}, cls=DjangoJSONEncoder
+    )
+    return f"event: {event['type']}\ndata: {data}\n\n"
+
+
+# Yield the server-sent events a subscriber wants, with a comment line every
+# heartbeat seconds so proxies keep the connection open
+async def event_stream(subscription, feed, post_ids, followed=frozenset(), user_id=None, heartbeat=15):
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if wants_event(event, feed, post_ids, followed, user_id):
+                yield format_event(event)
+    finally:
+        subscription.close()
@@ -0,0 +1,155 @@
+import heapq
+import math
+from array import array
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Follow, Suggestion
+
+"""
+FOLLOW GRAPH AND "WHO TO FOLLOW" SUGGESTIONS
+
+    FollowGraph holds Follow edges in compressed sparse row (CSR) form: the
+    users are numbered 0..n-1 in ID order, and the users node i follows are
+    out_targets[out_offsets[i]:out_offsets[i + 1]] (in_offsets/in_targets
+    hold the followers the same way). Everything is in flat integer arrays,
+    a few bytes per edge, which NumPy can also wrap without copying.
+
+    A user's suggestions are the users followed by the users they follow
+    (friends of friends), scored Adamic-Adar style: each followee adds
+    1 / log2(2 + its out-degree), so a followee who follows few people counts
+    for more than one who follows everyone. Users who follow them back get
+    FOLLOWS_YOU_WEIGHT on top. The best NETWORK_SUGGESTIONS_PER_USER are
+    stored as Suggestion rows and served from there.
+
+    - refresh_all() loads the whole graph and recomputes every user's
+      suggestions in batches (the refresh_suggestions command)
+    - refresh_users() recomputes a few users' suggestions from the part of
+      the graph around them; follows and unfollows queue it for the follower
+      (see network/jobs.py). The friends-of-friends of the follower's own
+      followers change too, and are only caught up by refresh_all().
+
+"""
+FOLLOWS_YOU_WEIGHT = 1.0
+
+# Followees following more users than this are not expanded, which bounds the
+# work per user; they follow too many people for a follow to mean much
+MAX_EXPANDED_DEGREE = 5000
+
+REFRESH_BATCH_SIZE = 500
+
+
+def suggestions_per_user():
+    return getattr(settings, "NETWORK_SUGGESTIONS_PER_USER", 10)
+
+
+class FollowGraph:
+
+    def __init__(self, edges):
+        edges = list(edges)
+        ids = sorted({follower for follower, _ in edges} | {follows for _, follows in edges})
+        self.ids = array("q", ids)
+        self.index = {user_id: node for node, user_id in enumerate(ids)}
+        pairs = [(self.index[follower], self.index[follows]) for follower, follows in edges]
+        self.out_offsets, self.out_targets = self._csr(pairs, len(ids))
+        self.in_offsets, self.in_targets = self._csr([(b, a) for a, b in pairs], len(ids))
+
+    @staticmethod
+    def _csr(pairs, size):
+        pairs.sort()
+        offsets = array("q", [0]) * (size + 1)
+        for source, _ in pairs:
+            offsets[source + 1] += 1
+        for node in range(size):
+            offsets[node + 1] += offsets[node]
+        return offsets, array("q", (target for _, target in pairs))
+
+    # The whole graph
+    @classmethod
+    def load(cls):
+        return cls(Follow.objects.values_list("follower", "follows").iterator(chunk_size=10000))
+
+    # Just the edges the suggestions of user_ids depend on: who they follow,
+    # who those users follow, and who follows them
+    @classmethod
+    def around(cls, user_ids):
+        edges = set(Follow.objects.filter(follower__in=user_ids).values_list("follower", "follows"))
+        followees = {follows for _, follows in edges}
+        edges.update(Follow.objects.filter(follower__in=followees).values_list("follower", "follows"))
+        edges.update(Follow.objects.filter(follows__in=user_ids).values_list("follower", "follows"))
+        return cls(edges)
+
+    def following(self, node):
+        return self.out_targets[self.out_offsets[node]:self.out_offsets[node + 1]]
+
+    def followers(self, node):
+        return self.in_targets[self.in_offsets[node]:self.in_offsets[node + 1]]
+
+    def out_degree(self, node):
+        return self.out_offsets[node + 1] - self.out_offsets[node]
+
+    # Return [(suggested_id, score, mutuals, follows_you)] for a user, best first
+    def suggestions(self, user_id, limit):
+        node = self.index.get(user_id)
+        if node is None:
+            return []
+        following = set(self.following(node))
+        scores = defaultdict(float)
+        mutuals = Counter()
+
+        for followee in following:
+            degree = self.out_degree(followee)
+            if degree > MAX_EXPANDED_DEGREE:
+                continue
+            weight = 1 / math.log2(2 + degree)
+            for candidate in self.following(followee):
+                if candidate != node and candidate not in following:
+                    scores[candidate] += weight
+                    mutuals[candidate] += 1
+
+        followers = set(self.followers(node)) - following
+        for candidate in followers:
+            scores[candidate] += FOLLOWS_YOU_WEIGHT
+
+        # Ties go to the lower ID, so the results are repeatable
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [
+            (self.ids[candidate], round(score, 6), mutuals[candidate], candidate in followers)
+            for candidate, score in best
+        ]
+
+
+# Replace the stored suggestions of user_ids with the ones computed from graph
+def save_suggestions(graph, user_ids):
+    limit = suggestions_per_user()
+    rows = [
+        Suggestion(user_id=user_id, suggested_id=suggested, score=score, mutuals=mutuals, follows_you=follows_you)
+        for user_id in user_ids
+        for suggested, score, mutuals, follows_you in graph.suggestions(user_id, limit)
+    ]
+    with transaction.atomic():
+        Suggestion.objects.filter(user__in=user_ids).delete()
+        Suggestion.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def refresh_users(user_ids):
+    user_ids = sorted(set(user_ids))
+    return save_suggestions(FollowGraph.around(user_ids), user_ids)
+
+
+# Recompute every user's suggestions; returns (users, suggestions)
+def refresh_all(log=None):
+    graph = FollowGraph.load()
+    saved = 0
+    for start in range(0, len(graph.ids), REFRESH_BATCH_SIZE):
+        saved += save_suggestions(graph, list(graph.ids[start:start + REFRESH_BATCH_SIZE]))
+        if log:
+            log(f"{min(start + REFRESH_BATCH_SIZE, len(graph.ids))}/{len(graph.ids)} users done")
+    # Users no longer in any follow have nothing to be suggested from
+    Suggestion.objects.exclude(user__in=Follow.objects.values("follower")).exclude(
+        user__in=Follow.objects.values("follows")
+    ).delete()
+    return len(graph.ids), saved
@@ -0,0 +1,281 @@
+import logging
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Min, Count, Q
+from django.utils import timezone
+
+from .models import User, Post, Follow, Job
+from .timeline import fan_out_post, backfill_timeline, remove_from_timeline
+from .graph import refresh_users
+
+logger = logging.getLogger(__name__)
+
+"""
+BACKGROUND JOBS
+
+    Writes hand their slow side effects, such as writing a new post into every
+    follower's timeline, to jobs, so the request only pays for inserting a Job
+    row in its own transaction:
+
+        enqueue("fan_out_post", post=post.id)
+
+    The jobs are run once the transaction commits, according to NETWORK_JOB_MODE:
+
+    - "inline": right after the commit, in the thread that committed (tests)
+    - "thread": by a pool of NETWORK_JOB_THREADS threads in this process (development)
+    - "worker": by the run_jobs command, in separate processes (production)
+
+    A runner claims up to NETWORK_JOB_BATCH_SIZE due jobs at a time, oldest
+    first, and hands consecutive jobs of the same kind to their handler as one
+    batch. A claim expires after NETWORK_JOB_LEASE_SECONDS, so the jobs of a
+    runner that died are picked up again. A batch that raises is retried
+    with exponential backoff, up to NETWORK_JOB_MAX_ATTEMPTS times, and then
+    kept with failed set.
+
+    Jobs can run more than once and out of order with other jobs, so handlers
+    must be idempotent and check that their work is still wanted.
+
+    stats() reports the queue depth and lag, and this process' counters.
+
+"""
+HANDLERS = {}
+
+
+def handler(kind):
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+def job_mode():
+    return getattr(settings, "NETWORK_JOB_MODE", "inline")
+
+
+def batch_size():
+    return getattr(settings, "NETWORK_JOB_BATCH_SIZE", 100)
+
+
+# Add jobs of one kind, each with its own payload, to the queue in the current
+# transaction; they run once it commits
+def enqueue_many(kind, payloads):
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind!r}.")
+    now = timezone.now()
+    jobs = Job.objects.bulk_create([Job(kind=kind, payload=payload, run_after=now) for payload in payloads])
+    ids = [job.id for job in jobs]
+    if ids:
+        # The write has committed whatever happens to its jobs; jobs that
+        # cannot be run now stay queued
+        transaction.on_commit(lambda: dispatch(ids), robust=True)
+    return ids
+
+
+def enqueue(kind, **payload):
+    return enqueue_many(kind, [payload])[0]
+
+
+def dispatch(ids):
+    mode = job_mode()
+    if mode == "inline":
+        run_jobs(ids)
+    elif mode == "thread":
+        get_runner().wake()
+
+
+"""
+RUNNING JOBS
+"""
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(**amounts):
+    with _stats_lock:
+        _stats.update(amounts)
+
+
+# Claim up to limit due jobs (or only the given ones) for one runner, and
+# return them oldest first. The claim is a single UPDATE, so two runners
+# never both get a job while its claim holds.
+def claim_jobs(limit=None, ids=None):
+    now = timezone.now()
+    lease = timedelta(seconds=getattr(settings, "NETWORK_JOB_LEASE_SECONDS", 60))
+    unclaimed = Q(claimed_until__isnull=True) | Q(claimed_until__lt=now)
+    due = Job.objects.filter(unclaimed, failed=False, run_after__lte=now)
+    if ids is not None:
+        due = due.filter(id__in=ids)
+    due_ids = list(due.order_by("run_after", "id").values_list("id", flat=True)[:limit or batch_size()])
+    if not due_ids:
+        return []
+
+    token = uuid.uuid4().hex
+    Job.objects.filter(unclaimed, id__in=due_ids).update(claimed_by=token, claimed_until=now + lease)
+    return list(Job.objects.filter(claimed_by=token).order_by("run_after", "id"))
+
+
+def _record_failure(jobs, error):
+    max_attempts = getattr(settings, "NETWORK_JOB_MAX_ATTEMPTS", 5)
+    now = timezone.now()
+    for job in jobs:
+        job.attempts += 1
+        job.failed = job.attempts >= max_attempts
+        job.run_after = now + timedelta(seconds=2 ** job.attempts)
+        job.claimed_by = ""
+        job.claimed_until = None
+        job.last_error = error
+    Job.objects.bulk_update(jobs, ["attempts", "failed", "run_after", "claimed_by", "claimed_until", "last_error"])
+    dead = sum(job.failed for job in jobs)
+    _count(failures=len(jobs), retries=len(jobs) - dead, dead=dead)
+
+
+# Run claimed jobs, a batch per run of consecutive jobs of one kind
+def run_claimed(jobs):
+    for kind, batch in groupby(jobs, key=lambda job: job.kind):
+        batch = list(batch)
+        start = time.perf_counter()
+        try:
+            if kind not in HANDLERS:
+                raise LookupError(f"No handler for job kind {kind!r}.")
+            with transaction.atomic():
+                HANDLERS[kind]([job.payload for job in batch])
+                Job.objects.filter(id__in=[job.id for job in batch]).delete()
+        except Exception as e:
+            logger.exception("%s job(s) of kind %s failed", len(batch), kind)
+            _record_failure(batch, f"{type(e).__name__}: {e}")
+        else:
+            _count(runs=len(batch), batches=1, run_ms=round((time.perf_counter() - start) * 1000, 3))
+    return len(jobs)
+
+
+# Run the given jobs, or up to limit due jobs; returns how many were run
+def run_jobs(ids=None, limit=None):
+    return run_claimed(claim_jobs(limit, ids))
+
+
+# Run due jobs until none are left
+def run_pending(limit=None):
+    total = 0
+    while True:
+        ran = run_jobs(limit=limit)
+        if not ran:
+            return total
+        total += ran
+
+
+class ThreadRunner:
+
+    def __init__(self, threads, poll_interval=5):
+        self.wake_event = threading.Event()
+        self.poll_interval = poll_interval
+        self.threads = [
+            threading.Thread(target=self.loop, name=f"network-jobs-{number}", daemon=True)
+            for number in range(threads)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def wake(self):
+        self.wake_event.set()
+
+    def loop(self):
+        while True:
+            # Also poll now and then for retries that have come due
+            self.wake_event.wait(self.poll_interval)
+            self.wake_event.clear()
+            try:
+                run_pending()
+            except Exception:
+                logger.exception("Running jobs failed")
+            finally:
+                connections.close_all()
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = ThreadRunner(getattr(settings, "NETWORK_JOB_THREADS", 2))
+        return _runner
+
+
+# The queue depth and lag, and the counters of the jobs this process ran
+def stats():
+    now = timezone.now()
+    queued = Job.objects.filter(failed=False)
+    due = queued.filter(run_after__lte=now).aggregate(count=Count("id"), oldest=Min("run_after"))
+    with _stats_lock:
+        counters = dict(_stats)
+    runs = counters.get("runs", 0)
+    return {
+        "queued": queued.count(),
+        "due": due["count"],
+        # How long the oldest due job has been waiting
+        "lag_s": round((now - due["oldest"]).total_seconds(), 3) if due["oldest"] else 0,
+        "failed": Job.objects.filter(failed=True).count(),
+        "queued_by_kind": dict(queued.values_list("kind").annotate(Count("id")).order_by("kind")),
+        **counters,
+        "avg_run_ms": round(counters.get("run_ms", 0) / runs, 3) if runs else None,
+    }
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+"""
+JOB HANDLERS
+
+    Each takes the payloads of a batch of jobs of its kind.
+"""
+@handler("fan_out_post")
+def fan_out_posts(payloads):
+    posts = Post.objects.select_related("poster").filter(id__in={payload["post"] for payload in payloads})
+    for post in posts.order_by("id"):
+        fan_out_post(post)
+
+
+# Unfollowing can overtake a backfill, so only users still followed are backfilled
+@handler("backfill_timeline")
+def backfill_timelines(payloads):
+    pairs = {(payload["owner"], payload["followed"]) for payload in payloads}
+    still_following = set(
+        Follow.objects.filter(
+            follower__in={owner for owner, _ in pairs}, follows__in={followed for _, followed in pairs}
+        ).values_list("follower", "follows")
+    )
+    followed_users = User.objects.in_bulk({followed for _, followed in pairs & still_following})
+    for owner, followed in sorted(pairs & still_following):
+        backfill_timeline(owner, followed_users[followed])
+
+
+# ... and following again can overtake a removal
+@handler("remove_from_timeline")
+def remove_from_timelines(payloads):
+    unfollowed = defaultdict(set)
+    for payload in payloads:
+        unfollowed[payload["owner"]].add(payload["unfollowed"])
+    for owner, user_ids in unfollowed.items():
+        followed_again = set(
+            Follow.objects.filter(follower=owner, follows__in=user_ids).values_list("follows", flat=True)
+        )
+        if user_ids - followed_again:
+            remove_from_timeline(owner, sorted(user_ids - followed_again))
+
+
+# A user's follows changed; recompute their suggestions once per batch
+@handler("refresh_suggestions")
+def refresh_suggestions(payloads):
+    refresh_users({payload["user"] for payload in payloads})
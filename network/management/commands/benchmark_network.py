@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.test.utils import override_settings
+
+from network.benchmark import Benchmark, format_results, load_results, save_results
+
+
+class Command(BaseCommand):
+    help = "Measure latency percentiles and query counts of the network endpoints."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=50, help="Rounds of requests per endpoint.")
+        parser.add_argument("--viewers", type=int, default=20, help="How many users to log in as.")
+        parser.add_argument("--cold", action="store_true", help="Clear the cache before every request.")
+        parser.add_argument("--seed", type=int, help="Random seed, for repeatable runs.")
+        parser.add_argument("--save", help="Write the results to this JSON file.")
+        parser.add_argument("--compare", help="Show the change from results saved with --save.")
+
+    def handle(self, *args, **options):
+        benchmark = Benchmark(
+            requests=options["requests"],
+            viewers=options["viewers"],
+            cold=options["cold"],
+            seed=options["seed"],
+            log=self.stderr.write,
+        )
+        try:
+            # Let the test client's requests through ALLOWED_HOSTS
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+                results = benchmark.run()
+        except ValueError as e:
+            raise CommandError(e)
+
+        baseline = load_results(options["compare"]) if options["compare"] else None
+        self.stdout.write(format_results(results, baseline))
+        if options["save"]:
+            save_results(results, options["save"])
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from network.transfer import DEFAULT_CHUNK_SIZE, export_data, open_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the users, posts, follows and likes to an NDJSON file, gzip compressed "
+        "if its name ends in .gz, for import_network."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="The file to write.")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                            help="Rows read from the database at a time.")
+
+    def handle(self, *args, **options):
+        with open_file(options["path"], "wb") as output:
+            counts = export_data(output, options["chunk_size"], log=self.stderr.write)
+        self.stdout.write(self.style.SUCCESS(
+            "Exported " + ", ".join(f"{count} {kind}(s)" for kind, count in counts.items()) + "."
+        ))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from network.transfer import DEFAULT_BATCH_SIZE, InvalidExport, import_data, open_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Add the users, posts, follows and likes of a file written by export_network "
+        "to this database, in one transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="The file to read; gzip compressed if its name ends in .gz.")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                            help="Rows inserted at a time.")
+        parser.add_argument("--skip-timelines", action="store_true",
+                            help="Do not build the Following feed timelines.")
+
+    def handle(self, *args, **options):
+        try:
+            with open_file(options["path"], "rb") as input:
+                importer = import_data(
+                    input, options["batch_size"], timelines=not options["skip_timelines"], log=self.stderr.write
+                )
+        except (OSError, InvalidExport) as e:
+            raise CommandError(e)
+
+        counts = importer.progress.counts
+        rate = sum(counts.values()) / importer.progress.elapsed()
+        self.stdout.write(self.style.SUCCESS(
+            "Imported " + ", ".join(f"{count} {kind}(s)" for kind, count in counts.items())
+            + f" in {importer.progress.elapsed():.1f}s ({rate:.0f} rows/s); {importer.matched} user(s) "
+            f"already existed, {importer.skipped} row(s) referred to rows not in the file and "
+            f"{importer.duplicates} follow(s) and like(s) were already there. "
+            "Run refresh_suggestions to update the suggestions."
+        ))
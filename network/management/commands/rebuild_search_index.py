@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from network.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Recreate the post search index and its triggers if missing, and reindex every post."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--optimize", action="store_true",
+                            help="Merge the index into a single segment afterwards.")
+
+    def handle(self, *args, **options):
+        indexed = rebuild_index(optimize=options["optimize"])
+        self.stdout.write(f"Indexed {indexed} posts.")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from network.models import User
+from network.timeline import rebuild_timeline
+
+
+class Command(BaseCommand):
+    help = "Rebuild every user's Following feed timeline from the Follow table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", help="Only rebuild these user IDs.")
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(following_count__gt=0)
+        if options["user"]:
+            users = User.objects.filter(pk__in=options["user"])
+
+        rebuilt = 0
+        for user in users.iterator():
+            rebuild_timeline(user)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} timeline(s)."))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from network.graph import refresh_all, refresh_users
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the \"who to follow\" suggestions from the follow graph. Follows "
+        "refresh the follower's own suggestions; run this regularly to catch up the rest."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", help="Only refresh these user IDs.")
+
+    def handle(self, *args, **options):
+        if options["user"]:
+            saved = refresh_users(options["user"])
+            users = len(options["user"])
+        else:
+            users, saved = refresh_all(log=self.stderr.write)
+        self.stdout.write(self.style.SUCCESS(f"Stored {saved} suggestion(s) for {users} user(s)."))
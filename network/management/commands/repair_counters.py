@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from network.counters import repair_counters
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored like and follower counters and repair any drift."
+
+    def handle(self, *args, **options):
+        posts, users = repair_counters()
+        self.stdout.write(
+            self.style.SUCCESS(f"Repaired counters on {posts} post(s) and {users} user(s).")
+        )
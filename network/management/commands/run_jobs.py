@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from network.jobs import run_jobs, stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the background jobs queued by the web processes (NETWORK_JOB_MODE=worker). "
+        "Several workers can run at once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Run the due jobs, then exit.")
+        parser.add_argument("--batch-size", type=int, help="Jobs to claim at a time (default NETWORK_JOB_BATCH_SIZE).")
+        parser.add_argument("--interval", type=float, default=1.0,
+                            help="Seconds to wait when no jobs are due.")
+        parser.add_argument("--stats-every", type=float, default=60.0,
+                            help="Print the queue stats every this many seconds.")
+
+    def handle(self, *args, **options):
+        ran = 0
+        last_stats = time.monotonic()
+        while True:
+            close_old_connections()
+            count = run_jobs(limit=options["batch_size"])
+            ran += count
+            if not count:
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+            if time.monotonic() - last_stats >= options["stats_every"]:
+                self.print_stats()
+                last_stats = time.monotonic()
+        self.stdout.write(f"Ran {ran} job(s).")
+        self.print_stats()
+
+    def print_stats(self):
+        queue = stats()
+        self.stdout.write(
+            f"queued={queue['queued']} due={queue['due']} lag={queue['lag_s']}s failed={queue['failed']} "
+            f"runs={queue.get('runs', 0)} failures={queue.get('failures', 0)} avg_run_ms={queue['avg_run_ms']}"
+        )
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from network.seed import DEFAULT_BATCH_SIZE, Seeder
+
+
+class Command(BaseCommand):
+    help = "Bulk-generate users, follows, posts and likes with a realistic social graph."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--posts", type=int, default=10000)
+        parser.add_argument("--likes", type=int, default=100000)
+        parser.add_argument("--follows-per-user", type=int, default=20,
+                            help="Typical number of accounts each user follows.")
+        parser.add_argument("--days", type=int, default=30, help="How far back posts go.")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument("--prefix", default="seed", help="Prefix of the generated usernames.")
+        parser.add_argument("--seed", type=int, help="Random seed, for repeatable data.")
+        parser.add_argument("--skip-timelines", action="store_true",
+                            help="Do not build the Following feed timelines.")
+
+    def handle(self, *args, **options):
+        seeder = Seeder(
+            users=options["users"],
+            posts=options["posts"],
+            likes=options["likes"],
+            follows_per_user=options["follows_per_user"],
+            days=options["days"],
+            batch_size=options["batch_size"],
+            prefix=options["prefix"],
+            seed=options["seed"],
+            log=self.stdout.write,
+        )
+        try:
+            with transaction.atomic():
+                seeder.run(timelines=not options["skip_timelines"])
+        except ValueError as e:
+            raise CommandError(e)
+        self.stdout.write(self.style.SUCCESS("Seeding done."))
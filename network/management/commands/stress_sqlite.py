@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from network.stress import StressTest, compare_modes
+
+
+class Command(BaseCommand):
+    help = "Run concurrent writers and readers against the database and report throughput and lock errors."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--writers", type=int, default=8, help="Writer threads.")
+        parser.add_argument("--readers", type=int, default=4, help="Reader threads.")
+        parser.add_argument("--seconds", type=float, default=5, help="How long to run for.")
+        parser.add_argument("--seed", type=int, help="Random seed, for repeatable runs.")
+        parser.add_argument("--compare", action="store_true",
+                            help="Run with the production SQLite pragmas off and then on, and show both.")
+
+    def handle(self, *args, **options):
+        stress_options = {
+            "writers": options["writers"],
+            "readers": options["readers"],
+            "seconds": options["seconds"],
+            "seed": options["seed"],
+        }
+        try:
+            if options["compare"]:
+                results = compare_modes(**stress_options)
+            else:
+                results = {"": StressTest(**stress_options).run()}
+        except ValueError as e:
+            raise CommandError(e)
+        runs = list(results.values())
+        for name in runs[0]:
+            self.stdout.write(f"{name:<22}" + "".join(f"{str(run[name]):>14}" for run in runs))
@@ -0,0 +1,44 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from network.routers import PRIMARY, replica_aliases
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database over the replica files, standing in "
+        "for replication when trying out read replicas locally."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float,
+                            help="Keep copying every this many seconds, to simulate replication lag.")
+
+    def handle(self, *args, **options):
+        primary = connections[PRIMARY].settings_dict
+        # The read-only alias of the production mode is the primary's own file
+        replicas = [
+            connections[alias].settings_dict["NAME"] for alias in replica_aliases()
+            if not connections[alias].settings_dict.get("OPTIONS", {}).get("uri")
+        ]
+        if primary["ENGINE"] != "django.db.backends.sqlite3" or not replicas:
+            raise CommandError("Set NETWORK_REPLICA_PATHS to the SQLite files to copy the primary to.")
+
+        while True:
+            source = sqlite3.connect(primary["NAME"])
+            try:
+                for path in replicas:
+                    target = sqlite3.connect(path)
+                    try:
+                        source.backup(target)
+                    finally:
+                        target.close()
+            finally:
+                source.close()
+            self.stdout.write(f"Copied the primary to {len(replicas)} replica(s).")
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
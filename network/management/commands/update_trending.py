@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from network.trending import rebuild, redecay
+
+
+class Command(BaseCommand):
+    help = (
+        "Decay the trending scores to now, drop the posts that have left the trending "
+        "window and score the new ones. Run it regularly, e.g. hourly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild", action="store_true", help="Rescore every recent post from its likes counter."
+        )
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            posts = rebuild()
+            self.stdout.write(self.style.SUCCESS(f"Scored {posts} recent post(s)."))
+            return
+        rescaled, dropped, added = redecay()
+        self.stdout.write(self.style.SUCCESS(
+            f"Decayed {rescaled} score(s), dropped {dropped} old post(s) and scored {added} new one(s)."
+        ))
@@ -0,0 +1,120 @@
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .perf import RequestProfile, aggregate, profiling
+from .ratelimit import SAFE_METHODS, check, configured_limits
+from .routers import replica_aliases, replica_reads
+
+"""
+PERFORMANCE MIDDLEWARE
+
+    Profiles a sample of requests (NETWORK_PERF_SAMPLE_RATE, from 0 to 1): their
+    wall time, database query count and time, serialization time and response
+    size. Profiled responses get a Server-Timing header and are added to the
+    rolling aggregate in network/perf.py.
+
+    Turned on with NETWORK_PERF_ENABLED; when off, Django drops the middleware
+    entirely. Unsampled requests cost one random number.
+
+"""
+class PerformanceMiddleware:
+
+    def __init__(self, get_response):
+        if not getattr(settings, "NETWORK_PERF_ENABLED", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, "NETWORK_PERF_SAMPLE_RATE", 1.0)
+        self.slow_ms = getattr(settings, "NETWORK_PERF_SLOW_MS", 500)
+        self.server_timing = getattr(settings, "NETWORK_PERF_SERVER_TIMING", True)
+
+    def __call__(self, request):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        with ExitStack() as stack:
+            stack.enter_context(profiling(profile))
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(profile.record_query))
+            response = self.get_response(request)
+        profile.finish()
+
+        url_name = request.resolver_match.url_name if request.resolver_match else None
+        size = len(response.content) if not response.streaming else 0
+        aggregate.add(url_name, profile, size)
+        if profile.total_ms >= self.slow_ms:
+            aggregate.add_slow(request.path, url_name, profile)
+
+        if self.server_timing:
+            response["Server-Timing"] = profile.server_timing()
+        return response
+
+
+"""
+REPLICA ROUTING MIDDLEWARE
+
+    Lets the reads of GET and HEAD requests go to the read replicas (see
+    network/routers.py), unless the browser wrote something in the last
+    NETWORK_REPLICA_STICKY_SECONDS. Any other request reads from the primary,
+    and starts that window again, so the user reads their own writes.
+
+"""
+STICKY_COOKIE = "network_primary_until"
+
+
+class ReplicaRoutingMiddleware:
+
+    def __init__(self, get_response):
+        if not replica_aliases():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sticky_seconds = getattr(settings, "NETWORK_REPLICA_STICKY_SECONDS", 5)
+
+    def sticky(self, request):
+        try:
+            return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def __call__(self, request):
+        safe = request.method in ("GET", "HEAD")
+        with replica_reads(safe and not self.sticky(request)):
+            response = self.get_response(request)
+
+        if not safe:
+            until = time.time() + self.sticky_seconds
+            response.set_cookie(
+                STICKY_COOKIE, f"{until:.3f}", max_age=self.sticky_seconds, httponly=True, samesite="Lax"
+            )
+        return response
+
+
+"""
+RATE LIMIT MIDDLEWARE
+
+    Applies NETWORK_RATE_LIMITS (see network/ratelimit.py) to the write
+    requests of the views it names. Reads cost a method check; Django drops the
+    middleware entirely when no limits are set.
+
+"""
+class RateLimitMiddleware:
+
+    def __init__(self, get_response):
+        if not configured_limits():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method in SAFE_METHODS or getattr(view_func, "rate_limited", False):
+            return None
+        name = request.resolver_match.url_name
+        limit = configured_limits().get(name)
+        return check(name, limit, request) if limit else None
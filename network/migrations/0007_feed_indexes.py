@@ -0,0 +1,65 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:40
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, field):
+    rows = (
+        model.objects.filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+
+def remove_duplicates(apps, schema_editor):
+    # Keep the oldest row of any duplicated like or follow so the unique
+    # constraints can be added, then recount the counters they affect
+    User = apps.get_model('network', 'User')
+    Post = apps.get_model('network', 'Post')
+    Follow = apps.get_model('network', 'Follow')
+    Like = apps.get_model('network', 'Like')
+
+    kept_likes = Like.objects.values('liker', 'post').annotate(keep=Min('id')).values('keep')
+    kept_follows = Follow.objects.values('follower', 'follows').annotate(keep=Min('id')).values('keep')
+    removed_likes = Like.objects.exclude(id__in=kept_likes).delete()[0]
+    removed_follows = Follow.objects.exclude(id__in=kept_follows).delete()[0]
+
+    if removed_likes:
+        Post.objects.update(likes_count=count_of(Like, 'post'))
+    if removed_follows:
+        User.objects.update(
+            followers_count=count_of(Follow, 'follows'),
+            following_count=count_of(Follow, 'follower'),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('network', '0006_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-timestamp', '-id'], name='post_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['poster', '-timestamp', '-id'], name='post_poster_feed_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('follower', 'follows'), name='unique_follow'),
+        ),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(fields=('liker', 'post'), name='unique_like'),
+        ),
+    ]
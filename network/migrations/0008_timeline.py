@@ -0,0 +1,52 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_timelines(apps, schema_editor):
+    # Give every follower the recent posts of the users they follow, as
+    # network.timeline would have written them
+    Post = apps.get_model('network', 'Post')
+    Follow = apps.get_model('network', 'Follow')
+    TimelineEntry = apps.get_model('network', 'TimelineEntry')
+    threshold = getattr(settings, 'NETWORK_FANOUT_THRESHOLD', 1000)
+    length = getattr(settings, 'NETWORK_TIMELINE_LENGTH', 800)
+
+    follows = Follow.objects.filter(follows__followers_count__lte=threshold)
+    for follower_id, follows_id in follows.values_list('follower', 'follows').iterator():
+        recent_posts = (
+            Post.objects.filter(poster=follows_id)
+            .order_by('-timestamp', '-id')
+            .values_list('id', 'timestamp')[:length]
+        )
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(owner_id=follower_id, post_id=post_id, timestamp=timestamp)
+             for post_id, timestamp in recent_posts],
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('network', '0007_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='network.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', '-timestamp', '-post'], name='timeline_owner_idx')],
+                'constraints': [models.UniqueConstraint(fields=('owner', 'post'), name='unique_timeline_entry')],
+            },
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.5
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('network', '0008_timeline'),
+    ]
+
+    # An external content FTS5 index of Post.body, kept up to date by triggers
+    # (see network/search.py)
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "CREATE VIRTUAL TABLE network_post_fts USING fts5("
+                "body, content='network_post', content_rowid='id', "
+                "tokenize='porter unicode61 remove_diacritics 2')",
+                "CREATE TRIGGER network_post_fts_insert AFTER INSERT ON network_post BEGIN "
+                "INSERT INTO network_post_fts(rowid, body) VALUES (new.id, new.body); END",
+                "CREATE TRIGGER network_post_fts_delete AFTER DELETE ON network_post BEGIN "
+                "INSERT INTO network_post_fts(network_post_fts, rowid, body) VALUES ('delete', old.id, old.body); END",
+                "CREATE TRIGGER network_post_fts_update AFTER UPDATE OF body ON network_post BEGIN "
+                "INSERT INTO network_post_fts(network_post_fts, rowid, body) VALUES ('delete', old.id, old.body); "
+                "INSERT INTO network_post_fts(rowid, body) VALUES (new.id, new.body); END",
+                "INSERT INTO network_post_fts(network_post_fts) VALUES ('rebuild')",
+            ],
+            reverse_sql=[
+                "DROP TRIGGER IF EXISTS network_post_fts_update",
+                "DROP TRIGGER IF EXISTS network_post_fts_delete",
+                "DROP TRIGGER IF EXISTS network_post_fts_insert",
+                "DROP TABLE IF EXISTS network_post_fts",
+            ],
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.5 on 2026-10-18 22:10
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_trending(apps, schema_editor):
+    # Start the epoch now and score the recent posts, counting their likes as
+    # given with the post, as network.trending.rebuild does
+    Post = apps.get_model('network', 'Post')
+    TrendingScore = apps.get_model('network', 'TrendingScore')
+    TrendingEpoch = apps.get_model('network', 'TrendingEpoch')
+    half_life = getattr(settings, 'NETWORK_TRENDING_HALF_LIFE_HOURS', 6) * 3600
+    window = timedelta(hours=getattr(settings, 'NETWORK_TRENDING_WINDOW_HOURS', 72))
+
+    epoch = timezone.now()
+    TrendingEpoch.objects.create(pk=1, epoch=epoch)
+    recent_posts = Post.objects.filter(timestamp__gte=epoch - window).values_list('id', 'timestamp', 'likes_count')
+    TrendingScore.objects.bulk_create(
+        [TrendingScore(post_id=post_id, score=(1 + likes) * 2 ** ((timestamp - epoch).total_seconds() / half_life))
+         for post_id, timestamp, likes in recent_posts.iterator()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('network', '0011_suggestions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingEpoch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('epoch', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending', serialize=False, to='network.post')),
+                ('score', models.FloatField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-score', '-post'], name='trending_score_idx')],
+            },
+        ),
+        migrations.RunPython(fill_trending, migrations.RunPython.noop),
+    ]
@@ -2,8 +2,14 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 
+def epoch_ms(moment):
+    return int(moment.timestamp() * 1000)
+
+
 class User(AbstractUser):
-    pass
+    # Stored counters, kept in step with the Follow table by network.counters
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
 
 
 class Post(models.Model):
@@ -12,6 +18,16 @@ class Post(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     edited = models.BooleanField(default=False)
     edited_timestamp = models.DateTimeField(blank=True, null=True)
+    # Stored counter, kept in step with the Like table by network.counters
+    likes_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # the all posts feed, newest first
+            models.Index(fields=["-timestamp", "-id"], name="post_feed_idx"),
+            # the profile and following feeds, newest first per poster
+            models.Index(fields=["poster", "-timestamp", "-id"], name="post_poster_feed_idx"),
+        ]
 
     def serialize(self):
         return {
@@ -22,18 +38,133 @@ class Post(models.Model):
             "timestamp": self.timestamp.strftime("%b %d %Y, %I:%M %p"),
             "edited": self.edited,
             "edited_timestamp": self.edited_timestamp.strftime("%b %d %Y, %I:%M %p") if self.edited_timestamp else None,
+            "likes_count": self.likes_count,
+        }
+
+    # The post in the compact wire format (see network/wire.py): epoch
+    # milliseconds, the poster by ID, and fields at their default left out.
+    # "name" is moved into the response's user table by network.wire.
+    def serialize_compact(self):
+        post = {
+            "id": self.id,
+            "user": self.poster_id,
+            "name": self.poster.username,
+            "body": self.body,
+            "ts": epoch_ms(self.timestamp),
         }
+        if self.edited and self.edited_timestamp:
+            post["edited_ts"] = epoch_ms(self.edited_timestamp)
+        if self.likes_count:
+            post["likes"] = self.likes_count
+        return post
     
 class Follow(models.Model):
     follower = models.ForeignKey("User", on_delete=models.CASCADE, related_name="following")
     follows = models.ForeignKey("User", on_delete=models.CASCADE, related_name="followers")
+
+    class Meta:
+        constraints = [
+            # also serves the "who does this user follow" lookups
+            models.UniqueConstraint(fields=["follower", "follows"], name="unique_follow"),
+        ]
     
 class Like(models.Model):
     liker = models.ForeignKey("User", on_delete=models.CASCADE, related_name="likes")
     post = models.ForeignKey("Post", on_delete=models.CASCADE, related_name="likes_of_post")
+
+    class Meta:
+        constraints = [
+            # also serves the "which of these posts did this user like" lookups
+            models.UniqueConstraint(fields=["liker", "post"], name="unique_like"),
+        ]
     
     def serialize(self):
         return {
             "liker": self.liker.username,
             "post": self.post.poster.username
         }
+
+class TimelineEntry(models.Model):
+    # One row per post in a user's Following feed, written by network.timeline
+    # when the post is created (fan-out on write) or when its poster is followed
+    owner = models.ForeignKey("User", on_delete=models.CASCADE, related_name="timeline")
+    post = models.ForeignKey("Post", on_delete=models.CASCADE, related_name="timeline_entries")
+    # copy of post.timestamp so the timeline can be ordered and trimmed on its own index
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["owner", "post"], name="unique_timeline_entry"),
+        ]
+        indexes = [
+            models.Index(fields=["owner", "-timestamp", "-post"], name="timeline_owner_idx"),
+        ]
+
+
+class Job(models.Model):
+    # A deferred side effect of a write, run by network.jobs. Rows are deleted
+    # once the job has run; failed ones stay for inspection.
+    kind = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict)
+    created = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField()
+    attempts = models.PositiveIntegerField(default=0)
+    # The runner working on the job, and when its claim runs out
+    claimed_by = models.CharField(max_length=32, blank=True, default="")
+    claimed_until = models.DateTimeField(blank=True, null=True)
+    # Gave up after NETWORK_JOB_MAX_ATTEMPTS
+    failed = models.BooleanField(default=False)
+    last_error = models.TextField(blank=True, default="")
+
+    class Meta:
+        indexes = [
+            # the jobs that are due, oldest first
+            models.Index(fields=["failed", "run_after"], name="job_due_idx"),
+        ]
+
+
+class Suggestion(models.Model):
+    # A user worth following, precomputed from the follow graph by network.graph
+    user = models.ForeignKey("User", on_delete=models.CASCADE, related_name="suggestions")
+    suggested = models.ForeignKey("User", on_delete=models.CASCADE, related_name="suggested_to")
+    score = models.FloatField()
+    # How many of the users user follows follow the suggested user
+    mutuals = models.PositiveIntegerField(default=0)
+    # Whether the suggested user follows user
+    follows_you = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "suggested"], name="unique_suggestion"),
+        ]
+        indexes = [
+            # a user's suggestions, best first
+            models.Index(fields=["user", "-score"], name="suggestion_user_idx"),
+        ]
+
+    def serialize(self):
+        return {
+            "id": self.suggested_id,
+            "username": self.suggested.username,
+            "mutuals": self.mutuals,
+            "follows_you": self.follows_you,
+        }
+
+
+class TrendingScore(models.Model):
+    # A recent post's time-decayed popularity, kept by network.trending. The
+    # score is as of TrendingEpoch.epoch, so every row decays at the same rate
+    # and the order of the rows does not change as time passes.
+    post = models.OneToOneField("Post", on_delete=models.CASCADE, primary_key=True, related_name="trending")
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [
+            # the trending feed, best first
+            models.Index(fields=["-score", "-post"], name="trending_score_idx"),
+        ]
+
+
+class TrendingEpoch(models.Model):
+    # The single row holding the moment the trending scores are measured at
+    epoch = models.DateTimeField()
@@ -0,0 +1,151 @@
+import base64
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Max, Q
+from django.utils.functional import cached_property
+
+"""
+KEYSET (CURSOR) PAGINATION HELPERS
+
+    A cursor is an opaque token holding the ordering values of the last row of
+    the previous page. The next page is every row that sorts after it, which
+    the database answers from an index without counting or skipping rows, and
+    which stays stable when new rows are added at the top of the feed.
+
+    Rows are always ordered descending on every field in `fields`, which may be
+    model fields or annotations; the last field must be unique (normally "id")
+    so that ties are broken.
+
+"""
+class InvalidCursor(Exception):
+    pass
+
+
+# DjangoJSONEncoder rounds datetimes to milliseconds, which would skip posts
+# created within the same millisecond as the last post of a page
+class CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), cls=CursorEncoder, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+# Return the list of count raw JSON values held by a cursor
+def decode_values(token, count):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor("Malformed cursor.")
+    if not isinstance(values, list) or len(values) != count:
+        raise InvalidCursor("Malformed cursor.")
+    return values
+
+
+def decode_cursor(token, queryset, fields):
+    values = decode_values(token, len(fields))
+
+    # Convert each value back to the type of its model field, or of the
+    # annotation it names
+    decoded = []
+    for name, value in zip(fields, values):
+        try:
+            field = queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            field = queryset.query.annotations[name].output_field
+        # to_python lets None through, and raises TypeError or ValueError
+        # rather than ValidationError on some values of the wrong JSON type
+        try:
+            value = field.to_python(value)
+        except (ValidationError, TypeError, ValueError):
+            raise InvalidCursor("Malformed cursor.")
+        if value is None:
+            raise InvalidCursor("Malformed cursor.")
+        decoded.append(value)
+    return decoded
+
+
+# Build the filter selecting the rows that sort after `values`, for a
+# descending ordering on `fields`: (a < x) OR (a = x AND b < y) OR ...
+# The leading a <= x is redundant but lets the database seek straight to the
+# cursor position in the index instead of scanning down from the top.
+def _after(fields, values):
+    condition = Q()
+    for i, name in enumerate(fields):
+        step = Q(**{f"{name}__lt": values[i]})
+        for prev_name, prev_value in zip(fields[:i], values[:i]):
+            step &= Q(**{prev_name: prev_value})
+        condition |= step
+    return Q(**{f"{fields[0]}__lte": values[0]}) & condition
+
+
+# Return (rows, next_cursor) for the page of `queryset` following `cursor`.
+# An empty or missing cursor returns the first page; next_cursor is None on
+# the last page.
+def keyset_page(queryset, fields, cursor=None, size=10):
+    queryset = queryset.order_by(*[f"-{name}" for name in fields])
+    if cursor:
+        values = decode_cursor(cursor, queryset, fields)
+        queryset = queryset.filter(_after(fields, values))
+
+    # Fetch one extra row to learn whether there is a next page
+    rows = list(queryset[:size + 1])
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, name) for name in fields)
+
+
+"""
+ESTIMATED COUNT PAGINATION
+
+    Paginator counts the whole queryset to number the pages, which on a table
+    of millions of rows is a full scan on every page view. The admin change
+    lists of the big tables use EstimatedCountPaginator instead:
+
+    - a whole table is estimated: from the planner's statistics on
+      PostgreSQL, and from the highest ID elsewhere (read from the end of the
+      primary key index, and too high by the rows deleted since)
+    - a filtered queryset is counted up to EXACT_COUNT_LIMIT rows only, so a
+      broad filter shows at most that many; narrow it to see the rest
+
+    Tables smaller than EXACT_COUNT_LIMIT are counted exactly.
+"""
+EXACT_COUNT_LIMIT = 10000
+
+
+# An estimate of the number of rows in model's table, or None
+def estimated_rows(model, using):
+    connection = connections[using]
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+            row = cursor.fetchone()
+        # -1 until the table has been analyzed
+        return row[0] if row and row[0] >= 0 else None
+    if model._meta.pk.get_internal_type() not in ("AutoField", "BigAutoField", "SmallAutoField"):
+        return None
+    return model._default_manager.using(using).aggregate(highest=Max("pk"))["highest"] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate > EXACT_COUNT_LIMIT:
+                return estimate
+        return queryset.order_by()[:EXACT_COUNT_LIMIT].count()
@@ -0,0 +1,168 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+"""
+PER-REQUEST PERFORMANCE INSTRUMENTATION
+
+    When PerformanceMiddleware (network/middleware.py) samples a request, a
+    RequestProfile is active for its duration. It records every database query
+    with its time, plus any spans timed with perf.timer(), e.g. "serialize".
+
+    Finished profiles are added to a rolling in-process aggregate per URL name,
+    from which snapshot() reports p50/p95/p99 latencies. Requests slower than
+    NETWORK_PERF_SLOW_MS are logged to the "network.perf" logger with their SQL
+    and kept in a short list of recent slow requests.
+
+"""
+logger = logging.getLogger("network.perf")
+
+_current = ContextVar("network_perf_profile", default=None)
+
+# How many queries of a request are kept for the slow request dump
+MAX_RECORDED_QUERIES = 100
+# How many recent slow requests are kept
+MAX_SLOW_REQUESTS = 20
+
+
+# Nearest-rank percentile of an already sorted list
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    rank = max(int(round(percent / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class RequestProfile:
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.total_ms = None
+        self.db_ms = 0.0
+        self.query_count = 0
+        self.queries = []
+        self.spans = {}
+
+    # Database execute wrapper (see connection.execute_wrapper)
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.db_ms += elapsed
+            self.query_count += 1
+            if len(self.queries) < MAX_RECORDED_QUERIES:
+                self.queries.append((round(elapsed, 2), sql))
+
+    def add_span(self, name, elapsed_ms):
+        self.spans[name] = self.spans.get(name, 0.0) + elapsed_ms
+
+    def finish(self):
+        self.total_ms = (time.perf_counter() - self.start) * 1000
+
+    def server_timing(self):
+        metrics = [f'db;dur={self.db_ms:.1f};desc="{self.query_count} queries"']
+        metrics += [f"{name};dur={elapsed:.1f}" for name, elapsed in self.spans.items()]
+        metrics.append(f"total;dur={self.total_ms:.1f}")
+        return ", ".join(metrics)
+
+
+def current_profile():
+    return _current.get()
+
+
+@contextmanager
+def profiling(profile):
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+
+
+# Time a block of code as a named span of the current request, if it is
+# being profiled; otherwise this costs a single context variable lookup
+@contextmanager
+def timer(name):
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_span(name, (time.perf_counter() - start) * 1000)
+
+
+"""
+ROLLING AGGREGATE
+"""
+class Aggregate:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.slow_requests = deque(maxlen=MAX_SLOW_REQUESTS)
+
+    def window(self):
+        return getattr(settings, "NETWORK_PERF_WINDOW", 1000)
+
+    def add(self, url_name, profile, size):
+        sample = (profile.total_ms, profile.db_ms, profile.query_count,
+                  profile.spans.get("serialize", 0.0), size)
+        with self.lock:
+            if url_name not in self.samples:
+                self.samples[url_name] = deque(maxlen=self.window())
+            self.samples[url_name].append(sample)
+
+    def add_slow(self, path, url_name, profile):
+        slow = {
+            "path": path,
+            "url_name": url_name,
+            "total_ms": round(profile.total_ms, 1),
+            "db_ms": round(profile.db_ms, 1),
+            "queries": profile.query_count,
+            "sql": profile.queries,
+        }
+        with self.lock:
+            self.slow_requests.append(slow)
+        logger.warning(
+            "Slow request %s (%s): %.1f ms, %d queries in %.1f ms\n%s",
+            path, url_name, profile.total_ms, profile.query_count, profile.db_ms,
+            "\n".join(f"  {elapsed} ms: {sql}" for elapsed, sql in profile.queries),
+        )
+
+    def snapshot(self):
+        with self.lock:
+            samples = {name: list(window) for name, window in self.samples.items()}
+            slow_requests = list(self.slow_requests)
+
+        views = {}
+        for name, window in samples.items():
+            totals = sorted(sample[0] for sample in window)
+            views[name] = {
+                "requests": len(window),
+                "p50_ms": round(percentile(totals, 50), 2),
+                "p95_ms": round(percentile(totals, 95), 2),
+                "p99_ms": round(percentile(totals, 99), 2),
+                "avg_db_ms": round(sum(sample[1] for sample in window) / len(window), 2),
+                "avg_queries": round(sum(sample[2] for sample in window) / len(window), 1),
+                "avg_serialize_ms": round(sum(sample[3] for sample in window) / len(window), 2),
+                "avg_response_bytes": round(sum(sample[4] for sample in window) / len(window)),
+            }
+        return {"views": views, "slow_requests": slow_requests}
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.slow_requests.clear()
+
+
+aggregate = Aggregate()
@@ -0,0 +1,150 @@
+import math
+import re
+import threading
+import time
+from functools import lru_cache, wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import JsonResponse
+
+"""
+RATE LIMITING
+
+    Write requests are limited per user (or per IP address for anonymous
+    requests) with token buckets. NETWORK_RATE_LIMITS maps URL names to a rate,
+    e.g.
+
+        "new_post": "10/m"                                  10 a minute, in bursts of up to 10
+        "like_post": {"rate": "120/m", "burst": 30}         a smaller burst
+        "register": {"rate": "5/h", "key": "ip"}            per IP address, even when logged in
+
+    RateLimitMiddleware applies them to POST, PUT, PATCH and DELETE requests;
+    GET, HEAD and OPTIONS requests, and views that are not listed, pass through
+    untouched. The rate_limit decorator does the same for a single view.
+
+    Each bucket is a single number in the cache named by NETWORK_RATE_LIMIT_CACHE:
+    the time at which it is full again (the "theoretical arrival time" of the
+    generic cell rate algorithm). A request costs one cache read and one write.
+    The buckets are shared by every process using the same cache, e.g. the file
+    or redis backends; with locmem each process counts on its own. Two processes
+    updating the same bucket at the same instant may both let a request through,
+    so a limit can be exceeded by a request or two under contention.
+
+    A request over the limit gets a 429 with a Retry-After header.
+
+"""
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+KEYS = ("user", "ip")
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class Limit:
+
+    def __init__(self, rate, burst=None, key="user"):
+        match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d*)\s*([smhd])\s*", rate)
+        if not match or int(match[1]) == 0:
+            raise ValueError(f"Invalid rate {rate!r}; expected e.g. '10/m' or '100/5m'.")
+        if key not in KEYS:
+            raise ValueError(f"Invalid rate limit key {key!r}; expected one of {KEYS}.")
+        count, period = int(match[1]), int(match[2] or 1) * UNITS[match[3]]
+        # Seconds for one token to come back, and how many tokens a full bucket holds
+        self.interval = period / count
+        self.burst = count if burst is None else burst
+        self.key = key
+
+    @classmethod
+    def from_setting(cls, value):
+        if isinstance(value, str):
+            return cls(value)
+        return cls(**value)
+
+
+@lru_cache(maxsize=None)
+def configured_limits():
+    return {
+        name: Limit.from_setting(value)
+        for name, value in getattr(settings, "NETWORK_RATE_LIMITS", {}).items()
+    }
+
+
+@receiver(setting_changed)
+def _clear_configured_limits(setting, **kwargs):
+    if setting == "NETWORK_RATE_LIMITS":
+        configured_limits.cache_clear()
+
+
+def _cache():
+    return caches[getattr(settings, "NETWORK_RATE_LIMIT_CACHE", getattr(settings, "NETWORK_CACHE_ALIAS", "default"))]
+
+
+# Requests of this process update buckets one at a time
+_lock = threading.Lock()
+
+
+# The client's address. Behind a proxy, NETWORK_CLIENT_IP_HEADER names the
+# header it puts the address in (e.g. HTTP_X_FORWARDED_FOR); the last address
+# in it is the one the proxy saw, which the client cannot forge
+def client_ip(request):
+    header = getattr(settings, "NETWORK_CLIENT_IP_HEADER", None)
+    if header and request.META.get(header):
+        return request.META[header].split(",")[-1].strip()
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def bucket_key(name, limit, request):
+    user = getattr(request, "user", None)
+    if limit.key == "user" and user is not None and user.is_authenticated:
+        return f"network:ratelimit:{name}:user:{user.pk}"
+    return f"network:ratelimit:{name}:ip:{client_ip(request)}"
+
+
+# Take a token from the bucket; returns 0 if there was one, otherwise the
+# number of seconds until there is
+def take_token(key, limit, now=None):
+    now = time.time() if now is None else now
+    cache = _cache()
+    with _lock:
+        full_at = max(cache.get(key, now), now)
+        new_full_at = full_at + limit.interval
+        allowed_at = new_full_at - limit.burst * limit.interval
+        if allowed_at > now:
+            return allowed_at - now
+        cache.set(key, new_full_at, math.ceil(new_full_at - now) + 1)
+    return 0
+
+
+def too_many_requests(retry_after):
+    seconds = max(1, math.ceil(retry_after))
+    response = JsonResponse(
+        {"error": f"Too many requests. Try again in {seconds} seconds."}, status=429
+    )
+    response["Retry-After"] = str(seconds)
+    return response
+
+
+# Return a 429 response if the request is over name's limit, otherwise None
+def check(name, limit, request):
+    if request.method in SAFE_METHODS:
+        return None
+    retry_after = take_token(bucket_key(name, limit, request), limit)
+    return too_many_requests(retry_after) if retry_after else None
+
+
+# Limit a view's writes to rate. A NETWORK_RATE_LIMITS entry for name takes
+# precedence, and RateLimitMiddleware leaves the view to the decorator
+def rate_limit(name, rate, burst=None, key="user"):
+    default = Limit(rate, burst, key)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            limit = configured_limits().get(name, default)
+            return check(name, limit, request) or view(request, *args, **kwargs)
+        wrapper.rate_limited = True
+        return wrapper
+    return decorator
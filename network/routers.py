@@ -0,0 +1,70 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+"""
+READ REPLICA ROUTING
+
+    ReplicaRouter sends reads to one of the database aliases in NETWORK_REPLICAS,
+    and all writes to the primary ("default"), but only while replica reads are
+    allowed. ReplicaRoutingMiddleware allows them for the GET and HEAD requests
+    of browsers that have not written recently; everything else (writes, the
+    requests just after them, management commands) reads from the primary.
+
+    After a POST, the browser gets a cookie that keeps its reads on the primary
+    for NETWORK_REPLICA_STICKY_SECONDS, so users see their own writes even while
+    the replicas lag behind.
+
+    Sessions are always read from the primary: a session written at login must
+    be found on the very next request, however far behind the replicas are.
+
+"""
+_replica_reads = ContextVar("network_replica_reads", default=False)
+
+PRIMARY = "default"
+
+# Apps whose models are never read from a replica
+PRIMARY_ONLY_APPS = {"sessions"}
+
+
+def replica_aliases():
+    return getattr(settings, "NETWORK_REPLICAS", [])
+
+
+def replica_reads_allowed():
+    return _replica_reads.get()
+
+
+@contextmanager
+def replica_reads(allowed=True):
+    token = _replica_reads.set(allowed)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replicas = replica_aliases()
+        if replicas and replica_reads_allowed() and model._meta.app_label not in PRIMARY_ONLY_APPS:
+            return random.choice(replicas)
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {PRIMARY, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    # The replicas are copies of the primary, and are never migrated themselves
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replica_aliases():
+            return False
+        return None
@@ -0,0 +1,101 @@
+import re
+
+from django.db import connections, router
+
+from .models import Post
+from .pagination import InvalidCursor, decode_values, encode_cursor
+
+"""
+POST SEARCH
+
+    Post.body is indexed by the SQLite FTS5 table network_post_fts (migration
+    0009). It is an external content index: it stores only the index, and reads
+    the text from network_post. Triggers on network_post add, update and remove
+    index entries in the same transaction as every insert, body update and
+    delete, including bulk_create.
+
+    A migration that makes Django remake the network_post table (SQLite has no
+    ALTER for most field changes) drops the triggers with the old table; run
+    rebuild_search_index after it, which recreates them and reindexes.
+
+    Results are ranked by bm25 (best first, newest first among equal ranks) and
+    paged by a cursor over (rank, id). Ranks shift a little as posts are added,
+    so a page fetched much later may repeat or skip a result at the boundary.
+
+"""
+# Recreating the index and its triggers; the same statements as migration 0009
+SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS network_post_fts USING fts5("
+    "body, content='network_post', content_rowid='id', "
+    "tokenize='porter unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS network_post_fts_insert AFTER INSERT ON network_post BEGIN "
+    "INSERT INTO network_post_fts(rowid, body) VALUES (new.id, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS network_post_fts_delete AFTER DELETE ON network_post BEGIN "
+    "INSERT INTO network_post_fts(network_post_fts, rowid, body) VALUES ('delete', old.id, old.body); END",
+    "CREATE TRIGGER IF NOT EXISTS network_post_fts_update AFTER UPDATE OF body ON network_post BEGIN "
+    "INSERT INTO network_post_fts(network_post_fts, rowid, body) VALUES ('delete', old.id, old.body); "
+    "INSERT INTO network_post_fts(rowid, body) VALUES (new.id, new.body); END",
+]
+
+# Longer queries are cut to this many words
+MAX_SEARCH_TERMS = 10
+
+SEARCH_SQL = """
+    SELECT score, id FROM (
+        SELECT rowid AS id, bm25(network_post_fts) AS score
+        FROM network_post_fts WHERE network_post_fts MATCH %s
+    )
+    {after}
+    ORDER BY score, id DESC
+    LIMIT %s
+"""
+
+
+class InvalidSearch(ValueError):
+    pass
+
+
+# Turn what the user typed into an FTS5 query: every word must appear, and the
+# last one may be the start of a word, so results show up while typing.
+# Quoting the words keeps FTS5 operators and punctuation from being parsed.
+def match_expression(query):
+    words = re.findall(r"\w+", query)[:MAX_SEARCH_TERMS]
+    if not words:
+        raise InvalidSearch("Enter words to search for.")
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+# Return (posts, next_cursor) for the page of search results following cursor
+def search_posts(query, cursor=None, size=10):
+    params = [match_expression(query)]
+    after = ""
+    if cursor:
+        score, post_id = decode_values(cursor, 2)
+        if not isinstance(score, (int, float)) or not isinstance(post_id, int):
+            raise InvalidCursor("Malformed cursor.")
+        after = "WHERE score > %s OR (score = %s AND id < %s)"
+        params += [score, score, post_id]
+    params.append(size + 1)
+
+    with connections[router.db_for_read(Post)].cursor() as db:
+        db.execute(SEARCH_SQL.format(after=after), params)
+        rows = db.fetchall()
+
+    next_cursor = encode_cursor(rows[size - 1]) if len(rows) > size else None
+    ids = [post_id for _, post_id in rows[:size]]
+    posts = Post.objects.select_related("poster").in_bulk(ids)
+    return [posts[post_id] for post_id in ids if post_id in posts], next_cursor
+
+
+# Recreate the index and its triggers if missing, and reindex every post
+def rebuild_index(optimize=False):
+    with connections[router.db_for_write(Post)].cursor() as db:
+        for statement in SCHEMA:
+            db.execute(statement)
+        db.execute("INSERT INTO network_post_fts(network_post_fts) VALUES ('rebuild')")
+        if optimize:
+            db.execute("INSERT INTO network_post_fts(network_post_fts) VALUES ('optimize')")
+        db.execute("SELECT COUNT(*) FROM network_post_fts")
+        return db.fetchone()[0]
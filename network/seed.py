@@ -0,0 +1,175 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.utils import timezone
+
+from .counters import repair_counters
+from .models import User, Post, Follow, Like
+from .timeline import rebuild_timeline
+from .trending import redecay
+
+"""
+BULK DATA SEEDING
+
+    Generates a realistic social graph for benchmarking, written with
+    bulk_create in batches:
+
+    - follower counts follow a power law: a few accounts are followed by a
+      large share of users, most by almost nobody
+    - posting is bursty: each user posts in a handful of bursts of activity,
+      and how much users post also follows a power law
+    - likes concentrate on a few hot posts
+
+    Every seeded user has the password "password".
+
+"""
+DEFAULT_BATCH_SIZE = 5000
+
+
+# Post.timestamp is auto_now_add, which would overwrite the generated times
+@contextmanager
+def keep_timestamps():
+    field = Post._meta.get_field("timestamp")
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+# Cumulative Zipf weights for ranks 1..n, for random.choices(cum_weights=...)
+def _zipf_cum_weights(n, exponent):
+    return list(accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+
+
+def in_batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Seeder:
+
+    def __init__(self, users, posts, likes, follows_per_user=20, days=30,
+                 batch_size=DEFAULT_BATCH_SIZE, prefix="seed", seed=None, log=None):
+        self.num_users = users
+        self.num_posts = posts
+        self.num_likes = likes
+        self.follows_per_user = follows_per_user
+        self.days = days
+        self.batch_size = batch_size
+        self.prefix = prefix
+        self.random = random.Random(seed)
+        self.log = log or (lambda message: None)
+
+    def run(self, timelines=True):
+        user_ids = self.create_users()
+        self.create_follows(user_ids)
+        post_ids = self.create_posts(user_ids)
+        self.create_likes(user_ids, post_ids)
+
+        self.log("Recounting counters...")
+        repair_counters()
+        if timelines:
+            self.log("Building timelines...")
+            seeded = User.objects.filter(username__startswith=self.prefix, following_count__gt=0)
+            for user in seeded.iterator():
+                rebuild_timeline(user)
+        # Score the recent posts, so the trending feed has the seeded ones
+        self.log("Scoring trending posts...")
+        redecay()
+        return user_ids, post_ids
+
+    def create_users(self):
+        if User.objects.filter(username__startswith=self.prefix).exists():
+            raise ValueError(f"Users named {self.prefix}* already exist; choose another prefix.")
+
+        # Hash the shared password once rather than once per user
+        password = make_password("password")
+        users = (
+            User(username=f"{self.prefix}{i}", email=f"{self.prefix}{i}@example.com", password=password)
+            for i in range(self.num_users)
+        )
+        for batch in in_batches(users, self.batch_size):
+            User.objects.bulk_create(batch)
+        self.log(f"Created {self.num_users} users.")
+
+        # The position of a user in this list is their popularity rank
+        # (the first is the most followed), shuffled so it is unrelated to their id
+        user_ids = list(
+            User.objects.filter(username__startswith=self.prefix).order_by("id").values_list("id", flat=True)
+        )
+        self.random.shuffle(user_ids)
+        return user_ids
+
+    def create_follows(self, user_ids):
+        popularity = _zipf_cum_weights(len(user_ids), 1.1)
+
+        def follows():
+            for follower_id in user_ids:
+                # How many accounts each user follows is itself heavy tailed
+                count = min(int(self.random.paretovariate(1.5) * self.follows_per_user / 3), len(user_ids) - 1)
+                targets = set(self.random.choices(user_ids, cum_weights=popularity, k=count))
+                targets.discard(follower_id)
+                for follows_id in targets:
+                    yield Follow(follower_id=follower_id, follows_id=follows_id)
+
+        total = 0
+        for batch in in_batches(follows(), self.batch_size):
+            Follow.objects.bulk_create(batch, ignore_conflicts=True)
+            total += len(batch)
+        self.log(f"Created {total} follows.")
+
+    def create_posts(self, user_ids):
+        now = timezone.now()
+        activity = _zipf_cum_weights(len(user_ids), 0.8)
+        # Each user posts in a few bursts, each a few hours long
+        bursts = {}
+
+        def posts():
+            posters = self.random.choices(user_ids, cum_weights=activity, k=self.num_posts)
+            for i, poster_id in enumerate(posters):
+                if poster_id not in bursts:
+                    bursts[poster_id] = [
+                        now - timedelta(days=self.random.uniform(0, self.days)) for _ in range(3)
+                    ]
+                burst = self.random.choice(bursts[poster_id])
+                timestamp = min(burst + timedelta(minutes=self.random.expovariate(1 / 90)), now)
+                yield Post(poster_id=poster_id, body=f"Seeded post {i} by {poster_id}", timestamp=timestamp)
+
+        with keep_timestamps():
+            for batch in in_batches(posts(), self.batch_size):
+                Post.objects.bulk_create(batch)
+        self.log(f"Created {self.num_posts} posts.")
+
+        return list(Post.objects.filter(poster__username__startswith=self.prefix).values_list("id", flat=True))
+
+    def create_likes(self, user_ids, post_ids):
+        if not post_ids:
+            return
+        # A few hot posts get most of the likes
+        hot_order = post_ids[:]
+        self.random.shuffle(hot_order)
+        hotness = _zipf_cum_weights(len(hot_order), 1.0)
+
+        # Draw the likes a batch at a time to keep memory flat
+        remaining = self.num_likes
+        while remaining > 0:
+            size = min(self.batch_size, remaining)
+            likers = self.random.choices(user_ids, k=size)
+            liked = self.random.choices(hot_order, cum_weights=hotness, k=size)
+            # Repeated (liker, post) pairs are dropped by the unique constraint
+            Like.objects.bulk_create(
+                [Like(liker_id=liker_id, post_id=post_id) for liker_id, post_id in zip(likers, liked)],
+                ignore_conflicts=True,
+            )
+            remaining -= size
+        self.log(f"Created up to {self.num_likes} likes.")
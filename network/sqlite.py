@@ -0,0 +1,60 @@
+import django
+from django.conf import settings
+
+from .routers import replica_aliases
+
+"""
+PRODUCTION SQLITE SETTINGS
+
+    With NETWORK_SQLITE_PRODUCTION on, every new SQLite connection is set up
+    for a web server with many concurrent readers and writers:
+
+    - journal_mode=WAL: readers no longer block the writer, nor it them
+    - synchronous=NORMAL: in WAL mode this is still safe against corruption,
+      and only syncs the disk at checkpoints rather than on every commit
+    - busy_timeout: a writer waits for the write lock instead of failing at
+      once with "database is locked"
+    - cache_size / mmap_size: keep the hot pages of the feed indexes in memory
+    - temp_store=MEMORY: sorts and temporary B-trees do not touch the disk
+
+    Connections to the read replicas (NETWORK_REPLICAS, see network/routers.py)
+    are also set to query_only, so a stray write through them fails loudly.
+
+    Writes are serialized by SQLite itself; project4/settings.py starts write
+    transactions with BEGIN IMMEDIATE (where Django supports it), so they take
+    the write lock up front and wait on busy_timeout, rather than failing when
+    a read transaction tries to upgrade to a write.
+
+"""
+PRAGMAS = [
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    # in milliseconds; the same as the timeout in the database OPTIONS
+    ("busy_timeout", 20000),
+    # a negative cache_size is in KiB: 64 MiB
+    ("cache_size", -64000),
+    ("mmap_size", 256 * 1024 * 1024),
+    ("temp_store", "MEMORY"),
+]
+
+
+# The database OPTIONS project4/settings.py adds in production mode
+def production_options():
+    options = {"timeout": 20}
+    if django.VERSION >= (5, 1):
+        options["transaction_mode"] = "IMMEDIATE"
+    return options
+
+
+def production_mode():
+    return getattr(settings, "NETWORK_SQLITE_PRODUCTION", False)
+
+
+def configure_connection(sender, connection, **kwargs):
+    if connection.vendor != "sqlite" or not production_mode():
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in PRAGMAS:
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+        if connection.alias in replica_aliases():
+            cursor.execute("PRAGMA query_only = ON")
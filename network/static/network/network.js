@@ -10,6 +10,9 @@ document.addEventListener('DOMContentLoaded', function() {
             document.querySelector("#all-posts-title h1").innerHTML = "Following";
             document.querySelector("#new-post").style.display = "none";
         }
+        else if (window.location.search.includes("trending=true")) {
+            document.querySelector("#all-posts-title h1").innerHTML = "Trending";
+        }
     }
 
     // If the profile page, show the user's profile and load their posts
@@ -23,8 +26,18 @@ document.addEventListener('DOMContentLoaded', function() {
 //----------------------------------------------
 const csrftoken = document.querySelector('[name=csrf-token]').content;
 
-// to manage pagination
-let page = 1;
+
+// to manage infinite scroll: the cursor of the next page (null on the last page)
+let nextCursor = null;
+let loadingMore = false;
+let scrollObserver = null;
+
+// to manage live updates: the open event stream and the user viewing the page
+let liveEvents = null;
+// Set once the server has turned the event stream down (e.g. 204 when not served over ASGI)
+let liveEventsUnavailable = false;
+let activeUserName = null;
+let newPostsWaiting = 0;
 
 // ----------------------------------------------
 // HELPER FUNCTION - TIME/DATE
@@ -50,24 +63,67 @@ function formatDate(date) {
 // FETCH FROM SERVER FUNCTIONS
 // ----------------------------------------------
 
+// Remembers the last response for each url, with its ETag
+const responseCache = new Map();
+
+// Fetches JSON from the server, sending back the ETag of the last response
+// for this url so the server can answer 304 Not Modified and reuse the cached data
+function fetchJSON(url) {
+    const headers = { 'X-Requested-With': 'XMLHttpRequest' };
+    const cached = responseCache.get(url);
+    if (cached) {
+        headers['If-None-Match'] = cached.etag;
+    }
+
+    return fetch(url, { headers: headers, cache: 'no-store' })
+        .then(response => {
+            if (response.status === 304 && cached) {
+                // structuredClone so callers can modify the data freely
+                return structuredClone(cached.data);
+            }
+            return response.json().then(data => {
+                const etag = response.headers.get('ETag');
+                if (response.ok && etag) {
+                    responseCache.set(url, {
+                        etag: etag,
+                        data: structuredClone(data)
+                    });
+                }
+                return data;
+            });
+        });
+}
+
 // gets all the posts from the DB
-function fetchAllPostsData() {
+// Pass a cursor to page through the feed by cursor; an empty string asks for the first page
+function fetchAllPostsData(cursor) {
     // base url
     let url = "/";
 
+    // Page by cursor, and ask for the compact format (see readFeed)
+    const pageParam = `cursor=${encodeURIComponent(cursor)}&format=compact`;
+
+    // On the search page, page through the search results instead
+    const searchQuery = document.querySelector("#index-container").dataset.search;
+    if (searchQuery !== undefined) {
+        url = `/search?q=${encodeURIComponent(searchQuery)}&${pageParam}`;
+    }
     // Check if the URL has the "following=true" parameter
-    if (window.location.search.includes("following=true")) {
+    else if (window.location.search.includes("following=true")) {
         url += "?following=true";
-        // Add the page parameter after the "following=true"
-        url += `&page=${page}`;
+        // Add the cursor parameter after the "following=true"
+        url += `&${pageParam}`;
+    }
+    // ... or the "trending=true" parameter
+    else if (window.location.search.includes("trending=true")) {
+        url += `?trending=true&${pageParam}`;
     } else {
-        // If no other query parameters, add the page parameter directly
-        url += `?page=${page}`;
+        // If no other query parameters, add the cursor parameter directly
+        url += `?${pageParam}`;
     }
     
     // fetch relevant posts from the DB based on the url
-    return fetch(url, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
-        .then(response => response.json())
+    return fetchJSON(url)
         .then(posts => {
             console.log('Fetched posts data:', posts);
             return posts;  // Return the posts data
@@ -79,12 +135,12 @@ function fetchAllPostsData() {
 }
 
 // gets a particular user's profile information from the DB
-function fetchUserProfileInfo(userID) {
-    // Adding page parameter to the URL
-    const url = `/profile/${userID}?page=${page}`;
+// Pass a cursor to page through the posts by cursor; an empty string asks for the first page
+function fetchUserProfileInfo(userID, cursor) {
+    // Adding cursor parameter to the URL, and asking for the posts in the compact format
+    const url = `/profile/${userID}?cursor=${encodeURIComponent(cursor)}&format=compact`;
 
-    return fetch(url, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
-    .then(response => response.json())
+    return fetchJSON(url)
     .then(userProfileData => {
         console.log('Fetched profile data for username:', userProfileData);
         return userProfileData;
@@ -96,29 +152,57 @@ function fetchUserProfileInfo(userID) {
 }
 
 
+// The data of the first page, if the server embedded it in the page
+// (see the index and profile views), in the shape of its AJAX response.
+// It is only read once: the script is removed, so reloading the feed later
+// (e.g. from the new posts notice) fetches it afresh
+function initialData(id) {
+    const script = document.getElementById(id);
+    if (!script) {
+        return null;
+    }
+    script.remove();
+    return JSON.parse(script.textContent);
+}
+
 // ----------------------------------------------
 // POPULATE THE DOM FUNCTIONS
 // ----------------------------------------------
 
-// adds posts to the DOM
-function add_posts(posts) {
+// Reads a feed response in the compact format into { posts, activeUser, nextCursor }
+// The posts are already in feed order, with epoch timestamps and the posters'
+// names in a user table
+function readFeed(data) {
+    return {
+        posts: data.posts.map(post => ({
+            id: post.id,
+            poster: data.users[post.user],
+            posterID: post.user,
+            body: post.body,
+            timestamp: post.ts,
+            edited: post.edited_ts !== undefined,
+            edited_timestamp: post.edited_ts,
+            likes_count: post.likes || 0,
+            user_liked: post.liked === true
+        })),
+        activeUser: data.me,
+        nextCursor: data.next || null
+    };
+}
+
+// adds the posts of a feed (see readFeed) to the DOM
+// When append is true the posts are added below the ones already shown (infinite scroll)
+function add_posts(feed, append = false) {
     const postsContainer = document.getElementById('page-posts');
     
     // Clear existing content before appending new posts
-    postsContainer.innerHTML = '';
+    if (!append) {
+        postsContainer.innerHTML = '';
+    }
     
-    // Get the active user from the posts array
-    const activeUser = posts[posts.length - 1].activeUser;
-
-    // Filter out posts in the returned array with the key "activeUser"
-    posts = posts.filter(post => !post.hasOwnProperty('activeUser'));
-
-    // Sort the posts by timestamp in descending order (newest first)
-    posts.sort((a, b) => {
-        const dateA = new Date(a.timestamp);
-        const dateB = new Date(b.timestamp);
-        return dateB - dateA;
-    });
+    const activeUser = feed.activeUser;
+    activeUserName = activeUser;
+    const posts = feed.posts;
 
     posts.forEach((post, index) => {
         const singlePostContainer = document.createElement('div');
@@ -128,7 +212,7 @@ function add_posts(posts) {
         postDiv.className = 'postDiv';
 
         // If it's the first post, adjust the top margin
-        if (index === 0) {
+        if (index === 0 && !append) {
         postDiv.style.marginTop = "0px";
         }
 
@@ -200,39 +284,27 @@ function add_posts(posts) {
         postsContainer.appendChild(singlePostContainer);
     });
     
-    // Add pagination buttons
-    const paginationContainer = document.getElementById('pagination-container');
-    
-    paginationContainer.innerHTML = `
-        <div id="page-number">Page ${page}</div>
-        <button class="btn btn-primary" id="prev-btn" onclick="prevPage()">Previous</button>
-        <button class="btn btn-primary" id="next-btn" onclick="nextPage()">Next</button>`;
-
-    // Hide the previous button if on the first page
-    if (page === 1) {
-        document.getElementById('prev-btn').style.display = 'none';
-    } else {
-        document.getElementById('prev-btn').style.display = 'block';
-    }
+    // Keep the infinite scroll going while there are more posts
+    setupInfiniteScroll();
 
-    // Hide the next button if on the last page
-    if (posts.length < 10) {
-        document.getElementById('next-btn').style.display = 'none';
-    } else {
-        document.getElementById('next-btn').style.display = 'block';
+    // Hear about new posts, and likes and edits of the posts now on screen
+    if (!append) {
+        hideNewPostsNotice();
     }
-
-    
-
+    openLiveUpdates();
 }
 
 // Loads all posts in the DB then adds them to the DOM.
 // This function is run on index page load.
 function load_all_posts() {
-    // Get all posts then add them to the DOM
-    fetchAllPostsData()
-        .then(posts => {
-            add_posts(posts);
+    // Get the first page of posts, from the page itself if it is there,
+    // then add them to the DOM
+    const initialFeed = initialData('initial-feed');
+    (initialFeed ? Promise.resolve(initialFeed) : fetchAllPostsData(""))
+        .then(data => {
+            const feed = readFeed(data);
+            nextCursor = feed.nextCursor;
+            add_posts(feed);
         });
 }
 
@@ -240,9 +312,11 @@ function load_all_posts() {
 // PROFILE PAGE
 // This function is run on profile page load.
 function load_user_page(userID) {
-    // Get the user's profile information
-    fetchUserProfileInfo(userID)
+    // Get the user's profile information, from the page itself if it is there
+    const initialProfile = initialData('initial-profile');
+    (initialProfile ? Promise.resolve(initialProfile) : fetchUserProfileInfo(userID, ""))
     .then(userProfileData => {    
+        nextCursor = userProfileData.next_cursor;
 
         // Add the user's profile information
         const profileInformation = document.getElementById('user-profile-information');
@@ -284,50 +358,65 @@ function load_user_page(userID) {
         }
 
         // Add the user's posts to the DOM
-        add_posts(userProfileData.userPosts);
+        add_posts(readFeed(userProfileData.userPosts));
     });
+
+    // The suggestions are not needed for the first paint, so they come after
+    load_suggestions();
 }
 
-// ----------------------------------------------
-// LIKE / UNLIKE FUNCTIONS
-// ----------------------------------------------
-function likePost(postID) {
-    fetch(`/like/${postID}`, {
-        method: 'POST',
-        headers: {
-            'X-CSRFToken': csrftoken
-        },
-    })
+// Shows the active user's "who to follow" suggestions on the profile page
+function load_suggestions() {
+    fetch('/suggestions', { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
     .then(response => response.json())
     .then(data => {
-        // Update likes count on DOM and toggle button
-        updateLikesOnDOM(postID, data.likes_count, true);
+        const container = document.getElementById('suggestions');
+        if (!container || !data.suggestions || data.suggestions.length === 0) {
+            return;
+        }
+        container.innerHTML = '<h4>Who to follow</h4>';
+        data.suggestions.forEach(suggestion => {
+            const reasons = [];
+            if (suggestion.mutuals > 0) {
+                reasons.push(`followed by ${suggestion.mutuals} ${suggestion.mutuals === 1 ? 'person' : 'people'} you follow`);
+            }
+            if (suggestion.follows_you) {
+                reasons.push('follows you');
+            }
+            const item = document.createElement('div');
+            item.className = 'suggestion';
+            const link = document.createElement('a');
+            link.href = `/profile/${suggestion.id}`;
+            link.textContent = suggestion.username;
+            item.appendChild(link);
+            item.appendChild(document.createTextNode(reasons.length ? ` (${reasons.join(', ')})` : ''));
+            container.appendChild(item);
+        });
+        container.style.display = 'block';
     })
     .catch(error => {
-        console.error('Error liking post:', error);
+        console.error('Error fetching suggestions:', error);
     });
 }
 
+// ----------------------------------------------
+// LIKE / UNLIKE FUNCTIONS
+// ----------------------------------------------
+// Likes show up on the page at once, and are sent to the server in a batch
+function likePost(postID) {
+    const currentLikes = parseInt(document.querySelector(`#post-likes-${postID}`).textContent.trim().split(" ")[1]);
+    updateLikesOnDOM(postID, currentLikes + 1, true);
+    queueOperation({ op: 'like', post: postID });
+}
+
 function unlikePost(postID) {
     const currentLikes = parseInt(document.querySelector(`#post-likes-${postID}`).textContent.trim().split(" ")[1]);
     if (currentLikes <= 0) {
         console.log("Cannot unlike a post with zero likes.");
         return;
     }
-    fetch(`/unlike/${postID}`, {
-        method: 'POST',
-        headers: {
-            'X-CSRFToken': csrftoken
-        },
-    })
-    .then(response => response.json())
-    .then(data => {
-        // Update likes count on DOM and toggle button
-        updateLikesOnDOM(postID, data.likes_count, false);
-    })
-    .catch(error => {
-        console.error('Error unliking post:', error);
-    });
+    updateLikesOnDOM(postID, currentLikes - 1, false);
+    queueOperation({ op: 'unlike', post: postID });
 }
 
 function updateLikesOnDOM(postID, likesCount, liked) {
@@ -357,38 +446,21 @@ function updateLikesOnDOM(postID, likesCount, liked) {
 // FOLLOW / UNFOLLOW FUNCTIONS
 // ----------------------------------------------
 
+// Follows show up on the page at once, and are sent to the server in a batch
 function followUser(userID, username) {
-    fetch(`/follow/${userID}`, {
-        method: 'POST',
-        headers: {
-            'X-CSRFToken': csrftoken
-        },
-    })
-    .then(response => response.json())
-    .then(data => {
-        // Update follow button to unfollow button
-        updateFollowButton(userID, username, true, data.follower_count);
-    })
-    .catch(error => {
-        console.error('Error liking post:', error);
-    });
+    updateFollowButton(userID, username, true, currentFollowerCount() + 1);
+    followUsernames.set(String(userID), username);
+    queueOperation({ op: 'follow', user: userID });
 }
 
 function unfollowUser(userID, username) {
-    fetch(`/unfollow/${userID}`, {
-        method: 'POST',
-        headers: {
-            'X-CSRFToken': csrftoken
-        },
-    })
-    .then(response => response.json())
-    .then(data => {
-        // Update unfollow button to follow button
-        updateFollowButton(userID, username, false, data.follower_count);
-    })
-    .catch(error => {
-        console.error('Error unliking post:', error);
-    });
+    updateFollowButton(userID, username, false, Math.max(currentFollowerCount() - 1, 0));
+    followUsernames.set(String(userID), username);
+    queueOperation({ op: 'unfollow', user: userID });
+}
+
+function currentFollowerCount() {
+    return parseInt(document.querySelector('#profile-followers').textContent.replace('Followers:', '').trim());
 }
 
 // Updates the follow button type and the count of followers
@@ -412,6 +484,92 @@ function updateFollowButton(userID, username, followed, follower_count) {
     currentButton.parentNode.replaceChild(newButton, currentButton); 
 }
 
+// ----------------------------------------------
+// BATCHED WRITE FUNCTIONS
+// ----------------------------------------------
+
+// Likes and follows are queued and sent together to /batch once the clicks pause
+// for BATCH_DELAY milliseconds; repeated toggles of the same post or user are
+// collapsed into the last one
+const BATCH_DELAY = 300;
+const pendingOperations = new Map();
+const followUsernames = new Map();
+let batchTimer = null;
+
+function operationKey(operation) {
+    return operation.post !== undefined ? `post:${operation.post}` : `user:${operation.user}`;
+}
+
+function queueOperation(operation) {
+    pendingOperations.set(operationKey(operation), operation);
+
+    clearTimeout(batchTimer);
+    batchTimer = setTimeout(flushOperations, BATCH_DELAY);
+}
+
+// Sends the queued operations, then shows the counts the server returns
+// keepalive lets the request finish when it is sent as the page closes
+function flushOperations(keepalive = false) {
+    clearTimeout(batchTimer);
+    batchTimer = null;
+    if (pendingOperations.size === 0) {
+        return;
+    }
+    const operations = Array.from(pendingOperations.values());
+    pendingOperations.clear();
+
+    fetch('/batch', {
+        method: 'POST',
+        body: JSON.stringify({ operations: operations }),
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': csrftoken
+        },
+        keepalive: keepalive
+    })
+    .then(response => {
+        if (response.status === 429) {
+            // Rate limited: queue the operations again, behind any newer clicks
+            // on the same rows, and send them once the server allows it
+            for (const operation of operations) {
+                if (!pendingOperations.has(operationKey(operation))) {
+                    pendingOperations.set(operationKey(operation), operation);
+                }
+            }
+            const retryAfter = parseInt(response.headers.get('Retry-After'), 10) || 1;
+            clearTimeout(batchTimer);
+            batchTimer = setTimeout(flushOperations, retryAfter * 1000);
+            return {};
+        }
+        return response.json();
+    })
+    .then(data => {
+        if (!data.posts) {
+            if (data.error) {
+                console.error('Error saving likes and follows:', data.error);
+            }
+            return;
+        }
+        // Rows clicked again since this batch was sent wait for the next response
+        for (const [postID, post] of Object.entries(data.posts)) {
+            if (!pendingOperations.has(`post:${postID}`) && document.querySelector(`#post-likes-${postID}`)) {
+                updateLikesOnDOM(postID, post.likes_count, post.user_liked);
+            }
+        }
+        for (const [userID, user] of Object.entries(data.users)) {
+            if (!pendingOperations.has(`user:${userID}`) && document.querySelector(`#followtoggle-btn-${userID}`)) {
+                updateFollowButton(userID, followUsernames.get(userID), user.activeUserFollows, user.follower_count);
+            }
+        }
+    })
+    .catch(error => {
+        console.error('Error saving likes and follows:', error);
+    });
+}
+
+// Don't lose the last clicks when the page is left
+window.addEventListener('pagehide', () => flushOperations(true));
+
 // ----------------------------------------------
 // EDIT POST FUNCTIONS
 // ----------------------------------------------
@@ -497,23 +655,154 @@ function update_post(postID, new_post_body) {
 // PAGINATION FUNCTIONS
 // ----------------------------------------------
 
-// Advances one page
-function nextPage() {
-    page++;
-    fetchAllPostsData().then(posts => {
-        add_posts(posts);
-        window.scrollTo({ top: 0, behavior: 'smooth' });
+// Watches the bottom of the feed and loads the next page when it scrolls into view
+function setupInfiniteScroll() {
+    const paginationContainer = document.getElementById('pagination-container');
+
+    if (scrollObserver) {
+        scrollObserver.disconnect();
+    }
+
+    // No cursor means the last page has been reached
+    if (!nextCursor) {
+        paginationContainer.innerHTML = '';
+        return;
+    }
+
+    paginationContainer.innerHTML = `<div id="feed-end">Loading more posts...</div>`;
+    scrollObserver = new IntersectionObserver(entries => {
+        if (entries[0].isIntersecting) {
+            loadMorePosts();
+        }
     });
+    scrollObserver.observe(document.getElementById('feed-end'));
 }
 
-// Moves back one page
-function prevPage() {
-    // control so that page number does not go below 1
-    if (page > 1) { 
-        page--;
-        fetchAllPostsData().then(posts => {
-            add_posts(posts);
-            window.scrollTo({ top: 0, behavior: 'smooth' });
+// Fetches the page after the current cursor and appends it to the feed
+function loadMorePosts() {
+    if (loadingMore || !nextCursor) {
+        return;
+    }
+    loadingMore = true;
+
+    let request;
+    if (document.querySelector("#profile-container")) {
+        request = fetchUserProfileInfo(userID, nextCursor).then(userProfileData => {
+            nextCursor = userProfileData.next_cursor;
+            return readFeed(userProfileData.userPosts);
+        });
+    } else {
+        request = fetchAllPostsData(nextCursor).then(data => {
+            const feed = readFeed(data);
+            nextCursor = feed.nextCursor;
+            return feed;
         });
     }
+
+    request
+        .then(feed => add_posts(feed, true))
+        .finally(() => {
+            loadingMore = false;
+        });
+}
+
+// ----------------------------------------------
+// LIVE UPDATE FUNCTIONS
+// ----------------------------------------------
+
+// The feed this page shows, as named by the /events endpoint
+function currentFeed() {
+    if (document.querySelector("#profile-container")) {
+        return `user:${userID}`;
+    }
+    if (document.querySelector("#index-container").dataset.search !== undefined) {
+        return "search";
+    }
+    if (window.location.search.includes("trending=true")) {
+        return "trending";
+    }
+    return window.location.search.includes("following=true") ? "following" : "all";
+}
+
+// (Re)opens the event stream for the feed and the posts currently on screen
+function openLiveUpdates() {
+    if (!window.EventSource || liveEventsUnavailable) {
+        return;
+    }
+    if (liveEvents) {
+        liveEvents.close();
+    }
+
+    // The server accepts up to 200 posts to watch
+    const postIDs = Array.from(document.querySelectorAll('.post-likes'))
+        .map(likes => likes.id.replace('post-likes-', ''))
+        .slice(-200);
+    liveEvents = new EventSource(`/events?feed=${encodeURIComponent(currentFeed())}&posts=${postIDs.join(',')}`);
+
+    // EventSource retries by itself after a dropped connection, but gives up
+    // for good on a response that is not a stream; so does this page
+    liveEvents.addEventListener('error', event => {
+        if (event.target.readyState === EventSource.CLOSED) {
+            liveEventsUnavailable = true;
+        }
+    });
+
+    liveEvents.addEventListener('post', event => {
+        const post = JSON.parse(event.data);
+        if (post.poster !== activeUserName) {
+            showNewPostsNotice(newPostsWaiting + 1);
+        }
+    });
+
+    liveEvents.addEventListener('likes', event => {
+        const change = JSON.parse(event.data);
+        const likes = document.querySelector(`#post-likes-${change.post_id}`);
+        // The server leaves out the viewer's own likes, whose count the like request returned
+        if (!likes) {
+            return;
+        }
+        const currentLikes = parseInt(likes.textContent.trim().split(" ")[1]);
+        likes.textContent = `❤️ ${Math.max(currentLikes + change.delta, 0)}`;
+    });
+
+    liveEvents.addEventListener('edit', event => {
+        const edit = JSON.parse(event.data);
+        const body = document.querySelector(`#post-body-${edit.post_id}`);
+        if (!body || document.querySelector(`#edit-form-${edit.post_id}`)) {
+            return;
+        }
+        // The body is text; setting it as HTML would run markup pushed to every viewer
+        body.textContent = edit.body;
+        document.querySelector(`#post-timestamp-${edit.post_id}`).innerHTML = ` (Edited) ${formatDate(new Date(edit.edited_timestamp))}`;
+    });
+}
+
+// Shows a notice above the feed that reloads the first page when clicked
+function showNewPostsNotice(count) {
+    newPostsWaiting = count;
+    let notice = document.getElementById('new-posts-notice');
+    if (!notice) {
+        notice = document.createElement('button');
+        notice.id = 'new-posts-notice';
+        notice.className = 'btn btn-outline-primary';
+        notice.onclick = () => {
+            window.scrollTo(0, 0);
+            if (document.querySelector("#profile-container")) {
+                load_user_page(userID);
+            } else {
+                load_all_posts();
+            }
+        };
+        const postsContainer = document.getElementById('page-posts');
+        postsContainer.parentNode.insertBefore(notice, postsContainer);
+    }
+    notice.innerText = count === 1 ? '1 new post' : `${count} new posts`;
+}
+
+function hideNewPostsNotice() {
+    newPostsWaiting = 0;
+    const notice = document.getElementById('new-posts-notice');
+    if (notice) {
+        notice.remove();
+    }
 }
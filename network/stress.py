@@ -0,0 +1,212 @@
+import random
+import threading
+import time
+
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.test import override_settings
+
+from .caching import feed_changed, posts_changed
+from .counters import change_likes_count, repair_counters
+from .models import User, Post, Like
+from .perf import percentile
+from .sqlite import production_mode, production_options
+from .jobs import enqueue, run_jobs
+from .models import Job
+from .trending import add_post, record_likes
+from .views import get_posts
+
+"""
+SQLITE CONCURRENCY STRESS TEST
+
+    Runs writer threads that like and unlike posts and create new posts, the
+    way the views do, next to reader threads that load feed pages, all for a
+    fixed time. Reports the throughput, the write latencies and how many
+    writes and reads failed with "database is locked".
+
+    The writers only queue the fan-out jobs of their posts, as a worker
+    deployment does; they are run once the threads are done, and any that
+    fail are reported as jobs_failed.
+
+    Run it with the stress_sqlite command against a seeded database.
+    compare_modes() (stress_sqlite --compare) runs it twice, without and with
+    the connection setup of NETWORK_SQLITE_PRODUCTION: its pragmas and BEGIN
+    IMMEDIATE transactions (the read-only alias is left out). The database is left as it was
+    found: every like is undone and the new posts are deleted.
+
+"""
+class StressTest:
+
+    def __init__(self, writers=8, readers=4, seconds=5, seed=None):
+        self.num_writers = writers
+        self.num_readers = readers
+        self.seconds = seconds
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.write_timings = []
+        self.reads = 0
+        self.locked_errors = 0
+        self.reader_locked_errors = 0
+        self.created_posts = []
+        self.job_ids = []
+
+    def run(self):
+        user_ids = list(User.objects.order_by("?").values_list("id", flat=True)[:200])
+        post_ids = list(Post.objects.order_by("-likes_count").values_list("id", flat=True)[:200])
+        if not user_ids or not post_ids:
+            raise ValueError("The database has no users or posts; run seed_network first.")
+
+        deadline = time.perf_counter() + self.seconds
+        threads = [
+            threading.Thread(target=self.writer, args=(i, deadline, user_ids, post_ids))
+            for i in range(self.num_writers)
+        ] + [
+            threading.Thread(target=self.reader, args=(i, deadline, user_ids))
+            for i in range(self.num_readers)
+        ]
+        with override_settings(NETWORK_JOB_MODE="worker"):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        jobs_failed = self.run_queued_jobs()
+        self.clean_up(post_ids)
+        timings = sorted(self.write_timings)
+        return {
+            "mode": "production" if production_mode() else "default",
+            "writes": len(timings),
+            "writes_per_s": round(len(timings) / self.seconds, 1),
+            "reads_per_s": round(self.reads / self.seconds, 1),
+            "write_p50_ms": round(percentile(timings, 50) or 0, 2),
+            "write_p95_ms": round(percentile(timings, 95) or 0, 2),
+            "write_max_ms": round(timings[-1], 2) if timings else 0,
+            "locked_errors": self.locked_errors,
+            "reader_locked_errors": self.reader_locked_errors,
+            "jobs_failed": jobs_failed,
+        }
+
+    # Run a write and record its time; returns False if the database was locked
+    def timed_write(self, write):
+        start = time.perf_counter()
+        try:
+            write()
+        except OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            with self.lock:
+                self.locked_errors += 1
+            return False
+        elapsed = (time.perf_counter() - start) * 1000
+        with self.lock:
+            self.write_timings.append(elapsed)
+        return True
+
+    def toggle_like(self, user_id, post_id):
+        with transaction.atomic():
+            deleted, _ = Like.objects.filter(liker_id=user_id, post_id=post_id).delete()
+            if deleted:
+                change_likes_count(post_id, -deleted)
+                record_likes(post_id, -deleted)
+            else:
+                try:
+                    with transaction.atomic():
+                        Like.objects.create(liker_id=user_id, post_id=post_id)
+                except IntegrityError:
+                    return
+                change_likes_count(post_id, 1)
+                record_likes(post_id, 1)
+            posts_changed(post_id)
+
+    def create_post(self, user_id):
+        with transaction.atomic():
+            post = Post.objects.create(poster_id=user_id, body="Stress test post")
+            job_id = enqueue("fan_out_post", post=post.id)
+            add_post(post)
+            feed_changed(user_id)
+            # Recorded before the commit, in case it goes through and the
+            # jobs run after it fail
+            with self.lock:
+                self.created_posts.append((post.id, user_id))
+                self.job_ids.append(job_id)
+
+    def writer(self, number, deadline, user_ids, post_ids):
+        rng = random.Random(None if self.seed is None else self.seed + number)
+        try:
+            while time.perf_counter() < deadline:
+                user_id = rng.choice(user_ids)
+                if rng.random() < 0.8:
+                    # Like and unlike again, so the likes are as they were;
+                    # the second toggle is retried until it gets through
+                    post_id = rng.choice(post_ids)
+                    if self.timed_write(lambda: self.toggle_like(user_id, post_id)):
+                        while not self.timed_write(lambda: self.toggle_like(user_id, post_id)):
+                            pass
+                else:
+                    self.timed_write(lambda: self.create_post(user_id))
+        finally:
+            connections.close_all()
+
+    def reader(self, number, deadline, user_ids):
+        rng = random.Random(None if self.seed is None else self.seed - number - 1)
+        try:
+            while time.perf_counter() < deadline:
+                try:
+                    user = User.objects.get(id=rng.choice(user_ids))
+                    get_posts(None, user, cursor="")
+                except OperationalError as e:
+                    if "locked" not in str(e):
+                        raise
+                    with self.lock:
+                        self.reader_locked_errors += 1
+                    continue
+                with self.lock:
+                    self.reads += 1
+        finally:
+            connections.close_all()
+
+    # Run the jobs the writers queued; returns how many failed (and are
+    # left queued for a retry)
+    def run_queued_jobs(self):
+        for start in range(0, len(self.job_ids), 500):
+            run_jobs(ids=self.job_ids[start:start + 500])
+        return Job.objects.filter(id__in=self.job_ids).count()
+
+    def clean_up(self, post_ids):
+        created_ids = [post_id for post_id, _ in self.created_posts]
+        with transaction.atomic():
+            for start in range(0, len(created_ids), 500):
+                Post.objects.filter(id__in=created_ids[start:start + 500]).delete()
+            for poster_id in {poster_id for _, poster_id in self.created_posts}:
+                feed_changed(poster_id)
+        repair_counters(post_ids=post_ids)
+
+
+# Run the stress test without and then with the production connection setup,
+# and return both results by mode. WAL mode stays set in the database file,
+# so the default run goes first and the journal mode is put back at the end.
+def compare_modes(**options):
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode")
+        journal_mode = cursor.fetchone()[0]
+    settings_dict = connection.settings_dict
+    connection_options = settings_dict["OPTIONS"]
+    default_options = {
+        name: value for name, value in connection_options.items() if name not in production_options()
+    }
+
+    results = {}
+    try:
+        for production in (False, True):
+            # New connections, this thread's included, are opened the way
+            # the mode opens them
+            settings_dict["OPTIONS"] = {**default_options, **(production_options() if production else {})}
+            connection.close()
+            with override_settings(NETWORK_SQLITE_PRODUCTION=production):
+                results["production" if production else "default"] = StressTest(**options).run()
+    finally:
+        settings_dict["OPTIONS"] = connection_options
+        connection.close()
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"PRAGMA journal_mode = {journal_mode}")
+    return results
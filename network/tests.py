@@ -1,3 +1,1795 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .caching import reset_stats, stats as cache_counters
+from .perf import aggregate
+from .events import LocalBroker, get_broker, wants_event
+from .stress import compare_modes
+from .benchmark import Benchmark
+from .middleware import STICKY_COOKIE, ReplicaRoutingMiddleware
+from .routers import ReplicaRouter
+from .wire import COMPACT_MEDIA_TYPE
+from .ratelimit import Limit, take_token
+from . import jobs
+from .assets import check_static_references, static_references
+from .models import User, Post, Follow, Like, TimelineEntry, Job, Suggestion, TrendingScore, TrendingEpoch
+from .graph import FollowGraph, refresh_all
+from . import trending
+from .transfer import InvalidExport, export_data, import_data
+from .pagination import EstimatedCountPaginator, encode_cursor
+from .counters import repair_counters
+from .timeline import rebuild_timeline
+
+
+AJAX = {"HTTP_X_REQUESTED_WITH": "XMLHttpRequest"}
+
+
+# Start every test with an empty feed cache, since the database is rolled
+# back between tests but the cache is not. Background jobs run as soon as the
+# write commits, and reads stay on the test's connection, which alone sees the
+# test's uncommitted data.
+@override_settings(NETWORK_JOB_MODE="inline", NETWORK_PARALLEL_READS=False)
+class NetworkTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        reset_stats()
+
+
+"""
+FEED QUERY COUNT TESTS
+
+    Every feed page must cost the same number of queries no matter how many
+    posts are on it, so the N+1 per-post lookups cannot creep back in.
+"""
+class FeedQueryCountTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.viewer = User.objects.create_user("viewer", "viewer@example.com", "password")
+        self.poster = User.objects.create_user("poster", "poster@example.com", "password")
+        self.other = User.objects.create_user("other", "other@example.com", "password")
+        Follow.objects.create(follower=self.viewer, follows=self.poster)
+        self.client.force_login(self.viewer)
+
+    def make_posts(self, count):
+        for i in range(count):
+            post = Post.objects.create(poster=self.poster, body=f"post {i}")
+            Like.objects.create(liker=self.other, post=post)
+            if i % 2:
+                Like.objects.create(liker=self.viewer, post=post)
+        repair_counters()
+        rebuild_timeline(self.viewer)
+
+    # Count the queries of a request that misses the cache
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **AJAX)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assert_constant_queries(self, url):
+        self.make_posts(1)
+        small_page = self.count_queries(url)
+        self.make_posts(9)
+        full_page = self.count_queries(url)
+        self.assertEqual(small_page, full_page)
+        return full_page
+
+    def test_index_query_count(self):
+        # session, user, page count, posts, liked posts
+        self.assertEqual(self.assert_constant_queries("/"), 5)
+
+    def test_following_query_count(self):
+        # plus the check for followed users who are not fanned out
+        self.assertEqual(self.assert_constant_queries("/?following=true"), 6)
+
+    def test_profile_query_count(self):
+        # the feed queries plus the profile user and activeUserFollows
+        self.assertEqual(self.assert_constant_queries(f"/profile/{self.poster.id}"), 7)
+
+    def test_serialized_posts(self):
+        self.make_posts(2)
+        posts = self.client.get("/", **AJAX).json()
+        self.assertEqual(posts[-1], {"activeUser": "viewer"})
+        newest, oldest = posts[0], posts[1]
+        self.assertEqual(newest["body"], "post 1")
+        self.assertEqual(newest["poster"], "poster")
+        self.assertEqual(newest["posterID"], self.poster.id)
+        self.assertEqual(newest["likes_count"], 2)
+        self.assertTrue(newest["user_liked"])
+        self.assertEqual(oldest["likes_count"], 1)
+        self.assertFalse(oldest["user_liked"])
+
+
+"""
+STORED COUNTER TESTS
+"""
+class CounterTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.viewer = User.objects.create_user("viewer", "viewer@example.com", "password")
+        self.poster = User.objects.create_user("poster", "poster@example.com", "password")
+        self.post = Post.objects.create(poster=self.poster, body="hello")
+        self.client.force_login(self.viewer)
+
+    def test_like_and_unlike_update_post_counter(self):
+        response = self.client.post(f"/like/{self.post.id}")
+        self.assertEqual(response.json(), {"likes_count": 1})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+
+        response = self.client.post(f"/unlike/{self.post.id}")
+        self.assertEqual(response.json(), {"likes_count": 0})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+
+    def test_repeat_like_and_follow_are_rejected(self):
+        self.client.post(f"/like/{self.post.id}")
+        self.assertEqual(self.client.post(f"/like/{self.post.id}").status_code, 400)
+        self.client.post(f"/follow/{self.poster.id}")
+        self.assertEqual(self.client.post(f"/follow/{self.poster.id}").status_code, 400)
+        self.post.refresh_from_db()
+        self.poster.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.poster.followers_count), (1, 1))
+
+    def test_follow_and_unfollow_update_user_counters(self):
+        response = self.client.post(f"/follow/{self.poster.id}")
+        self.assertEqual(response.json()["follower_count"], 1)
+        self.poster.refresh_from_db()
+        self.viewer.refresh_from_db()
+        self.assertEqual((self.poster.followers_count, self.viewer.following_count), (1, 1))
+
+        response = self.client.post(f"/unfollow/{self.poster.id}")
+        self.assertEqual(response.json()["follower_count"], 0)
+        self.poster.refresh_from_db()
+        self.viewer.refresh_from_db()
+        self.assertEqual((self.poster.followers_count, self.viewer.following_count), (0, 0))
+
+    def test_profile_reads_counters(self):
+        User.objects.filter(pk=self.poster.pk).update(followers_count=7, following_count=3)
+        data = self.client.get(f"/profile/{self.poster.id}", **AJAX).json()
+        self.assertEqual((data["numFollowers"], data["numFollows"]), (7, 3))
+
+    def test_repair_counters_command(self):
+        # Rows written directly bypass the counters, leaving them drifted
+        Like.objects.create(liker=self.viewer, post=self.post)
+        Follow.objects.create(follower=self.viewer, follows=self.poster)
+        out = StringIO()
+        call_command("repair_counters", stdout=out)
+        self.assertIn("1 post(s) and 2 user(s)", out.getvalue())
+        self.post.refresh_from_db()
+        self.poster.refresh_from_db()
+        self.viewer.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+        self.assertEqual(self.poster.followers_count, 1)
+        self.assertEqual(self.viewer.following_count, 1)
+
+        call_command("repair_counters", stdout=out)
+        self.assertIn("0 post(s) and 0 user(s)", out.getvalue())
+
+
+"""
+CURSOR PAGINATION TESTS
+"""
+class CursorPaginationTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.viewer = User.objects.create_user("viewer", "viewer@example.com", "password")
+        self.poster = User.objects.create_user("poster", "poster@example.com", "password")
+        self.posts = [Post.objects.create(poster=self.poster, body=f"post {i}") for i in range(25)]
+        self.client.force_login(self.viewer)
+
+    def walk(self, url, key=None):
+        bodies, cursor = [], ""
+        while cursor is not None:
+            data = self.client.get(url, {"cursor": cursor}, **AJAX).json()
+            if key:
+                posts, cursor = data[key][:-1], data["next_cursor"]
+            else:
+                posts, cursor = data[:-1], data[-1]["next_cursor"]
+            bodies += [post["body"] for post in posts]
+        return bodies
+
+    def test_index_walks_every_post_newest_first(self):
+        self.assertEqual(self.walk("/"), [f"post {i}" for i in reversed(range(25))])
+
+    def test_profile_walks_every_post(self):
+        self.assertEqual(len(self.walk(f"/profile/{self.poster.id}", "userPosts")), 25)
+
+    def test_new_posts_do_not_shift_pages(self):
+        first = self.client.get("/", {"cursor": ""}, **AJAX).json()
+        Post.objects.create(poster=self.poster, body="newer")
+        second = self.client.get("/", {"cursor": first[-1]["next_cursor"]}, **AJAX).json()
+        self.assertEqual(second[0]["body"], "post 14")
+
+    def test_cursor_mode_does_not_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/", {"cursor": ""}, **AJAX)
+        self.assertFalse(any("COUNT(" in query["sql"] for query in queries))
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/", {"cursor": "not-a-cursor"}, **AJAX)
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_with_values_of_the_wrong_type(self):
+        # The trending feed's cursor is a (score, post ID) pair of numbers and an epoch
+        for feed, values in [
+            ({}, [None, None]), ({}, [1, 2]), ({"following": "true"}, [None, None]),
+            ({"following": "true"}, [1, 2]), ({"trending": "true"}, [None, None]), ({"trending": "true"}, ["x", "y"]),
+        ]:
+            with self.subTest(values=values, feed=feed):
+                response = self.client.get("/", {"cursor": encode_cursor(values), **feed}, **AJAX)
+                self.assertEqual(response.status_code, 400)
+
+
+"""
+QUERY PLAN TESTS
+
+    Run EXPLAIN QUERY PLAN on the hot feed, like and follow queries and check
+    that SQLite answers each one from an index rather than a table scan.
+"""
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN output is SQLite specific")
+class QueryPlanTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.viewer = User.objects.create_user("viewer", "viewer@example.com", "password")
+        self.poster = User.objects.create_user("poster", "poster@example.com", "password")
+        self.posts = [Post.objects.create(poster=self.poster, body=f"post {i}") for i in range(3)]
+
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    # index is the index name, or part of the search it performs (SQLite
+    # names the indexes behind unique constraints itself)
+    def assert_uses_index(self, queryset, table, index=None):
+        plan = self.plan(queryset)
+        steps = [step for step in plan if f" {table} " in f"{step} "]
+        self.assertTrue(steps, plan)
+        for step in steps:
+            self.assertRegex(step, r"USING (COVERING )?INDEX|USING INTEGER PRIMARY KEY", plan)
+            if index:
+                self.assertIn(index, step, plan)
+        return plan
+
+    def feed(self, posts, cursor=None):
+        posts = posts.select_related("poster").order_by("-timestamp", "-id")
+        if cursor:
+            posts = posts.filter(timestamp__lte=self.posts[1].timestamp)
+        return posts[:11]
+
+    def test_all_posts_feed(self):
+        plan = self.assert_uses_index(self.feed(Post.objects.all()), "network_post", "post_feed_idx")
+        self.assertFalse(any("TEMP B-TREE" in step for step in plan), plan)
+
+    def test_all_posts_feed_after_cursor(self):
+        self.assert_uses_index(self.feed(Post.objects.all(), cursor=True), "network_post", "post_feed_idx")
+
+    def test_profile_feed(self):
+        plan = self.assert_uses_index(
+            self.feed(Post.objects.filter(poster=self.poster.id)), "network_post", "post_poster_feed_idx"
+        )
+        self.assertFalse(any("TEMP B-TREE" in step for step in plan), plan)
+
+    def test_following_feed(self):
+        following = Follow.objects.filter(follower=self.viewer).values_list("follows", flat=True)
+        self.assert_uses_index(self.feed(Post.objects.filter(poster__in=following)), "network_post")
+        # the unique (follower, follows) constraint's index
+        self.assert_uses_index(following, "network_follow", "(follower_id=?)")
+
+    def test_liked_posts_lookup(self):
+        liked = Like.objects.filter(liker=self.viewer, post__in=[post.id for post in self.posts])
+        self.assert_uses_index(
+            liked.values_list("post_id", flat=True), "network_like", "(liker_id=? AND post_id=?)"
+        )
+
+    def test_follow_lookup(self):
+        follow = Follow.objects.filter(follower=self.viewer, follows=self.poster)
+        self.assert_uses_index(follow, "network_follow", "(follower_id=? AND follows_id=?)")
+
+
+"""
+FOLLOWING TIMELINE TESTS
+"""
+class TimelineTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.viewer = User.objects.create_user("viewer", "viewer@example.com", "password")
+        self.poster = User.objects.create_user("poster", "poster@example.com", "password")
+        self.stranger = User.objects.create_user("stranger", "stranger@example.com", "password")
+        self.old_post = Post.objects.create(poster=self.poster, body="before follow")
+        Post.objects.create(poster=self.stranger, body="not followed")
+
+    def following_feed(self):
+        self.client.force_login(self.viewer)
+        posts = self.client.get("/", {"following": "true", "cursor": ""}, **AJAX).json()
+        return [post["body"] for post in posts[:-1]]
+
+    # Post as the logged in user, and run the jobs the write queues
+    def write(self, url, data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(url, data)
+
+    def post_as(self, user, body):
+        self.client.force_login(user)
+        self.write("/new-post", {"new-post-body": body})
+
+    def test_follow_backfills_and_new_posts_fan_out(self):
+        self.client.force_login(self.viewer)
+        self.write(f"/follow/{self.poster.id}")
+        self.post_as(self.poster, "after follow")
+        self.post_as(self.stranger, "still not followed")
+        self.assertEqual(self.following_feed(), ["after follow", "before follow"])
+
+    def test_unfollow_removes_posts(self):
+        self.client.force_login(self.viewer)
+        self.write(f"/follow/{self.poster.id}")
+        self.write(f"/unfollow/{self.poster.id}")
+        self.assertEqual(self.following_feed(), [])
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.viewer).exists())
+
+    @override_settings(NETWORK_FANOUT_THRESHOLD=0)
+    def test_popular_posters_are_merged_on_read(self):
+        self.client.force_login(self.viewer)
+        self.write(f"/follow/{self.poster.id}")
+        self.post_as(self.poster, "after follow")
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.following_feed(), ["after follow", "before follow"])
+
+    @override_settings(NETWORK_TIMELINE_LENGTH=3)
+    def test_timeline_is_trimmed(self):
+        for i in range(5):
+            Post.objects.create(poster=self.poster, body=f"post {i}")
+        self.client.force_login(self.viewer)
+        self.write(f"/follow/{self.poster.id}")
+        self.assertEqual(self.following_feed(), ["post 4", "post 3", "post 2"])
+
+    @override_settings(NETWORK_TIMELINE_LENGTH=3, NETWORK_RATE_LIMITS={})
+    def test_fan_out_trims_timelines(self):
+        self.client.force_login(self.viewer)
+        self.write(f"/follow/{self.poster.id}")
+        for i in range(10):
+            self.post_as(self.poster, f"post {i}")
+        self.assertEqual(TimelineEntry.objects.filter(owner=self.viewer).count(), 3)
+        self.assertEqual(self.following_feed(), ["post 9", "post 8", "post 7"])
+
+
+"""
+FEED CACHE TESTS
+"""
+class FeedCacheTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.viewer = User.objects.create_user("viewer", "viewer@example.com", "password")
+        self.poster = User.objects.create_user("poster", "poster@example.com", "password")
+        self.post = Post.objects.create(poster=self.poster, body="hello")
+        self.client.force_login(self.viewer)
+
+    def feed(self):
+        return self.client.get("/", **AJAX).json()[:-1]
+
+    # Make a write request, running its on-commit cache invalidation
+    def write(self, url, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(url, **kwargs)
+
+    def test_warm_feed_skips_post_queries(self):
+        self.feed()
+        with CaptureQueriesContext(connection) as queries:
+            self.feed()
+        # session, user and the viewer's likes: no post queries
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(cache_counters()["page_hits"], 1)
+
+    def test_user_liked_is_per_viewer(self):
+        self.feed()
+        self.write(f"/like/{self.post.id}")
+        self.assertTrue(self.feed()[0]["user_liked"])
+        self.client.force_login(self.poster)
+        self.assertFalse(self.feed()[0]["user_liked"])
+        self.assertEqual(self.feed()[0]["likes_count"], 1)
+
+    def test_new_post_invalidates_feed(self):
+        self.feed()
+        self.write("/new-post", data={"new-post-body": "second"})
+        self.assertEqual([post["body"] for post in self.feed()], ["second", "hello"])
+
+    def test_edit_invalidates_post(self):
+        self.feed()
+        self.client.force_login(self.poster)
+        self.write(f"/edit/{self.post.id}", data={"new-post-body": "edited"}, content_type="application/json")
+        self.assertEqual(self.feed()[0]["body"], "edited")
+
+    def test_follow_invalidates_profile_header(self):
+        self.client.get(f"/profile/{self.poster.id}", **AJAX)
+        self.write(f"/follow/{self.poster.id}")
+        data = self.client.get(f"/profile/{self.poster.id}", **AJAX).json()
+        self.assertEqual(data["numFollowers"], 1)
+        self.assertTrue(data["activeUserFollows"])
+
+    def test_cache_stats_is_staff_only(self):
+        self.assertEqual(self.client.get("/cache-stats").status_code, 403)
+        User.objects.filter(pk=self.viewer.pk).update(is_staff=True)
+        self.feed()
+        self.assertEqual(self.client.get("/cache-stats").json()["page_misses"], 1)
+
+
+"""
+CONDITIONAL GET TESTS
+"""
+class ConditionalGetTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.viewer = User.objects.create_user("viewer", "viewer@example.com", "password")
+        self.post = Post.objects.create(poster=self.viewer, body="hello")
+        self.client.force_login(self.viewer)
+
+    def test_unchanged_feed_is_not_modified(self):
+        first = self.client.get("/", **AJAX)
+        self.assertIn("no-cache", first["Cache-Control"])
+        second = self.client.get("/", HTTP_IF_NONE_MATCH=first["ETag"], **AJAX)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.content, b"")
+        self.assertFalse(first.has_header("Last-Modified"))
+
+    def test_like_changes_validators(self):
+        first = self.client.get("/", **AJAX)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/like/{self.post.id}")
+        second = self.client.get("/", HTTP_IF_NONE_MATCH=first["ETag"], **AJAX)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second["ETag"], first["ETag"])
+        self.assertTrue(second.json()[0]["user_liked"])
+
+    def test_page_back_in_an_earlier_state_is_not_modified(self):
+        first = self.client.get("/", **AJAX)
+        for action in ("like", "unlike"):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(f"/{action}/{self.post.id}")
+        second = self.client.get("/", HTTP_IF_NONE_MATCH=first["ETag"], **AJAX)
+        self.assertEqual(second.status_code, 304)
+
+    def test_profile_is_not_modified(self):
+        url = f"/profile/{self.viewer.id}"
+        first = self.client.get(url, **AJAX)
+        second = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"], **AJAX)
+        self.assertEqual(second.status_code, 304)
+
+
+"""
+SEEDING AND BENCHMARK TESTS
+"""
+class SeedAndBenchmarkTests(NetworkTestCase):
+
+    def test_seed_network(self):
+        call_command("seed_network", users=30, posts=200, likes=500, seed=1, stdout=StringIO())
+        self.assertEqual(User.objects.filter(username__startswith="seed").count(), 30)
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertTrue(Follow.objects.exists())
+        self.assertTrue(TimelineEntry.objects.exists())
+        # the stored counters were recounted after the bulk inserts
+        self.assertEqual(repair_counters(), (0, 0))
+        # and the posts of the trending window were scored
+        recent = Post.objects.filter(timestamp__gte=timezone.now() - trending.window())
+        self.assertTrue(recent.exists())
+        self.assertEqual(TrendingScore.objects.count(), recent.count())
+        with self.assertRaises(CommandError):
+            call_command("seed_network", users=1, posts=1, likes=1, stdout=StringIO())
+
+    def test_benchmark_network(self):
+        call_command("seed_network", users=20, posts=50, likes=100, seed=1, stdout=StringIO())
+        out = StringIO()
+        call_command("benchmark_network", requests=3, viewers=2, seed=1, stdout=out, stderr=StringIO())
+        report = out.getvalue()
+        for endpoint in ("index", "following", "profile", "like_post", "unlike_post"):
+            self.assertIn(endpoint, report)
+
+    def test_benchmark_is_not_rate_limited_and_stops_on_errors(self):
+        call_command("seed_network", users=20, posts=50, likes=100, seed=1, stdout=StringIO())
+        # More likes and follows than the bursts of the default limits allow
+        results = Benchmark(requests=35, viewers=1, seed=1).run()
+        self.assertEqual(results["like_post"]["requests"], 35)
+        self.assertEqual(repair_counters(), (0, 0))
+
+        benchmark = Benchmark()
+        benchmark.client.force_login(User.objects.first())
+        with self.assertRaises(RuntimeError):
+            benchmark.measure("like_post", "post", "/like/999999")
+
+
+"""
+PERFORMANCE MIDDLEWARE TESTS
+"""
+@override_settings(NETWORK_PERF_ENABLED=True, NETWORK_PERF_SAMPLE_RATE=1.0)
+class PerformanceMiddlewareTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        aggregate.reset()
+        self.viewer = User.objects.create_user("viewer", "viewer@example.com", "password", is_staff=True)
+        Post.objects.create(poster=self.viewer, body="hello")
+        self.client.force_login(self.viewer)
+
+    def test_server_timing_header(self):
+        response = self.client.get("/", **AJAX)
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="\d+ queries", .*total;dur=[\d.]+$')
+        self.assertIn("serialize;dur=", response["Server-Timing"])
+
+    def test_aggregate_per_url_name(self):
+        for _ in range(3):
+            self.client.get("/", **AJAX)
+        stats = self.client.get("/perf-stats").json()
+        index = stats["views"]["index"]
+        self.assertEqual(index["requests"], 3)
+        self.assertGreater(index["avg_queries"], 0)
+        self.assertLessEqual(index["p50_ms"], index["p99_ms"])
+
+    @override_settings(NETWORK_PERF_SLOW_MS=0)
+    def test_slow_requests_are_dumped_with_sql(self):
+        with self.assertLogs("network.perf", "WARNING"):
+            self.client.get("/", **AJAX)
+        slow = aggregate.snapshot()["slow_requests"][0]
+        self.assertEqual(slow["url_name"], "index")
+        self.assertTrue(any("network_post" in sql for _, sql in slow["sql"]))
+
+    @override_settings(NETWORK_PERF_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_are_not_profiled(self):
+        response = self.client.get("/", **AJAX)
+        self.assertNotIn("Server-Timing", response)
+
+    @override_settings(NETWORK_PERF_ENABLED=False)
+    def test_disabled(self):
+        self.assertNotIn("Server-Timing", self.client.get("/", **AJAX))
+
+
+"""
+LIVE UPDATE TESTS
+"""
+class LiveEventTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user("author", "author@example.com", "password")
+        self.viewer = User.objects.create_user("viewer", "viewer@example.com", "password")
+        self.post = Post.objects.create(poster=self.author, body="hello")
+
+    def post_as(self, user, url, **kwargs):
+        self.client.force_login(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(url, **kwargs)
+
+    async def next_event(self, subscription):
+        return await asyncio.wait_for(subscription.get(), 1)
+
+    async def test_broker_delivers_events_published_from_other_threads(self):
+        broker = LocalBroker()
+        subscription = broker.subscribe()
+        thread = threading.Thread(target=broker.publish, args=({"type": "likes", "post_id": 1, "delta": 1},))
+        thread.start()
+        thread.join()
+        self.assertEqual((await self.next_event(subscription))["delta"], 1)
+        subscription.close()
+        self.assertFalse(broker.subscriptions)
+
+    async def test_views_publish_events(self):
+        subscription = get_broker().subscribe()
+        try:
+            await sync_to_async(self.post_as)(self.viewer, f"/like/{self.post.id}")
+            self.assertEqual(
+                await self.next_event(subscription),
+                {"type": "likes", "post_id": self.post.id, "delta": 1, "liker_id": self.viewer.id},
+            )
+            await sync_to_async(self.post_as)(self.viewer, f"/unlike/{self.post.id}")
+            self.assertEqual((await self.next_event(subscription))["delta"], -1)
+
+            await sync_to_async(self.post_as)(self.author, "/new-post", data={"new-post-body": "news"})
+            event = await self.next_event(subscription)
+            self.assertEqual((event["type"], event["poster_id"]), ("post", self.author.id))
+
+            await sync_to_async(self.post_as)(
+                self.author, f"/edit/{self.post.id}",
+                data={"new-post-body": "edited"}, content_type="application/json",
+            )
+            event = await self.next_event(subscription)
+            self.assertEqual((event["type"], event["body"]), ("edit", "edited"))
+        finally:
+            subscription.close()
+
+    def test_events_are_filtered_by_feed_and_posts_on_screen(self):
+        new_post = {"type": "post", "id": 9, "poster_id": self.author.id, "poster": "author"}
+        self.assertTrue(wants_event(new_post, "all", set()))
+        self.assertTrue(wants_event(new_post, "following", set(), {self.author.id}))
+        self.assertFalse(wants_event(new_post, "following", set(), {self.viewer.id}))
+        self.assertTrue(wants_event(new_post, f"user:{self.author.id}", set()))
+        self.assertFalse(wants_event(new_post, f"user:{self.viewer.id}", set()))
+
+        like = {"type": "likes", "post_id": self.post.id, "delta": 1, "liker_id": self.viewer.id}
+        self.assertTrue(wants_event(like, "all", {self.post.id}, user_id=self.author.id))
+        self.assertFalse(wants_event(like, "all", {self.post.id + 1}, user_id=self.author.id))
+        # The liker's own pages already show the new count
+        self.assertFalse(wants_event(like, "all", {self.post.id}, user_id=self.viewer.id))
+
+    async def test_stream_endpoint(self):
+        await sync_to_async(self.async_client.force_login)(self.viewer)
+        response = await self.async_client.get("/events", {"feed": "all", "posts": str(self.post.id)})
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = response.streaming_content
+        try:
+            self.assertEqual(await anext(stream), b"retry: 3000\n\n")
+            # Skipped: the post is not on screen
+            get_broker().publish({"type": "likes", "post_id": self.post.id + 1, "delta": 1, "liker_id": self.author.id})
+            # Skipped: the viewer's own like
+            get_broker().publish({"type": "likes", "post_id": self.post.id, "delta": 1, "liker_id": self.viewer.id})
+            get_broker().publish({"type": "likes", "post_id": self.post.id, "delta": 2, "liker_id": self.author.id})
+            chunk = await asyncio.wait_for(anext(stream), 1)
+            self.assertTrue(chunk.startswith(b"event: likes\ndata: "))
+            self.assertIn(f'"post_id": {self.post.id}'.encode(), chunk)
+            self.assertIn(b'"delta": 2', chunk)
+            # Who liked it is not sent
+            self.assertNotIn(b"liker", chunk)
+        finally:
+            await stream.aclose()
+
+    def test_stream_endpoint_needs_asgi(self):
+        # Under WSGI the stream would hold a worker for good
+        self.client.force_login(self.viewer)
+        response = self.client.get("/events", {"feed": "all"})
+        self.assertEqual(response.status_code, 204)
+
+    async def test_stream_endpoint_rejects_bad_requests(self):
+        response = await self.async_client.get("/events")
+        self.assertEqual(response.status_code, 401)
+        await sync_to_async(self.async_client.force_login)(self.viewer)
+        response = await self.async_client.get("/events", {"feed": "everything"})
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.get("/events", {"posts": "1,x"})
+        self.assertEqual(response.status_code, 400)
+
+
+"""
+ASYNC VIEW TESTS
+"""
+# The async client takes headers by name rather than as WSGI environ keys
+AJAX_HEADERS = {"X-Requested-With": "XMLHttpRequest"}
+
+
+class AsyncViewTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user("author", "author@example.com", "password")
+        self.viewer = User.objects.create_user("viewer", "viewer@example.com", "password")
+        Follow.objects.create(follower=self.viewer, follows=self.author)
+        repair_counters()
+        Post.objects.create(poster=self.author, body="hello")
+
+    async def test_feed_and_profile_through_async_client(self):
+        await sync_to_async(self.async_client.force_login)(self.viewer)
+        posts = (await self.async_client.get("/", {"cursor": ""}, headers=AJAX_HEADERS)).json()
+        self.assertEqual([post["body"] for post in posts[:-1]], ["hello"])
+
+        response = await self.async_client.get(f"/profile/{self.author.id}", {"cursor": ""}, headers=AJAX_HEADERS)
+        data = response.json()
+        self.assertEqual((data["userName"], data["numFollowers"]), ("author", 1))
+        self.assertTrue(data["activeUserFollows"])
+        self.assertEqual(data["activeUser"], "viewer")
+
+        response = await self.async_client.get(f"/profile/{self.author.id}", {"cursor": "bad"}, headers=AJAX_HEADERS)
+        self.assertEqual(response.status_code, 400)
+
+    async def test_anonymous_users_are_redirected(self):
+        response = await self.async_client.get(f"/profile/{self.author.id}", headers=AJAX_HEADERS)
+        self.assertRedirects(response, "/login", fetch_redirect_response=False)
+
+
+# Parallel reads (the default) use other threads' connections, which only see
+# committed data
+class ParallelReadTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user("author", "author@example.com", "password")
+        self.viewer = User.objects.create_user("viewer", "viewer@example.com", "password")
+        Follow.objects.create(follower=self.viewer, follows=self.author)
+        repair_counters()
+        Post.objects.create(poster=self.author, body="hello")
+
+    def test_profile_with_parallel_reads(self):
+        self.client.force_login(self.viewer)
+        data = self.client.get(f"/profile/{self.author.id}", {"cursor": ""}, **AJAX).json()
+        self.assertEqual([post["body"] for post in data["userPosts"][:-1]], ["hello"])
+        self.assertEqual(data["numFollowers"], 1)
+        self.assertTrue(data["activeUserFollows"])
+
+
+"""
+BATCHED WRITE TESTS
+"""
+class BatchTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.viewer = User.objects.create_user("viewer", "viewer@example.com", "password")
+        self.authors = [
+            User.objects.create_user(f"author{i}", f"author{i}@example.com", "password") for i in range(3)
+        ]
+        self.posts = [Post.objects.create(poster=author, body="hello") for author in self.authors]
+        self.client.force_login(self.viewer)
+
+    def send(self, *operations):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post("/batch", {"operations": list(operations)}, content_type="application/json")
+
+    def test_operations_are_applied_and_counted(self):
+        response = self.send(
+            {"op": "like", "post": self.posts[0].id},
+            {"op": "like", "post": self.posts[1].id},
+            {"op": "follow", "user": self.authors[0].id},
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["posts"][str(self.posts[0].id)], {"likes_count": 1, "user_liked": True})
+        self.assertEqual(data["users"][str(self.authors[0].id)], {"follower_count": 1, "activeUserFollows": True})
+        self.viewer.refresh_from_db()
+        self.assertEqual(self.viewer.following_count, 1)
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.viewer, post=self.posts[0]).exists())
+
+        data = self.send(
+            {"op": "unlike", "post": self.posts[0].id},
+            {"op": "unfollow", "user": self.authors[0].id},
+        ).json()
+        self.assertEqual(data["posts"][str(self.posts[0].id)]["likes_count"], 0)
+        self.assertEqual(data["users"][str(self.authors[0].id)]["follower_count"], 0)
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.viewer).exists())
+        self.assertEqual(repair_counters(), (0, 0))
+
+    def test_repeated_toggles_are_coalesced_and_idempotent(self):
+        post = self.posts[0]
+        data = self.send(
+            {"op": "like", "post": post.id},
+            {"op": "unlike", "post": post.id},
+            {"op": "like", "post": post.id},
+        ).json()
+        self.assertEqual(data["posts"][str(post.id)]["likes_count"], 1)
+        # Liking again changes nothing
+        data = self.send({"op": "like", "post": post.id}).json()
+        self.assertEqual(data["posts"][str(post.id)]["likes_count"], 1)
+        self.assertEqual(Like.objects.filter(post=post).count(), 1)
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        def count(operations):
+            with CaptureQueriesContext(connection) as queries:
+                self.send(*operations)
+            return len(queries)
+
+        trending.current_epoch()  # cached by the first like otherwise
+        one = count([{"op": "like", "post": self.posts[0].id}])
+        many = count([{"op": "like", "post": post.id} for post in self.posts[1:]])
+        self.assertEqual(one, many)
+
+    def test_invalid_batches(self):
+        for operations in ([], [{"op": "poke", "post": 1}], [{"op": "like", "post": "1"}],
+                           [{"op": "like", "post": 0}], [{"op": "like", "post": 10 ** 30}],
+                           [{"op": "follow", "user": -2 ** 63}], [{"op": "follow", "user": self.viewer.id}]):
+            response = self.send(*operations)
+            self.assertEqual(response.status_code, 400, operations)
+        response = self.client.post("/batch", "not json", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_targets_are_reported(self):
+        data = self.send({"op": "like", "post": 999999}, {"op": "follow", "user": 999999}).json()
+        self.assertEqual(data["not_found"], {"posts": [999999], "users": [999999]})
+
+
+"""
+PRODUCTION SQLITE TESTS
+"""
+class ProductionSqliteTests(NetworkTestCase):
+
+    @override_settings(NETWORK_SQLITE_PRODUCTION=True)
+    def test_pragmas_are_set_on_new_connections(self):
+        from django.db.backends.sqlite3.base import DatabaseWrapper
+
+        with tempfile.TemporaryDirectory() as directory:
+            settings_dict = {**connection.settings_dict, "NAME": os.path.join(directory, "db.sqlite3")}
+            wrapper = DatabaseWrapper(settings_dict, alias="pragma_test")
+            try:
+                with wrapper.cursor() as cursor:
+                    cursor.execute("PRAGMA journal_mode")
+                    self.assertEqual(cursor.fetchone()[0], "wal")
+                    cursor.execute("PRAGMA synchronous")
+                    # NORMAL
+                    self.assertEqual(cursor.fetchone()[0], 1)
+                    cursor.execute("PRAGMA busy_timeout")
+                    self.assertEqual(cursor.fetchone()[0], 20000)
+            finally:
+                wrapper.close()
+
+    def test_pragmas_are_left_alone_by_default(self):
+        from django.db.backends.sqlite3.base import DatabaseWrapper
+
+        with tempfile.TemporaryDirectory() as directory:
+            settings_dict = {**connection.settings_dict, "NAME": os.path.join(directory, "db.sqlite3")}
+            wrapper = DatabaseWrapper(settings_dict, alias="pragma_test")
+            try:
+                with wrapper.cursor() as cursor:
+                    cursor.execute("PRAGMA journal_mode")
+                    self.assertEqual(cursor.fetchone()[0], "delete")
+            finally:
+                wrapper.close()
+
+
+# The stress threads use connections of their own, which only see committed
+# data; they run on a copy of the test database in a file, since SQLite only
+# waits for locks (busy_timeout) and has WAL mode there, not in memory
+@override_settings(NETWORK_JOB_MODE="inline")
+class StressTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(f"user{i}", f"user{i}@example.com", "password") for i in range(3)]
+        for user in self.users:
+            Post.objects.create(poster=user, body="hello")
+
+    # Call function in a thread of its own, with new connections opening a
+    # copy of the test database in a file
+    def in_file_database(self, function):
+        result = {}
+
+        def run():
+            try:
+                result["value"] = function()
+            except Exception as e:
+                result["error"] = e
+            finally:
+                connections.close_all()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "stress.sqlite3")
+            connection.ensure_connection()
+            copy = sqlite3.connect(path)
+            connection.connection.backup(copy)
+            copy.close()
+            with mock.patch.dict(connections.settings["default"], {"NAME": path}):
+                thread = threading.Thread(target=run)
+                thread.start()
+                thread.join()
+        if "error" in result:
+            raise result["error"]
+        return result["value"]
+
+    def test_stress_compares_modes_and_leaves_the_database_as_it_was(self):
+        def stress():
+            results = compare_modes(writers=3, readers=2, seconds=0.5, seed=1)
+            return results, Post.objects.count(), repair_counters(), Job.objects.count()
+
+        results, posts, repaired, jobs = self.in_file_database(stress)
+        self.assertEqual(
+            [result["mode"] for result in results.values()], ["default", "production"]
+        )
+        for result in results.values():
+            self.assertGreater(result["writes"], 0)
+            self.assertGreater(result["reads_per_s"], 0)
+            self.assertEqual(result["reader_locked_errors"], 0)
+            self.assertEqual(result["jobs_failed"], 0)
+        # Writers wait on busy_timeout rather than failing
+        self.assertEqual(results["production"]["locked_errors"], 0)
+        self.assertLessEqual(results["production"]["locked_errors"], results["default"]["locked_errors"])
+        self.assertEqual((posts, repaired, jobs), (3, (0, 0), 0))
+
+
+"""
+READ REPLICA ROUTING TESTS
+"""
+@override_settings(NETWORK_REPLICAS=["replica1", "replica2"], NETWORK_REPLICA_STICKY_SECONDS=5)
+class ReplicaRoutingTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    # Run a request through the middleware, and return where its reads went
+    def route(self, request):
+        routed = {}
+
+        def get_response(request):
+            routed["post"] = self.router.db_for_read(Post)
+            routed["session"] = self.router.db_for_read(Session)
+            routed["write"] = self.router.db_for_write(Post)
+            return HttpResponse()
+
+        response = ReplicaRoutingMiddleware(get_response)(request)
+        return routed, response
+
+    def test_reads_go_to_the_primary_outside_requests(self):
+        self.assertEqual(self.router.db_for_read(Post), "default")
+
+    def test_get_requests_read_from_replicas(self):
+        routed, response = self.route(self.factory.get("/"))
+        self.assertIn(routed["post"], ["replica1", "replica2"])
+        self.assertEqual(routed["session"], "default")
+        self.assertEqual(routed["write"], "default")
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    def test_writes_pin_the_browser_to_the_primary(self):
+        routed, response = self.route(self.factory.post("/like/1"))
+        self.assertEqual(routed["post"], "default")
+        sticky = response.cookies[STICKY_COOKIE]
+
+        # The next reads see the write
+        request = self.factory.get("/")
+        request.COOKIES[STICKY_COOKIE] = sticky.value
+        routed, _ = self.route(request)
+        self.assertEqual(routed["post"], "default")
+
+        # Until the window has passed
+        request.COOKIES[STICKY_COOKIE] = str(time.time() - 1)
+        routed, _ = self.route(request)
+        self.assertIn(routed["post"], ["replica1", "replica2"])
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate("replica1", "network"))
+        self.assertIsNone(self.router.allow_migrate("default", "network"))
+
+    @override_settings(NETWORK_REPLICAS=[])
+    def test_middleware_is_unused_without_replicas(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaRoutingMiddleware(lambda request: HttpResponse())
+
+
+"""
+SEARCH TESTS
+"""
+class SearchTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.viewer = User.objects.create_user("viewer", "viewer@example.com", "password")
+        self.client.force_login(self.viewer)
+
+    def search(self, query, cursor=""):
+        return self.client.get("/search", {"q": query, "cursor": cursor}, **AJAX)
+
+    def bodies(self, response):
+        return [post["body"] for post in response.json()[:-1]]
+
+    def test_new_and_edited_posts_are_indexed(self):
+        post = Post.objects.create(poster=self.viewer, body="Gardening with tomatoes")
+        Post.objects.create(poster=self.viewer, body="Cooking pasta")
+        self.assertEqual(self.bodies(self.search("tomato")), ["Gardening with tomatoes"])
+
+        post.body = "Gardening with cucumbers"
+        post.save()
+        self.assertEqual(self.bodies(self.search("tomato")), [])
+        self.assertEqual(self.bodies(self.search("cucumbers")), ["Gardening with cucumbers"])
+
+        post.delete()
+        self.assertEqual(self.bodies(self.search("cucumbers")), [])
+
+    def test_results_are_ranked_and_in_the_feed_shape(self):
+        Post.objects.create(poster=self.viewer, body="one cat among many dogs and birds and fish")
+        best = Post.objects.create(poster=self.viewer, body="cat cat cat")
+        Like.objects.create(liker=self.viewer, post=best)
+        data = self.search("cat").json()
+        self.assertEqual(data[0]["body"], "cat cat cat")
+        self.assertTrue(data[0]["user_liked"])
+        self.assertEqual(set(data[0]), set(best.serialize()) | {"user_liked"})
+        self.assertEqual(data[-1], {"activeUser": "viewer", "next_cursor": None})
+
+    def test_cursor_pagination(self):
+        for i in range(25):
+            Post.objects.create(poster=self.viewer, body=f"kittens {'kittens ' * (i % 3)}{i}")
+        seen = []
+        cursor = ""
+        while cursor is not None:
+            data = self.search("kittens", cursor).json()
+            seen += [post["id"] for post in data[:-1]]
+            cursor = data[-1]["next_cursor"]
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(len(set(seen)), 25)
+
+    def test_query_syntax_is_not_interpreted(self):
+        Post.objects.create(poster=self.viewer, body="AND OR NOT (quotes)")
+        self.assertEqual(self.search('"AND OR NOT').status_code, 200)
+        self.assertEqual(self.search("!!!").status_code, 400)
+        self.assertEqual(self.search("x", cursor="bad").status_code, 400)
+
+    def test_rebuild_command_restores_missing_triggers(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER network_post_fts_insert")
+        Post.objects.create(poster=self.viewer, body="unindexed walrus")
+        self.assertEqual(self.bodies(self.search("walrus")), [])
+
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(self.bodies(self.search("walrus")), ["unindexed walrus"])
+        Post.objects.create(poster=self.viewer, body="another walrus")
+        self.assertEqual(len(self.bodies(self.search("walrus"))), 2)
+
+    def test_search_page_renders(self):
+        response = self.client.get("/search", {"q": "walrus"})
+        self.assertContains(response, 'data-search="walrus"')
+
+
+"""
+COMPACT WIRE FORMAT TESTS
+"""
+class CompactWireFormatTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user("author", "author@example.com", "password")
+        self.viewer = User.objects.create_user("viewer", "viewer@example.com", "password")
+        self.first = Post.objects.create(poster=self.author, body="first")
+        self.second = Post.objects.create(poster=self.author, body="second")
+        Like.objects.create(liker=self.viewer, post=self.second)
+        repair_counters()
+        self.client.force_login(self.viewer)
+
+    def test_envelope(self):
+        response = self.client.get("/", {"cursor": "", "format": "compact"}, **AJAX)
+        self.assertEqual(response["Content-Type"], COMPACT_MEDIA_TYPE)
+        data = response.json()
+        self.assertEqual(data["v"], 1)
+        self.assertEqual(data["me"], "viewer")
+        self.assertEqual(data["users"], {str(self.author.id): "author"})
+        self.assertNotIn("next", data)
+        second, first = data["posts"]
+        self.assertEqual(second, {
+            "id": self.second.id, "user": self.author.id, "body": "second",
+            "ts": int(self.second.timestamp.timestamp() * 1000), "likes": 1, "liked": True,
+        })
+        # Defaults are left out
+        self.assertEqual(set(first), {"id", "user", "body", "ts"})
+
+    def test_negotiated_by_accept_header(self):
+        response = self.client.get("/", {"cursor": ""}, HTTP_ACCEPT=COMPACT_MEDIA_TYPE, **AJAX)
+        self.assertEqual(response.json()["v"], 1)
+        self.assertIn("Accept", response["Vary"])
+        # The full format is still the default
+        response = self.client.get("/", {"cursor": ""}, **AJAX)
+        self.assertEqual(response.json()[-1]["activeUser"], "viewer")
+
+    def test_cached_posts_stay_fresh_in_both_formats(self):
+        self.client.get("/", {"cursor": ""}, **AJAX)
+        self.client.get("/", {"cursor": "", "format": "compact"}, **AJAX)
+        self.client.force_login(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/edit/{self.first.id}", {"new-post-body": "changed"}, content_type="application/json")
+        self.client.force_login(self.viewer)
+
+        data = self.client.get("/", {"cursor": "", "format": "compact"}, **AJAX).json()
+        edited = data["posts"][1]
+        self.assertEqual(edited["body"], "changed")
+        self.assertIn("edited_ts", edited)
+        full = self.client.get("/", {"cursor": "", "page": 1}, **AJAX).json()
+        self.assertEqual(full[1]["body"], "changed")
+
+    def test_compact_is_smaller(self):
+        for i in range(8):
+            Post.objects.create(poster=self.author, body=f"post {i}")
+        full = self.client.get("/", {"cursor": ""}, **AJAX)
+        compact = self.client.get("/", {"cursor": "", "format": "compact"}, **AJAX)
+        self.assertLess(len(compact.content), len(full.content) * 0.75)
+
+    def test_paging_and_search(self):
+        for i in range(12):
+            Post.objects.create(poster=self.author, body=f"walrus {i}")
+        data = self.client.get("/", {"cursor": "", "format": "compact"}, **AJAX).json()
+        page_two = self.client.get("/", {"cursor": data["next"], "format": "compact"}, **AJAX).json()
+        self.assertEqual(len(data["posts"]) + len(page_two["posts"]), 14)
+
+        data = self.client.get("/search", {"q": "walrus", "format": "compact"}, **AJAX).json()
+        self.assertEqual(len(data["posts"]), 10)
+        self.assertIn("next", data)
+
+    def test_profile(self):
+        url = f"/profile/{self.author.id}"
+        response = self.client.get(url, {"cursor": "", "format": "compact"}, **AJAX)
+        self.assertEqual(response["Content-Type"], COMPACT_MEDIA_TYPE)
+        data = response.json()
+        self.assertEqual((data["userName"], data["activeUser"], data["numFollowers"]), ("author", "viewer", 0))
+        self.assertEqual([post["body"] for post in data["userPosts"]["posts"]], ["second", "first"])
+        self.assertIsNone(data["next_cursor"])
+        # The full format is still the default
+        full = self.client.get(url, {"cursor": ""}, **AJAX).json()
+        self.assertEqual(full["userPosts"][-1]["activeUser"], "viewer")
+
+
+"""
+RATE LIMIT TESTS
+"""
+@override_settings(NETWORK_RATE_LIMITS={
+    "like_post": {"rate": "2/m"},
+    "register": {"rate": "1/h", "key": "ip"},
+    "login": "2/h",
+})
+class RateLimitTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user("user", "user@example.com", "password")
+        self.posts = [Post.objects.create(poster=self.user, body=f"post {i}") for i in range(3)]
+        self.client.force_login(self.user)
+
+    def test_writes_over_the_limit_get_429(self):
+        for post in self.posts[:2]:
+            self.assertEqual(self.client.post(f"/like/{post.id}").status_code, 201)
+        response = self.client.post(f"/like/{self.posts[2].id}")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "30")
+        self.assertFalse(Like.objects.filter(post=self.posts[2]).exists())
+
+    def test_buckets_are_per_user_and_reads_are_not_limited(self):
+        for post in self.posts[:2]:
+            self.client.post(f"/like/{post.id}")
+        for _ in range(5):
+            self.assertEqual(self.client.get("/", {"cursor": ""}, **AJAX).status_code, 200)
+
+        other = User.objects.create_user("other", "other@example.com", "password")
+        self.client.force_login(other)
+        self.assertEqual(self.client.post(f"/like/{self.posts[2].id}").status_code, 201)
+
+    def test_anonymous_requests_are_limited_per_ip(self):
+        self.client.logout()
+        data = {"username": "new", "email": "new@example.com", "password": "pw", "confirmation": "pw"}
+        self.assertEqual(self.client.post("/register", data, REMOTE_ADDR="10.0.0.1").status_code, 302)
+        self.client.logout()
+        data["username"] = "newer"
+        self.assertEqual(self.client.post("/register", data, REMOTE_ADDR="10.0.0.1").status_code, 429)
+        self.assertEqual(self.client.post("/register", data, REMOTE_ADDR="10.0.0.2").status_code, 302)
+        # Showing the form is free
+        self.assertEqual(self.client.get("/register", REMOTE_ADDR="10.0.0.1").status_code, 200)
+
+    def test_decorated_view_uses_the_configured_rate(self):
+        self.client.logout()
+        for _ in range(2):
+            self.client.post("/login", {"username": "user", "password": "wrong"})
+        self.assertEqual(self.client.post("/login", {"username": "user", "password": "wrong"}).status_code, 429)
+
+    def test_bucket_refills(self):
+        limit = Limit("60/m", burst=3)
+        now = 1000.0
+        for _ in range(3):
+            self.assertEqual(take_token("bucket", limit, now), 0)
+        self.assertAlmostEqual(take_token("bucket", limit, now), 1.0)
+        self.assertEqual(take_token("bucket", limit, now + 1), 0)
+        self.assertGreater(take_token("bucket", limit, now + 1), 0)
+        # A bucket left alone fills up to its burst size, and no further
+        for _ in range(3):
+            self.assertEqual(take_token("bucket", limit, now + 60), 0)
+        self.assertGreater(take_token("bucket", limit, now + 60), 0)
+
+    def test_invalid_rates(self):
+        for rate in ("10", "0/m", "10/w"):
+            with self.assertRaises(ValueError):
+                Limit(rate)
+
+
+"""
+BACKGROUND JOB TESTS
+"""
+class JobTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        jobs.reset_stats()
+        self.viewer = User.objects.create_user("viewer", "viewer@example.com", "password")
+        self.poster = User.objects.create_user("poster", "poster@example.com", "password")
+        Follow.objects.create(follower=self.viewer, follows=self.poster)
+        self.batches = []
+        jobs.HANDLERS["test"] = self.batches.append
+        self.addCleanup(jobs.HANDLERS.pop, "test")
+
+    @override_settings(NETWORK_JOB_MODE="worker")
+    def test_writes_queue_jobs_for_the_worker(self):
+        self.client.force_login(self.poster)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/new-post", {"new-post-body": "hello"})
+        self.assertEqual(list(Job.objects.values_list("kind", flat=True)), ["fan_out_post"])
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(jobs.stats()["due"], 1)
+
+        out = StringIO()
+        call_command("run_jobs", "--once", stdout=out)
+        self.assertIn("Ran 1 job(s).", out.getvalue())
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.viewer).exists())
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(NETWORK_JOB_MODE="worker")
+    def test_jobs_of_a_kind_are_batched(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for number in range(3):
+                jobs.enqueue("test", number=number)
+            jobs.enqueue("fan_out_post", post=0)
+            jobs.enqueue("test", number=3)
+        self.assertEqual(jobs.run_pending(), 5)
+        self.assertEqual(self.batches, [[{"number": 0}, {"number": 1}, {"number": 2}], [{"number": 3}]])
+        self.assertEqual(jobs.stats()["batches"], 3)
+
+    @override_settings(NETWORK_JOB_MODE="worker", NETWORK_JOB_MAX_ATTEMPTS=2)
+    def test_failed_jobs_are_retried_then_kept(self):
+        def fail(payloads):
+            raise RuntimeError("broken")
+        jobs.HANDLERS["test"] = fail
+        job_id = jobs.enqueue("test")
+
+        with self.assertLogs("network.jobs", "ERROR"):
+            self.assertEqual(jobs.run_jobs(), 1)
+        job = Job.objects.get(id=job_id)
+        self.assertEqual((job.attempts, job.failed, job.claimed_by), (1, False, ""))
+        self.assertEqual(job.last_error, "RuntimeError: broken")
+        # Backing off: not due yet
+        self.assertEqual(jobs.run_jobs(), 0)
+
+        Job.objects.update(run_after=job.created)
+        with self.assertLogs("network.jobs", "ERROR"):
+            jobs.run_jobs()
+        self.assertTrue(Job.objects.get(id=job_id).failed)
+        counters = jobs.stats()
+        self.assertEqual((counters["failed"], counters["retries"], counters["dead"]), (1, 1, 1))
+
+    @override_settings(NETWORK_JOB_MODE="worker")
+    def test_claimed_jobs_are_not_run_twice(self):
+        jobs.enqueue("test", number=1)
+        claimed = jobs.claim_jobs()
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(jobs.claim_jobs(), [])
+        jobs.run_claimed(claimed)
+        self.assertEqual(self.batches, [[{"number": 1}]])
+
+    def test_backfill_after_unfollow_is_skipped(self):
+        Post.objects.create(poster=self.poster, body="hello")
+        Follow.objects.all().delete()
+        jobs.backfill_timelines([{"owner": self.viewer.id, "followed": self.poster.id}])
+        self.assertFalse(TimelineEntry.objects.exists())
+
+
+"""
+STATIC ASSET TESTS
+"""
+class StaticAssetTests(NetworkTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.static_root = cls.enterClassContext(tempfile.TemporaryDirectory())
+        cls.enterClassContext(override_settings(
+            NETWORK_STATIC_PRODUCTION=True,
+            STATIC_ROOT=cls.static_root,
+            STORAGES={
+                "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+                "staticfiles": {"BACKEND": "network.assets.CompressedManifestStaticFilesStorage"},
+            },
+        ))
+        call_command("collectstatic", interactive=False, verbosity=0)
+
+    def hashed_url(self):
+        html = self.client.get("/login").content.decode()
+        return re.search(r'src="(/static/network/network\.[0-9a-f]{12}\.js)"', html)[1]
+
+    def test_pages_link_hashed_names(self):
+        self.assertTrue(os.path.exists(os.path.join(self.static_root, self.hashed_url()[len("/static/"):] + ".gz")))
+
+    def test_hashed_files_are_compressed_and_cached_forever(self):
+        response = self.client.get(self.hashed_url(), HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Content-Type"], "text/javascript")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertIn(b"function", gzip.decompress(response.content))
+
+        response = self.client.get(self.hashed_url(), HTTP_ACCEPT_ENCODING="gzip;q=0")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_unhashed_files_are_revalidated(self):
+        response = self.client.get("/static/network/styles.css")
+        self.assertEqual(response["Cache-Control"], "public, max-age=60")
+        self.assertEqual(int(response["Content-Length"]), len(response.content))
+        response = self.client.get("/static/network/styles.css", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_template_check(self):
+        self.assertEqual(check_static_references(), [])
+        names, hard_coded = static_references(
+            '{% static "network/app.js" %} <img src="/static/network/logo.png">', "/static/"
+        )
+        self.assertEqual(names, ["network/app.js"])
+        self.assertEqual(hard_coded, ["/static/network/logo.png"])
+
+
+"""
+FIRST PAGE RENDERING TESTS
+"""
+class FirstPageRenderingTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user("author", "author@example.com", "password")
+        self.viewer = User.objects.create_user("viewer", "viewer@example.com", "password")
+        for i in range(12):
+            Post.objects.create(poster=self.author, body=f"walrus {i}")
+        self.client.force_login(self.viewer)
+
+    def embedded(self, response, element_id):
+        match = re.search(rf'<script id="{element_id}" type="application/json">(.*?)</script>', response.content.decode())
+        return json.loads(match[1]) if match else None
+
+    def test_index_embeds_the_first_page(self):
+        response = self.client.get("/")
+        data = self.embedded(response, "initial-feed")
+        self.assertEqual(data, self.client.get("/", {"cursor": "", "format": "compact"}, **AJAX).json())
+        self.assertEqual(len(data["posts"]), 10)
+
+    def test_following_and_search_pages_embed_their_first_page(self):
+        data = self.embedded(self.client.get("/", {"following": "true"}), "initial-feed")
+        self.assertEqual(data["posts"], [])
+        data = self.embedded(self.client.get("/search", {"q": "walrus"}), "initial-feed")
+        self.assertEqual(len(data["posts"]), 10)
+        self.assertIn("next", data)
+        # A query without words is left to the AJAX request to report
+        self.assertIsNone(self.embedded(self.client.get("/search", {"q": "?"}), "initial-feed"))
+
+    def test_profile_embeds_the_header_and_first_page(self):
+        data = self.embedded(self.client.get(f"/profile/{self.author.id}"), "initial-profile")
+        self.assertEqual(data["userName"], "author")
+        self.assertFalse(data["activeUserFollows"])
+        self.assertEqual(len(data["userPosts"]["posts"]), 10)
+        self.assertEqual(data["next_cursor"], data["userPosts"]["next"])
+        self.assertEqual(self.client.get("/profile/999").status_code, 200)
+
+    @override_settings(NETWORK_SSR_FIRST_PAGE=False)
+    def test_can_be_turned_off(self):
+        self.assertIsNone(self.embedded(self.client.get("/"), "initial-feed"))
+
+
+"""
+SESSION AND USER CACHE TESTS
+"""
+class FastAuthTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user("user", "user@example.com", "password")
+        self.post = Post.objects.create(poster=self.user, body="hello")
+
+    # Queries of a warm AJAX feed request, and of a like
+    def count_queries(self):
+        self.client.force_login(self.user)
+        self.client.get("/", {"cursor": ""}, **AJAX)
+        with CaptureQueriesContext(connection) as feed:
+            self.assertEqual(self.client.get("/", {"cursor": ""}, **AJAX).status_code, 200)
+        with CaptureQueriesContext(connection) as like, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(f"/like/{self.post.id}").status_code, 201)
+        Like.objects.all().delete()
+        Post.objects.update(likes_count=0)
+        cache.clear()
+        return len(feed), len(like)
+
+    def test_cached_session_and_user_save_queries(self):
+        feed, like = self.count_queries()
+        for engine in ("cached_db", "signed_cookies"):
+            with self.subTest(engine=engine), override_settings(
+                SESSION_ENGINE=f"django.contrib.sessions.backends.{engine}", NETWORK_USER_CACHE_TIMEOUT=300
+            ):
+                self.client = self.client_class()
+                self.assertEqual(self.count_queries(), (feed - 2, like - 2))
+
+    @override_settings(NETWORK_USER_CACHE_TIMEOUT=300)
+    def test_password_change_ends_other_sessions(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get("/", {"cursor": ""}, **AJAX).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password("changed")
+            self.user.save()
+        self.assertEqual(self.client.get("/", {"cursor": ""}, **AJAX).status_code, 302)
+
+    @override_settings(NETWORK_USER_CACHE_TIMEOUT=300)
+    def test_cached_user_is_dropped_on_logout_and_follow(self):
+        self.client.force_login(self.user)
+        self.client.get("/", {"cursor": ""}, **AJAX)
+        self.assertIsNotNone(cache.get(f"network:user:{self.user.id}"))
+        other = User.objects.create_user("other", "other@example.com", "password")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/follow/{other.id}")
+        self.assertIsNone(cache.get(f"network:user:{self.user.id}"))
+
+        self.client.get("/", {"cursor": ""}, **AJAX)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get("/logout")
+        self.assertIsNone(cache.get(f"network:user:{self.user.id}"))
+
+
+"""
+FOLLOW SUGGESTION TESTS
+"""
+class SuggestionTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.users = {
+            name: User.objects.create_user(name, f"{name}@example.com", "password") for name in "abcdef"
+        }
+        for follower, follows in ["ab", "ac", "bd", "cd", "ce", "ea"]:
+            Follow.objects.create(follower=self.users[follower], follows=self.users[follows])
+        repair_counters()
+
+    def names(self, suggestions):
+        ids = {user.id: name for name, user in self.users.items()}
+        return [(ids[suggested], mutuals, follows_you) for suggested, _, mutuals, follows_you in suggestions]
+
+    def test_graph_and_scores(self):
+        graph = FollowGraph.load()
+        a = graph.index[self.users["a"].id]
+        self.assertEqual(sorted(graph.ids[node] for node in graph.following(a)),
+                         [self.users["b"].id, self.users["c"].id])
+        self.assertEqual(list(graph.followers(a)), [graph.index[self.users["e"].id]])
+        # e follows a back, and d is followed by both of a's followees
+        self.assertEqual(self.names(graph.suggestions(self.users["a"].id, 10)), [("e", 1, True), ("d", 2, False)])
+        # The part of the graph around a user gives the same suggestions
+        self.assertEqual(FollowGraph.around([self.users["a"].id]).suggestions(self.users["a"].id, 10),
+                         graph.suggestions(self.users["a"].id, 10))
+        self.assertEqual(graph.suggestions(self.users["f"].id, 10), [])
+
+    def test_served_from_the_stored_suggestions(self):
+        self.assertEqual(refresh_all(), (5, Suggestion.objects.count()))
+        self.client.force_login(self.users["a"])
+        with self.assertNumQueries(3):
+            data = self.client.get("/suggestions").json()
+        self.assertEqual([s["username"] for s in data["suggestions"]], ["e", "d"])
+        self.assertEqual(data["suggestions"][1], {"id": self.users["d"].id, "username": "d", "mutuals": 2,
+                                                  "follows_you": False})
+
+    def test_following_refreshes_the_followers_suggestions(self):
+        refresh_all()
+        self.client.force_login(self.users["a"])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/follow/{self.users['d'].id}")
+        self.assertEqual([s["username"] for s in self.client.get("/suggestions").json()["suggestions"]], ["e"])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/batch", {"operations": [{"op": "unfollow", "user": self.users["d"].id}]},
+                             content_type="application/json")
+        self.assertEqual([s["username"] for s in self.client.get("/suggestions").json()["suggestions"]],
+                         ["e", "d"])
+
+    def test_command(self):
+        out = StringIO()
+        call_command("refresh_suggestions", stdout=out, stderr=StringIO())
+        self.assertIn("for 5 user(s)", out.getvalue())
+
+
+"""
+TRENDING FEED TESTS
+"""
+@override_settings(NETWORK_RATE_LIMITS={})
+class TrendingTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.poster = User.objects.create_user("poster", "poster@example.com", "password")
+        self.fans = [User.objects.create_user(f"fan{i}", f"fan{i}@example.com", "password") for i in range(3)]
+        self.client.force_login(self.poster)
+        for number in range(12):
+            self.client.post("/new-post", {"new-post-body": f"Post {number}"})
+        self.posts = list(Post.objects.order_by("id"))
+
+    def like(self, user, post, unlike=False):
+        self.client.force_login(user)
+        self.client.post(f"/{'unlike' if unlike else 'like'}/{post.id}")
+
+    def feed_ids(self, cursor=""):
+        data = self.client.get("/", {"trending": "true", "cursor": cursor}, **AJAX).json()
+        return [post["id"] for post in data[:-1]], data[-1]["next_cursor"]
+
+    def test_new_posts_are_scored_newest_first(self):
+        self.assertEqual(TrendingScore.objects.count(), 12)
+        first, cursor = self.feed_ids()
+        second, last = self.feed_ids(cursor)
+        self.assertEqual(first + second, [post.id for post in reversed(self.posts)])
+        self.assertIsNone(last)
+
+    def test_likes_move_posts_up(self):
+        oldest, older = self.posts[0], self.posts[1]
+        for fan in self.fans:
+            self.like(fan, oldest)
+        self.like(self.fans[0], older)
+        ids, _ = self.feed_ids()
+        self.assertEqual(ids[:2], [oldest.id, older.id])
+        # Taking the likes back drops the post again, and never below zero
+        for fan in self.fans:
+            self.like(fan, oldest, unlike=True)
+        self.like(self.fans[0], oldest)
+        self.like(self.fans[0], oldest, unlike=True)
+        self.assertGreaterEqual(TrendingScore.objects.get(post=oldest).score, 0)
+        self.assertEqual(self.feed_ids()[0][0], older.id)
+
+    def test_batch_likes_are_recorded(self):
+        self.client.force_login(self.fans[0])
+        self.client.post("/batch", {"operations": [{"op": "like", "post": self.posts[0].id}]},
+                         content_type="application/json")
+        self.assertEqual(self.feed_ids()[0][0], self.posts[0].id)
+
+    def test_redecay_keeps_the_order(self):
+        self.like(self.fans[0], self.posts[3])
+        before = list(TrendingScore.objects.order_by("-score", "-post").values_list("post", "score"))
+        rescaled, dropped, added = trending.redecay(trending.current_epoch() + timedelta(hours=12))
+        self.assertEqual((rescaled, dropped, added), (12, 0, 0))
+        after = list(TrendingScore.objects.order_by("-score", "-post").values_list("post", "score"))
+        self.assertEqual([post for post, _ in after], [post for post, _ in before])
+        # Two half-lives later, every score is a quarter of what it was
+        for (_, old), (_, new) in zip(before, after):
+            self.assertAlmostEqual(new, old / 4)
+
+    def test_redecay_drops_old_posts_and_scores_new_ones(self):
+        Post.objects.filter(id=self.posts[0].id).update(timestamp=timezone.now() - timedelta(days=4))
+        unscored = Post.objects.create(poster=self.poster, body="Not scored yet", likes_count=5)
+        self.assertEqual(trending.redecay()[1:], (1, 1))
+        self.assertFalse(TrendingScore.objects.filter(post=self.posts[0]).exists())
+        # Its likes count as given with it
+        self.assertEqual(self.feed_ids()[0][0], unscored.id)
+
+    def test_a_stale_epoch_is_moved_before_weights_overflow(self):
+        post = self.posts[5]
+        TrendingEpoch.objects.update(epoch=timezone.now() - timedelta(days=300))
+        cache.clear()
+        with self.assertLogs("network.trending", "WARNING"), self.captureOnCommitCallbacks(execute=True):
+            self.like(self.fans[0], post)
+        self.assertAlmostEqual((timezone.now() - trending.current_epoch()).total_seconds(), 0, delta=60)
+        self.assertEqual(self.feed_ids()[0][0], post.id)
+        # The next like is weighed against the new epoch, without a warning
+        with self.assertNoLogs("network.trending", "WARNING"):
+            self.like(self.fans[1], post)
+
+    def test_likes_read_the_epoch_from_the_cache(self):
+        trending.current_epoch()
+        with CaptureQueriesContext(connection) as queries:
+            trending.record_likes(self.posts[0].id, 1)
+        self.assertFalse(any("trendingepoch" in query["sql"] for query in queries))
+
+    def test_cursors_survive_a_redecay(self):
+        self.like(self.fans[0], self.posts[3])
+        first, cursor = self.feed_ids()
+        with self.captureOnCommitCallbacks(execute=True):
+            trending.redecay(trending.current_epoch() + timedelta(hours=1))
+        second, _ = self.feed_ids(cursor)
+        # The cursor's score is scaled like the stored ones: no post repeated or skipped
+        self.assertEqual(sorted(first + second), sorted(post.id for post in self.posts))
+
+    def test_stored_scores_match_the_aggregate(self):
+        for fan, post in zip(self.fans, self.posts[2:5]):
+            self.like(fan, post)
+        self.like(self.fans[1], self.posts[2])
+        self.assertEqual(trending.rebuild(), 12)
+        stored = list(trending.trending_posts().order_by("-trending_score", "-trending_post")[:10])
+        self.assertEqual(stored, trending.aggregate_trending(10))
+
+    def test_command(self):
+        out = StringIO()
+        call_command("update_trending", stdout=out)
+        self.assertIn("Decayed 12 score(s)", out.getvalue())
+        call_command("update_trending", "--rebuild", stdout=out)
+        self.assertIn("Scored 12 recent post(s)", out.getvalue())
+
+
+"""
+EXPORT AND IMPORT TESTS
+"""
+class TransferTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.users = {name: User.objects.create_user(name, f"{name}@example.com", "password") for name in "abc"}
+        for follower, follows in ["ab", "ac", "ba"]:
+            Follow.objects.create(follower=self.users[follower], follows=self.users[follows])
+        for name in "abc":
+            Post.objects.create(poster=self.users[name], body=f"Post by {name}")
+        Post.objects.filter(poster=self.users["a"]).update(edited=True, edited_timestamp=timezone.now())
+        for liker, poster in ["ab", "ac", "cb"]:
+            Like.objects.create(liker=self.users[liker], post=Post.objects.get(poster=self.users[poster]))
+        repair_counters()
+
+    def snapshot(self):
+        return {
+            "users": sorted(User.objects.values_list("username", "password", "followers_count", "following_count")),
+            "posts": sorted(Post.objects.values_list("poster__username", "body", "timestamp", "edited",
+                                                     "edited_timestamp", "likes_count")),
+            "follows": sorted(Follow.objects.values_list("follower__username", "follows__username")),
+            "likes": sorted(Like.objects.values_list("liker__username", "post__body")),
+            "timelines": sorted(TimelineEntry.objects.values_list("owner__username", "post__body")),
+        }
+
+    def export(self):
+        output = BytesIO()
+        export_data(output)
+        return output.getvalue()
+
+    def test_round_trip(self):
+        for user in self.users.values():
+            rebuild_timeline(user)
+        before = self.snapshot()
+        data = self.export()
+        self.assertEqual(data.count(b"\n"), 1 + 3 + 3 + 3 + 3)
+
+        User.objects.all().delete()
+        importer = import_data(BytesIO(data), batch_size=2)
+        self.assertEqual(importer.progress.counts, {"user": 3, "post": 3, "follow": 3, "like": 3})
+        self.assertEqual(self.snapshot(), before)
+        self.assertEqual(TrendingScore.objects.count(), 3)
+
+    def test_existing_users_are_matched_by_username(self):
+        data = self.export()
+        Follow.objects.all().delete()
+        importer = import_data(BytesIO(data))
+        self.assertEqual(importer.matched, 3)
+        self.assertEqual(User.objects.count(), 3)
+        self.assertEqual(Post.objects.count(), 6)
+        self.assertEqual(Follow.objects.count(), 3)
+        # Only the rows inserted are counted: the likes are of the new posts
+        self.assertEqual(importer.progress.counts, {"user": 0, "post": 3, "follow": 3, "like": 3})
+        self.assertEqual(import_data(BytesIO(data)).progress.counts["follow"], 0)
+        self.assertEqual(User.objects.get(username="a").following_count, 2)
+
+    def test_rows_referring_to_missing_rows_are_skipped(self):
+        data = self.export() + b'{"type":"like","liker":999,"post":1}\n'
+        importer = import_data(BytesIO(data))
+        self.assertEqual(importer.skipped, 1)
+        self.assertEqual(importer.progress.counts["like"], 3)
+
+    def test_invalid_files(self):
+        data = self.export()
+        header, rest = data.split(b"\n", 1)
+        lines = rest.splitlines(keepends=True)
+        for invalid in (b"", rest, header + b"\n" + b"not json\n",
+                        header + b"\n" + lines[-1] + lines[0],
+                        header + b"\n" + lines[1] + lines[0],
+                        header + b'\n{"type":"user","id":1}\n',
+                        header + b"\n" + lines[0].replace(b'"id":', b'"id":"x').replace(b',"username"', b'","username"'),
+                        header + b"\n" + lines[0] + re.sub(rb'"timestamp":"[^"]*"', b'"timestamp":null', lines[3])):
+            with self.assertRaises(InvalidExport):
+                import_data(BytesIO(invalid))
+
+    def test_commands(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "network.ndjson.gz")
+            out = StringIO()
+            call_command("export_network", path, stdout=out, stderr=StringIO())
+            self.assertIn("Exported 3 user(s), 3 post(s)", out.getvalue())
+            with gzip.open(path) as file:
+                self.assertEqual(json.loads(file.readline()), {"format": "network", "version": 1})
+
+            User.objects.all().delete()
+            out = StringIO()
+            call_command("import_network", path, stdout=out, stderr=StringIO())
+            self.assertIn("Imported 3 user(s), 3 post(s), 3 follow(s), 3 like(s)", out.getvalue())
+            with self.assertRaises(CommandError):
+                call_command("import_network", os.path.join(directory, "missing.ndjson"), stderr=StringIO())
+            # A file cut short
+            with open(path, "rb") as file:
+                data = file.read()
+            with open(path, "wb") as file:
+                file.write(data[:len(data) // 2])
+            with self.assertRaises(CommandError):
+                call_command("import_network", path, stderr=StringIO())
+
+
+"""
+ADMIN TESTS
+"""
+@mock.patch("network.pagination.EXACT_COUNT_LIMIT", 3)
+class AdminTests(NetworkTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.alice = User.objects.create_user("alice", "alice@example.com", "password")
+        self.spammer = User.objects.create_user("spammer", "spammer@example.com", "password")
+        self.client.force_login(self.spammer)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/follow/" + str(self.alice.id))
+            for number in range(3):
+                self.client.post("/new-post", {"new-post-body": f"Spam {number}"})
+        self.client.force_login(self.alice)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/follow/" + str(self.spammer.id))
+            self.client.post("/new-post", {"new-post-body": "Hello"})
+            self.alice_post = Post.objects.get(poster=self.alice)
+            self.client.post(f"/like/{Post.objects.filter(poster=self.spammer).first().id}")
+        self.client.force_login(self.spammer)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/like/{self.alice_post.id}")
+        self.client.force_login(self.admin)
+
+    def test_estimated_count(self):
+        self.assertEqual(EstimatedCountPaginator(Post.objects.order_by("id"), 10).count, Post.objects.latest("id").id)
+        # A filtered list is counted up to the limit
+        self.assertEqual(EstimatedCountPaginator(Post.objects.filter(poster=self.spammer).order_by("id"), 10).count, 3)
+        self.assertEqual(EstimatedCountPaginator(Post.objects.filter(poster=self.alice).order_by("id"), 10).count, 1)
+        self.assertEqual(EstimatedCountPaginator(Like.objects.order_by("id"), 10).count, 2)
+
+    def test_changelists_do_not_count_the_tables(self):
+        for url in ("/admin/network/post/", "/admin/network/post/?poster=spammer", "/admin/network/like/",
+                    "/admin/network/follow/?follower=alice", "/admin/network/user/?q=alice"):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            counts = [query["sql"] for query in queries.captured_queries if "COUNT(" in query["sql"]]
+            self.assertTrue(all("LIMIT" in sql for sql in counts), counts)
+
+    def test_user_forms_hash_the_password(self):
+        response = self.client.post("/admin/network/user/add/", {
+            "username": "bob", "password1": "a-long-password", "password2": "a-long-password",
+            "usable_password": "true",
+        })
+        self.assertEqual(response.status_code, 302)
+        bob = User.objects.get(username="bob")
+        self.assertNotEqual(bob.password, "a-long-password")
+        self.assertTrue(bob.check_password("a-long-password"))
+        response = self.client.get(f"/admin/network/user/{bob.id}/change/")
+        self.assertContains(response, "../password/")
+
+    def test_username_filter(self):
+        response = self.client.get("/admin/network/post/", {"poster": "alice"})
+        self.assertEqual(list(response.context["cl"].result_list), [self.alice_post])
+        self.assertContains(response, 'name="poster" value="alice"')
+
+    def test_delete_spammer_content(self):
+        score = TrendingScore.objects.get(post=self.alice_post).score
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/admin/network/user/", {
+                "action": "delete_users_content", "_selected_action": [self.spammer.id],
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Post.objects.filter(poster=self.spammer).exists())
+        self.assertFalse(Like.objects.exists())
+        self.alice_post.refresh_from_db()
+        self.assertEqual(self.alice_post.likes_count, 0)
+        self.assertLess(TrendingScore.objects.get(post=self.alice_post).score, score)
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.alice).exists())
+        self.assertEqual(repair_counters(), (0, 0))
+
+    def test_delete_selected_likes_and_follows(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/admin/network/like/", {
+                "action": "delete_selected_likes", "_selected_action": list(Like.objects.values_list("id", flat=True)),
+            })
+            self.client.post("/admin/network/follow/", {
+                "action": "delete_selected_follows",
+                "_selected_action": list(Follow.objects.filter(follower=self.alice).values_list("id", flat=True)),
+            })
+        self.assertFalse(Like.objects.exists())
+        self.assertFalse(Follow.objects.filter(follower=self.alice).exists())
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.alice, post__poster=self.spammer).exists())
+        self.assertEqual(repair_counters(), (0, 0))
+        self.assertEqual(User.objects.get(id=self.alice.id).following_count, 0)
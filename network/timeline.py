@@ -0,0 +1,160 @@
+from django.conf import settings
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+from .models import User, Post, Follow, TimelineEntry
+
+"""
+FOLLOWING FEED TIMELINES
+
+    Each user's Following feed is stored as TimelineEntry rows, so reading it
+    is a range scan on the viewer's own timeline instead of merging the posts
+    of everyone they follow.
+
+    - fan_out_post() writes a new post into the timelines of its poster's
+      followers, and trims them
+    - backfill_timeline() adds a newly followed user's recent posts to a timeline
+    - remove_from_timeline() takes an unfollowed user's posts back out
+
+    Users with more than NETWORK_FANOUT_THRESHOLD followers are not fanned out,
+    since one post would mean writing that many rows. Their posts are merged into
+    their followers' feeds when the feed is read (fan-out on read) instead.
+
+    Timelines keep the newest NETWORK_TIMELINE_LENGTH entries; older posts drop
+    off the Following feed. The rebuild_timelines command rebuilds every timeline
+    from the Follow table, e.g. after the threshold is changed.
+
+"""
+FANOUT_BATCH_SIZE = 500
+
+
+def fanout_threshold():
+    return getattr(settings, "NETWORK_FANOUT_THRESHOLD", 1000)
+
+
+def timeline_length():
+    return getattr(settings, "NETWORK_TIMELINE_LENGTH", 800)
+
+
+def is_fanned_out(user):
+    return user.followers_count <= fanout_threshold()
+
+
+# Write a new post into the timeline of every follower of its poster, and
+# trim those timelines back to their maximum length
+def fan_out_post(post):
+    if not is_fanned_out(post.poster):
+        return 0
+
+    followers = (
+        Follow.objects.filter(follows=post.poster_id)
+        .values_list("follower", flat=True)
+        .iterator(chunk_size=FANOUT_BATCH_SIZE)
+    )
+    written = 0
+    batch = []
+    for follower_id in followers:
+        batch.append(TimelineEntry(owner_id=follower_id, post_id=post.id, timestamp=post.timestamp))
+        if len(batch) == FANOUT_BATCH_SIZE:
+            written += _write_entries(batch)
+            batch = []
+    if batch:
+        written += _write_entries(batch)
+    return written
+
+
+def _write_entries(entries):
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+    trim_timelines([entry.owner_id for entry in entries])
+    return len(entries)
+
+
+# Add the recent posts of a newly followed user to the follower's timeline,
+# then trim the timeline back to its maximum length
+def backfill_timeline(owner_id, followed):
+    if not is_fanned_out(followed):
+        return
+    recent_posts = (
+        Post.objects.filter(poster=followed)
+        .order_by("-timestamp", "-id")
+        .values_list("id", "timestamp")[:timeline_length()]
+    )
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner_id=owner_id, post_id=post_id, timestamp=timestamp)
+         for post_id, timestamp in recent_posts],
+        batch_size=FANOUT_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    trim_timeline(owner_id)
+
+
+# Take the posts of unfollowed users back out of the follower's timeline
+def remove_from_timeline(owner_id, unfollowed_ids):
+    # unfollowed_ids may be a single ID or a list of IDs
+    if isinstance(unfollowed_ids, int):
+        unfollowed_ids = [unfollowed_ids]
+    TimelineEntry.objects.filter(owner=owner_id, post__poster__in=unfollowed_ids).delete()
+
+
+# Drop the entries beyond the newest timeline_length() from a timeline
+def trim_timeline(owner_id):
+    entries = TimelineEntry.objects.filter(owner=owner_id)
+    oldest_kept = (
+        entries.order_by("-timestamp", "-post")
+        .values_list("timestamp", flat=True)[timeline_length() - 1:timeline_length()]
+    )
+    oldest_kept = list(oldest_kept)
+    if oldest_kept:
+        entries.filter(timestamp__lt=oldest_kept[0]).delete()
+
+
+# Drop the entries beyond the newest timeline_length() from several
+# timelines at once, numbering each timeline's entries newest first
+def trim_timelines(owner_ids):
+    beyond = (
+        TimelineEntry.objects.filter(owner__in=owner_ids)
+        .annotate(position=Window(
+            RowNumber(), partition_by=F("owner"), order_by=[F("timestamp").desc(), F("post").desc()]
+        ))
+        .filter(position__gt=timeline_length())
+        .values_list("id", flat=True)
+    )
+    dropped = list(beyond)
+    if dropped:
+        TimelineEntry.objects.filter(id__in=dropped).delete()
+
+
+# Rebuild a user's timeline from scratch from the users they follow
+def rebuild_timeline(owner):
+    TimelineEntry.objects.filter(owner=owner).delete()
+    followed = User.objects.filter(followers__follower=owner)
+    for user in followed:
+        backfill_timeline(owner.id, user)
+
+
+# The Following feed is ordered on the timeline's own columns, which
+# following_posts() annotates onto the posts
+TIMELINE_ORDERING = ("feed_timestamp", "feed_id")
+
+
+# Return the posts of the user's Following feed as a Post queryset, to be
+# ordered by TIMELINE_ORDERING: their timeline, plus the posts of any followed
+# users who are not fanned out
+def following_posts(user):
+    merged_on_read = list(
+        Follow.objects.filter(follower=user, follows__followers_count__gt=fanout_threshold())
+        .values_list("follows", flat=True)
+    )
+
+    # Read the timeline in its index order, so a page is a range scan
+    if not merged_on_read:
+        return Post.objects.filter(timeline_entries__owner=user).annotate(
+            feed_timestamp=F("timeline_entries__timestamp"),
+            feed_id=F("timeline_entries__post"),
+        )
+
+    timeline = TimelineEntry.objects.filter(owner=user).values("post")
+    return Post.objects.filter(Q(id__in=timeline) | Q(poster__in=merged_on_read)).annotate(
+        feed_timestamp=F("timestamp"),
+        feed_id=F("id"),
+    )
@@ -0,0 +1,229 @@
+import heapq
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Post, TrendingScore, TrendingEpoch
+from .pagination import InvalidCursor, decode_values, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+"""
+TRENDING POSTS
+
+    A post's trending score is its weight plus the weight of each of its likes,
+    every weight halving each NETWORK_TRENDING_HALF_LIFE_HOURS after it was
+    given. Since everything decays at the same rate, the scores are stored as
+    of one moment, the epoch: a like at time t adds 2 ** ((t - epoch) / half-life),
+    and the order of the stored scores is the order of the scores right now.
+    The trending feed is then a range scan down the score index, and a like
+    is a single F() increment, like the likes counter:
+
+    - new_post adds the post's row (add_post)
+    - like_post, unlike_post and /batch add or take away a like's weight
+      (record_likes), in the same transaction as the Like row
+    - the update_trending command moves the epoch to now, scaling every
+      score down in one UPDATE, drops the posts older than
+      NETWORK_TRENDING_WINDOW_HOURS and scores the recent posts that have no
+      row yet. Run it regularly (e.g. hourly): the weights of new likes grow
+      with the time since the epoch. Should it not run for MAX_HALVINGS
+      half-lives (16 days by default), the next like or post moves the epoch
+      itself, with a warning, before the weights lose precision or overflow.
+
+    Which like an unlike takes back is not known, so it takes away the weight
+    of a like given now, and a score never goes below zero. Posts scored by
+    update_trending count their existing likes as given with the post.
+
+    The epoch is kept in the cache named by NETWORK_CACHE_ALIAS, so a like
+    costs no query to read it. Where that cache is per process, the other
+    processes see a new epoch up to NETWORK_CACHE_TIMEOUT seconds late, and
+    weigh the likes of that time as if given that much later.
+
+    A feed cursor holds a stored score, so it also holds the epoch of that
+    score, and a cursor issued before update_trending is scaled to the new
+    epoch (see read_cursor) rather than pointing at the wrong place.
+
+"""
+POST_WEIGHT = 1.0
+LIKE_WEIGHT = 1.0
+
+REBUILD_BATCH_SIZE = 1000
+
+# How many half-lives a weight may grow by before the epoch is moved: 2 ** 64
+# keeps them far from the float limit (2 ** 1024)
+MAX_HALVINGS = 64
+
+# The trending feed is ordered by score; the post ID breaks ties
+TRENDING_ORDERING = ("trending_score", "trending_post")
+
+
+def half_life_hours():
+    return getattr(settings, "NETWORK_TRENDING_HALF_LIFE_HOURS", 6)
+
+
+def window():
+    return timedelta(hours=getattr(settings, "NETWORK_TRENDING_WINDOW_HOURS", 72))
+
+
+def halvings(moment, epoch):
+    return (moment - epoch).total_seconds() / 3600 / half_life_hours()
+
+
+# How much more a weight given at moment counts than one given at epoch
+def growth(moment, epoch):
+    return 2 ** halvings(moment, epoch)
+
+
+def initial_score(timestamp, likes, epoch):
+    return (POST_WEIGHT + LIKE_WEIGHT * likes) * growth(timestamp, epoch)
+
+
+EPOCH_KEY = "network:trending-epoch"
+
+
+def _cache():
+    return caches[getattr(settings, "NETWORK_CACHE_ALIAS", "default")]
+
+
+def _load_epoch():
+    state, _ = TrendingEpoch.objects.get_or_create(pk=1, defaults={"epoch": timezone.now()})
+    return state.epoch
+
+
+# The moment the stored scores are measured at; the first call starts it now
+def current_epoch():
+    epoch = _cache().get(EPOCH_KEY)
+    if epoch is None:
+        epoch = _load_epoch()
+        _cache().set(EPOCH_KEY, epoch, getattr(settings, "NETWORK_CACHE_TIMEOUT", 300))
+    return epoch
+
+
+def _epoch_changed():
+    transaction.on_commit(lambda: _cache().delete(EPOCH_KEY))
+
+
+# The epoch to weigh something given at moment against, moved to moment first
+# if the weights would otherwise grow too big
+def _epoch_for(moment):
+    epoch = current_epoch()
+    if halvings(moment, epoch) > MAX_HALVINGS:
+        logger.warning("The trending epoch is %s old; run update_trending regularly", moment - epoch)
+        redecay(moment)
+        # The cached epoch is only dropped once this transaction commits
+        epoch = _load_epoch()
+    return epoch
+
+
+def add_post(post):
+    TrendingScore.objects.create(post=post, score=initial_score(post.timestamp, 0, _epoch_for(post.timestamp)))
+
+
+# Add (delta > 0) or take away (delta < 0) delta likes given now to posts.
+# Call it inside the transaction of the Like insert or delete, after it.
+def record_likes(post_ids, delta, now=None):
+    if isinstance(post_ids, int):
+        post_ids = [post_ids]
+    if not post_ids:
+        return
+    now = now or timezone.now()
+    weight = delta * LIKE_WEIGHT * growth(now, _epoch_for(now))
+    TrendingScore.objects.filter(post__in=post_ids).update(score=Greatest(F("score") + weight, Value(0.0)))
+
+
+def trending_posts():
+    return Post.objects.filter(trending__isnull=False).annotate(
+        trending_score=F("trending__score"), trending_post=F("trending__post")
+    )
+
+
+# Score the posts of the window that have no row yet
+def _add_missing(epoch):
+    posts = Post.objects.filter(timestamp__gte=epoch - window(), trending__isnull=True)
+    rows = [
+        TrendingScore(post_id=post_id, score=initial_score(timestamp, likes, epoch))
+        for post_id, timestamp, likes in posts.values_list("id", "timestamp", "likes_count").iterator(
+            chunk_size=REBUILD_BATCH_SIZE
+        )
+    ]
+    TrendingScore.objects.bulk_create(rows, batch_size=REBUILD_BATCH_SIZE, ignore_conflicts=True)
+    return len(rows)
+
+
+# Move the epoch to now; returns (rescaled, dropped, added) row counts.
+# A like recorded while this runs may be counted as of the old epoch, which
+# weighs it by the decay since then: about 12% more when run hourly with
+# the default half-life.
+def redecay(now=None):
+    now = now or timezone.now()
+    with transaction.atomic():
+        state, _ = TrendingEpoch.objects.select_for_update().get_or_create(pk=1, defaults={"epoch": now})
+        # Multiplied by the inverse, which goes to 0 rather than overflowing
+        # however old the epoch is
+        rescaled = TrendingScore.objects.update(score=F("score") * 2 ** -halvings(now, state.epoch))
+        dropped, _ = TrendingScore.objects.filter(post__timestamp__lt=now - window()).delete()
+        state.epoch = now
+        state.save(update_fields=["epoch"])
+        _epoch_changed()
+        added = _add_missing(now)
+    return rescaled, dropped, added
+
+
+# Rescore every post of the window from its likes counter; returns the number of posts
+def rebuild(now=None):
+    now = now or timezone.now()
+    with transaction.atomic():
+        TrendingScore.objects.all().delete()
+        TrendingEpoch.objects.update_or_create(pk=1, defaults={"epoch": now})
+        _epoch_changed()
+        return _add_missing(now)
+
+
+"""
+FEED CURSORS
+"""
+# A trending feed cursor is the keyset cursor's (score, post ID) plus the
+# epoch of the score. Add the epoch to a keyset cursor
+def write_cursor(token, epoch):
+    if not token:
+        return token
+    return encode_cursor([*decode_values(token, 2), epoch])
+
+
+# Return the keyset cursor of a trending feed cursor, with its score scaled
+# to the current epoch as redecay scaled the stored scores
+def read_cursor(token):
+    if not token:
+        return token
+    score, post_id, epoch = decode_values(token, 3)
+    try:
+        epoch = parse_datetime(epoch) if isinstance(epoch, str) else None
+    except ValueError:
+        epoch = None
+    if epoch is None or not isinstance(score, (int, float)) or isinstance(score, bool):
+        raise InvalidCursor("Malformed cursor.")
+    current = current_epoch()
+    if epoch != current:
+        score *= 2 ** -halvings(current, epoch)
+    return encode_cursor([score, post_id])
+
+
+# The best posts of the window computed from the Like table on every call,
+# as it would be without the stored scores; the benchmark compares the two
+def aggregate_trending(limit, now=None):
+    now = now or timezone.now()
+    posts = (
+        Post.objects.filter(timestamp__gte=now - window())
+        .annotate(likes=Count("likes_of_post"))
+        .values_list("id", "timestamp", "likes")
+    )
+    best = heapq.nlargest(limit, posts, key=lambda row: (initial_score(row[1], row[2], now), row[0]))
+    found = Post.objects.select_related("poster").in_bulk([post_id for post_id, _, _ in best])
+    return [found[post_id] for post_id, _, _ in best]
@@ -18,4 +18,11 @@ urlpatterns = [
     path('follow/<int:userID>', views.follow_user, name="follow_user"),
     path('unfollow/<int:userID>', views.unfollow_user, name="unfollow_user"),
     path('edit/<int:post_id>', views.edit, name="edit"),
+    path('search', views.search, name="search"),
+    path('suggestions', views.suggestions, name="suggestions"),
+    path('batch', views.batch, name="batch"),
+    path('events', views.live_events, name="live_events"),
+    path('cache-stats', views.cache_stats, name="cache_stats"),
+    path('perf-stats', views.perf_stats, name="perf_stats"),
+    path('job-stats', views.job_stats, name="job_stats"),
 ]
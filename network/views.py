@@ -1,9 +1,14 @@
+import asyncio
 import json
+import re
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db import IntegrityError
-from django.http import JsonResponse
+from django.db import IntegrityError, close_old_connections, transaction
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import HttpResponseRedirect, render
 from django.urls import reverse
 from django.db.models.query import QuerySet
@@ -11,89 +16,271 @@ from django.views.decorators.http import require_POST
 from django.utils import timezone
 from django.core.paginator import Paginator
 
-from .models import User, Post, Follow, Like
+from .models import User, Post, Follow, Like, Suggestion
+from .counters import change_likes_count, change_follow_counts
+from .pagination import InvalidCursor, keyset_page
+from .caching import (
+    feed_name, get_feed_page, get_profile_header, feed_changed, posts_changed, profiles_changed,
+    stats as cache_counters
+)
+from .conditional import conditional_json
+from .wire import compact_envelope, compact_response, wants_compact
+from .perf import aggregate, timer
+from .ratelimit import rate_limit
+from .search import InvalidSearch, search_posts
+from .batch import InvalidBatch, parse_operations, apply_operations
+from .events import get_broker, event_stream, post_created, likes_changed, post_edited
+from .timeline import TIMELINE_ORDERING, following_posts
+from .jobs import enqueue, stats as job_counters
+from .graph import suggestions_per_user
+from .trending import TRENDING_ORDERING, add_post, current_epoch, read_cursor, record_likes, trending_posts, write_cursor
+
+POSTS_PER_PAGE = 10
+
+# Feeds are ordered newest first; the id breaks ties between posts
+# created in the same instant
+FEED_ORDERING = ("timestamp", "id")
 
 """ 
 GET_POSTS HELPER FUNCTION
 
     Get posts. If there is a userID object, it checks whether it is a list or QuerySet, 
-    or a single ID and it filters the posts by that user(s). If nothing is provided,
-    it returns all the posts.
+    or a single ID and it filters the posts by that user(s). If a posts QuerySet is
+    provided, those posts are used instead. If nothing is provided, it returns all
+    the posts.
 
     Returns serialized posts, with the order reversed so newest posts appear first.
+
+    Posts are ordered newest first by the fields in ordering (see FEED_ORDERING).
+    They are paged by page number, unless a cursor is given (an empty string
+    asks for the first page). In cursor mode the posts are paged by
+    (timestamp, id) without counting the feed, and the trailing activeUser
+    entry also carries the next_cursor token (None on the last page).
+
+    With compact, the page is returned as a compact wire format envelope
+    instead (see network/wire.py).
     
 """
-def get_posts(userID=None, active_user=None, page=1):
+def get_posts(userID=None, active_user=None, page=1, cursor=None, posts=None, ordering=FEED_ORDERING,
+              compact=False):
+
+    # The all posts and profile feeds look the same to every viewer, so their
+    # pages can be served from the cache; a posts QuerySet (the Following feed)
+    # or a list of users is specific to the viewer
+    cacheable = posts is None and (userID is None or isinstance(userID, int))
     
+    # If a Post QuerySet is provided, page through it as it is
+    # this is needed for the Following page, which is read from the user's timeline
+    if posts is not None:
+        pass
+
     # If userID is a list or a QuerySet, filter posts by multiple users
-    # this is needed for the Following page
-    if isinstance(userID, (list, QuerySet)):
-        posts = Post.objects.filter(poster__in=userID).order_by('-timestamp')
+    elif isinstance(userID, (list, QuerySet)):
+        posts = Post.objects.filter(poster__in=userID)
     
     # If userID is a single integer, filter posts by that specific user
     # this is needed for the profile page
     elif isinstance(userID, int):
-        posts = Post.objects.filter(poster=userID).order_by('-timestamp')
+        posts = Post.objects.filter(poster=userID)
     
     # If no userID is provided, get all posts
     # this is needed for the all posts page
     else:
-        posts = Post.objects.all().order_by('-timestamp')
+        posts = Post.objects.all()
+
+    # Load the poster in the same query, so a page costs the same number
+    # of queries whatever its size
+    posts = posts.select_related('poster')
 
-    # Create a Paginator object with 10 posts per page
-    paginator = Paginator(posts, 10)
+    # Get the posts of the current page from the DB
+    def load_page():
+        # In cursor mode, get the page of posts following the cursor
+        if cursor is not None:
+            return keyset_page(posts, ordering, cursor, POSTS_PER_PAGE)
 
-    # Get the posts for the current page
-    current_page_posts = paginator.get_page(page)
+        # Otherwise, create a Paginator object with 10 posts per page
+        # and get the posts for the current page
+        paginator = Paginator(posts.order_by(*[f"-{field}" for field in ordering]), POSTS_PER_PAGE)
+        return list(paginator.get_page(page)), None
+
+    # Get the serialized posts of the page, from the cache if possible
+    if cacheable:
+        serialized_posts, next_cursor = get_feed_page(
+            feed_name(userID), page, cursor, load_page,
+            lambda post_ids: Post.objects.select_related('poster').filter(id__in=post_ids),
+            compact=compact,
+        )
+    else:
+        current_page_posts, next_cursor = load_page()
+        with timer("serialize"):
+            serialized_posts = [
+                post.serialize_compact() if compact else post.serialize() for post in current_page_posts
+            ]
+
+    # The compact format goes in an envelope instead (see network/wire.py)
+    if compact:
+        liked_ids = get_liked_post_ids(serialized_posts, active_user)
+        return compact_envelope(serialized_posts, liked_ids, active_user.username, next_cursor)
 
-    # Create a serialized list of posts
     # if there is a logged in user, add a check to see if the post has been liked
     # by the active user
-    serialized_posts = []
-    for post in current_page_posts:
-        post_data = post.serialize()
-        if active_user:
-            post_data['user_liked'] = Like.objects.filter(post=post, liker=active_user).exists()
-        post_data['likes_count'] = Like.objects.filter(post=post).count()
-        serialized_posts.append(post_data)
+    if active_user:
+        add_user_liked(serialized_posts, active_user)
     
     # Add the active user to the serialized list so we have access to it client-side
-    serialized_posts.append({"activeUser": active_user.username})
+    if cursor is not None:
+        serialized_posts.append({"activeUser": active_user.username, "next_cursor": next_cursor})
+    else:
+        serialized_posts.append({"activeUser": active_user.username})
 
     return serialized_posts
    
+"""
+ASYNC VIEW HELPER FUNCTIONS
+
+    The feed and profile views are async, so under ASGI (project4/asgi.py) a
+    worker holds many requests in flight while they wait on the database.
+
+    Django runs the ORM, the cache and the session in a thread per request, so
+    the lookups of one request would run one after another. With
+    NETWORK_PARALLEL_READS (on by default) independent read-only lookups each
+    run on a thread (and database connection) of their own instead, and the
+    request waits for the slowest of them rather than for their sum.
+"""
+# The logged in user, or None; request.user is loaded lazily from the
+# session, which needs the database
+async def get_active_user(request):
+    return await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+
+
+def _read_in_own_thread(lookup):
+    def read():
+        # This thread does not see request_started/finished, so recycle its
+        # connection here
+        close_old_connections()
+        return lookup()
+    return read
+
+
+# Run independent read-only lookups, concurrently if NETWORK_PARALLEL_READS is set,
+# and return their results in order
+async def read_concurrently(*lookups):
+    if not getattr(settings, "NETWORK_PARALLEL_READS", True):
+        return [await sync_to_async(lookup)() for lookup in lookups]
+    return await asyncio.gather(*(
+        sync_to_async(_read_in_own_thread(lookup), thread_sensitive=False)() for lookup in lookups
+    ))
+
+
+# Find which of the serialized posts the active user has liked,
+# using a single query for the whole page
+def get_liked_post_ids(serialized_posts, active_user):
+    return set(
+        Like.objects.filter(
+            liker=active_user,
+            post__in=[post_data['id'] for post_data in serialized_posts]
+        ).values_list('post_id', flat=True)
+    )
+
+
+def add_user_liked(serialized_posts, active_user):
+    liked_post_ids = get_liked_post_ids(serialized_posts, active_user)
+    for post_data in serialized_posts:
+        post_data['user_liked'] = post_data['id'] in liked_post_ids
+
+
 """
 MAIN INDEX PAGE FUNCTIONS
+
+    With NETWORK_SSR_FIRST_PAGE on, the index, search and profile pages embed
+    the data of their first page in the HTML (with json_script), in the same
+    shape as the AJAX response for it, and network.js shows it without
+    fetching it again. Only the pages after it are fetched.
 """
+def ssr_enabled():
+    return getattr(settings, "NETWORK_SSR_FIRST_PAGE", True)
+
+
+# Get a page of the all posts, following ("following") or trending ("trending") feed
+def load_feed_page(user, feed, page, cursor, compact=False):
+    # If the user is only interested in posts from people they follow
+    # get the posts from their timeline
+    if feed == "following":
+        return get_posts(
+            None, user, page, cursor,
+            posts=following_posts(user), ordering=TIMELINE_ORDERING, compact=compact
+        )
+
+    # The trending feed is read down the stored scores (see network/trending.py),
+    # and its cursors carry the epoch of those scores
+    if feed == "trending":
+        epoch = current_epoch()
+        posts = get_posts(
+            None, user, page, read_cursor(cursor),
+            posts=trending_posts(), ordering=TRENDING_ORDERING, compact=compact
+        )
+        return with_next_cursor(posts, lambda token: write_cursor(token, epoch))
+
+    # otherwise, get all the posts
+    return get_posts(None, user, page, cursor, compact=compact)
+
+
+# Apply change to the next page cursor of a get_posts() result, in either format
+def with_next_cursor(posts, change):
+    if isinstance(posts, dict):
+        if "next" in posts:
+            posts["next"] = change(posts["next"])
+    elif "next_cursor" in posts[-1]:
+        posts[-1]["next_cursor"] = change(posts[-1]["next_cursor"])
+    return posts
+
+
+def feed_requested(request):
+    if request.GET.get('following') == 'true':
+        return "following"
+    if request.GET.get('trending') == 'true':
+        return "trending"
+    return "all"
+
 
 # render the index page after getting necessary data
-def index(request):
+async def index(request):
     # Check if the user is logged in
-    if not request.user.is_authenticated:
+    user = await get_active_user(request)
+    if user is None:
         return HttpResponseRedirect(reverse("login"))
     
-    # Check if "following" query parameter is set to "true"
-    following_only = request.GET.get('following') == 'true'
+    # Check if the "following" or "trending" query parameter is set to "true"
+    feed = feed_requested(request)
     
     #grab all the posts from the DB and return them as JSON
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         page = request.GET.get('page', 1)
-        
-        # If the user is only interested in posts from people they follow
-        # get only the posts from the users they follow
-        if following_only:
-            following_users = Follow.objects.filter(follower=request.user).values_list('follows', flat=True)
-            posts = get_posts(following_users, request.user, page)
-        
-        # otherwise, get all the posts
-        else:
-            posts = get_posts(None, request.user, page)
+        cursor = request.GET.get('cursor')
+        compact = wants_compact(request)
 
-        return JsonResponse(posts, safe=False)
+        # The liked posts lookup needs the page, so the feed is read in one go
+        def load_feed():
+            try:
+                posts = load_feed_page(user, feed, page, cursor, compact=compact)
+            except InvalidCursor as e:
+                return JsonResponse({"error": str(e)}, status=400)
+
+            # answer with a 304 if the client already has this page
+            return conditional_json(request, posts, compact=compact, safe=False)
+
+        return await sync_to_async(load_feed)()
         
-    #If it's not an AJAX request, render the index page
+    #If it's not an AJAX request, render the index page, with the first page
+    # of posts in the compact format
     else:
-        return render(request, "network/index.html")
+        def render_page():
+            context = {}
+            if ssr_enabled():
+                context["initial_feed"] = load_feed_page(user, feed, 1, "", compact=True)
+            return render(request, "network/index.html", context)
+
+        return await sync_to_async(render_page)()
     
 # create a new post
 @login_required
@@ -103,15 +290,71 @@ def new_post(request):
          # Check if postBody is not empty
          
         if request.POST.get("new-post-body"): 
-            Post.objects.create(
-                poster=request.user, 
-                body=request.POST["new-post-body"]
-                )
+            # Create the post, and queue writing it into the followers' timelines
+            with transaction.atomic():
+                post = Post.objects.create(
+                    poster=request.user, 
+                    body=request.POST["new-post-body"]
+                    )
+                enqueue("fan_out_post", post=post.id)
+                add_post(post)
+                feed_changed(request.user.id)
+                post_created(post)
             return HttpResponseRedirect(reverse("index"))
     else:
         messages.error(request, 'Cannot create empty post.')
         return HttpResponseRedirect(reverse("index"))
         
+"""
+SEARCH FUNCTIONS
+
+    /search?q=<words> shows the index page with the posts matching the words;
+    its AJAX requests get the results in the same shapes as the feed (full or
+    compact), best match first and paged by cursor (see network/search.py).
+"""
+# Get a page of search results in the compact format
+def search_envelope(query, cursor, active_user):
+    posts, next_cursor = search_posts(query, cursor, POSTS_PER_PAGE)
+    with timer("serialize"):
+        serialized_posts = [post.serialize_compact() for post in posts]
+    liked_ids = get_liked_post_ids(serialized_posts, active_user)
+    return compact_envelope(serialized_posts, liked_ids, active_user.username, next_cursor)
+
+
+def search(request):
+    if not request.user.is_authenticated:
+        return HttpResponseRedirect(reverse("login"))
+
+    query = request.GET.get("q", "")
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        if wants_compact(request):
+            try:
+                envelope = search_envelope(query, request.GET.get("cursor"), request.user)
+            except (InvalidSearch, InvalidCursor) as e:
+                return JsonResponse({"error": str(e)}, status=400)
+            with timer("serialize"):
+                return compact_response(envelope)
+
+        try:
+            posts, next_cursor = search_posts(query, request.GET.get("cursor"), POSTS_PER_PAGE)
+        except (InvalidSearch, InvalidCursor) as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        with timer("serialize"):
+            serialized_posts = [post.serialize() for post in posts]
+        add_user_liked(serialized_posts, request.user)
+        serialized_posts.append({"activeUser": request.user.username, "next_cursor": next_cursor})
+        return JsonResponse(serialized_posts, safe=False)
+    else:
+        context = {"search_query": query}
+        if ssr_enabled():
+            try:
+                context["initial_feed"] = search_envelope(query, "", request.user)
+            except InvalidSearch:
+                # Left to the AJAX request, which shows the error
+                pass
+        return render(request, "network/index.html", context)
+
 """
 LIKE / UNLIKE BUTTON FUNCTIONS
 """
@@ -120,15 +363,21 @@ LIKE / UNLIKE BUTTON FUNCTIONS
 def like_post(request, post_id):
     try:
         post = Post.objects.get(pk=post_id)
-        # Check if the like already exists
-        existing_like = Like.objects.filter(liker=request.user, post=post)
-        if existing_like.exists():
+
+        # Create the like and count it in the same transaction; the unique
+        # constraint on (liker, post) rejects a like that already exists
+        try:
+            with transaction.atomic():
+                Like.objects.create(liker=request.user, post=post)
+                change_likes_count(post.id, 1)
+                record_likes(post.id, 1)
+                posts_changed(post.id)
+                likes_changed(post.id, 1, request.user)
+        except IntegrityError:
             return JsonResponse({"error": "Post already liked by user."}, status=400)
-        
-        else:
-            # Create the like since it doesn't exist
-            Like.objects.create(liker=request.user, post=post)
-            return JsonResponse({"likes_count": Like.objects.filter(post=post).count()}, status=201)
+
+        post.refresh_from_db(fields=["likes_count"])
+        return JsonResponse({"likes_count": post.likes_count}, status=201)
     except:
         return JsonResponse({"error": "Unable to like post."}, status=400)
 
@@ -137,18 +386,42 @@ def like_post(request, post_id):
 def unlike_post(request, post_id):
     try:
         post = Post.objects.get(pk=post_id)
-        if Like.objects.filter(post=post).count() <= 0:
+        if post.likes_count <= 0:
             return JsonResponse({"error": "Cannot unlike a post with zero likes."}, status=400)
         else:
-            like = Like.objects.filter(liker=request.user, post=post).first()
-            if like:
-                like.delete()
-            else:
+            with transaction.atomic():
+                deleted, _ = Like.objects.filter(liker=request.user, post=post).delete()
+                if deleted:
+                    change_likes_count(post.id, -deleted)
+                    record_likes(post.id, -deleted)
+                    posts_changed(post.id)
+                    likes_changed(post.id, -deleted, request.user)
+            if not deleted:
                 return JsonResponse({"error": "Post not liked by user."}, status=400)
-            return JsonResponse({"likes_count": Like.objects.filter(post=post).count()}, status=200)
+            post.refresh_from_db(fields=["likes_count"])
+            return JsonResponse({"likes_count": post.likes_count}, status=200)
     except:
         return JsonResponse({"error": "Unable to unlike post."}, status=400)
     
+"""
+BATCHED LIKE / FOLLOW FUNCTION
+
+    Applies a list of like, unlike, follow and unfollow operations in one
+    transaction (see network/batch.py), and returns the new likes count of
+    every post and follower count of every user they name.
+"""
+@login_required
+@require_POST
+def batch(request):
+    try:
+        data = json.loads(request.body)
+        likes, follows = parse_operations(data.get("operations") if isinstance(data, dict) else None)
+        return JsonResponse(apply_operations(request.user, likes, follows), status=200)
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Invalid JSON."}, status=400)
+    except InvalidBatch as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
 """
 EDIT POST FUNCTIONS
 """
@@ -167,6 +440,8 @@ def edit(request, post_id):
             post.edited = True
             post.edited_timestamp = timezone.now()
             post.save()
+            posts_changed(post.id)
+            post_edited(post)
             return JsonResponse({"body": post.body, "edited": post.edited}, status=201)
         else:
             return JsonResponse({"error": "Post not owned by current user and cannot be edited."}, status=400)
@@ -175,41 +450,132 @@ def edit(request, post_id):
         return JsonResponse({"error": "Unable to edit post."}, status=400)
 
 
+"""
+LIVE UPDATE FUNCTIONS
+
+    A page keeps an EventSource open on this view to learn about new posts in
+    the feed it shows, and about likes and edits of the posts on screen:
+
+        /events?feed=all|following|search|user:<id>&posts=<id>,<id>,...
+
+    It streams for as long as the page stays open, so it is only served
+    through the ASGI application (project4/asgi.py), where an open stream only
+    holds a coroutine. Under WSGI Django reads an async stream to its end
+    before sending it, so an endless one would hold a worker forever; there
+    the view answers 204 No Content, which tells EventSource not to
+    reconnect, and the pages go without live updates.
+"""
+# How many on screen posts a page can ask to hear about
+MAX_WATCHED_POSTS = 200
+
+async def live_events(request):
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+
+    user = await get_active_user(request)
+    if user is None:
+        return JsonResponse({"error": "Login required."}, status=401)
+
+    feed = request.GET.get("feed", "all")
+    if feed not in ("all", "following", "trending", "search") and not re.fullmatch(r"user:\d+", feed):
+        return JsonResponse({"error": "Unknown feed."}, status=400)
+    try:
+        post_ids = {int(post_id) for post_id in request.GET.get("posts", "").split(",") if post_id}
+    except ValueError:
+        return JsonResponse({"error": "Invalid post IDs."}, status=400)
+    if len(post_ids) > MAX_WATCHED_POSTS:
+        return JsonResponse({"error": f"At most {MAX_WATCHED_POSTS} posts can be watched."}, status=400)
+
+    followed = frozenset()
+    if feed == "following":
+        followed = frozenset([
+            user_id async for user_id in Follow.objects.filter(follower=user).values_list("follows_id", flat=True)
+        ])
+
+    response = StreamingHttpResponse(
+        event_stream(get_broker().subscribe(), feed, post_ids, followed, user.id),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    # Ask a buffering proxy (nginx) to pass events on as they come
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
 """
 PROFILE PAGE FUNCTIONS
 """  
+# Get the part of the profile page that is the same for every viewer
+def load_profile_header(userID):
+    profile_user = User.objects.get(id=userID)
+    return {
+        "userName": profile_user.username,
+        "numFollowers": profile_user.followers_count,
+        "numFollows": profile_user.following_count,
+    }
+
+# Get the data of a page of a user's profile: a page of their posts, their
+# follower and follows counts, and whether the active user follows them.
+# With compact, userPosts is a compact wire format envelope
+async def load_profile_page(user, userID, page, cursor, compact=False):
+    # The posts, the header and the follow check do not depend on each other
+    userPosts, header, activeUserFollows = await read_concurrently(
+        lambda: get_posts(userID, user, page, cursor, compact=compact),
+        lambda: get_profile_header(userID, lambda: load_profile_header(userID)),
+        lambda: Follow.objects.filter(follower=user, follows=userID).exists(),
+    )
+    userName = header["userName"]
+    numFollowers = header["numFollowers"]
+    numFollows = header["numFollows"]
+
+    # Return data in structured format
+    userProfileData = {
+        "userName": userName,
+        "userPosts": userPosts,
+        "numFollowers": numFollowers,
+        "numFollows": numFollows,
+        "activeUserFollows": activeUserFollows,
+        "activeUser": user.username
+    }
+    if compact:
+        userProfileData["next_cursor"] = userPosts.get("next")
+    elif cursor is not None:
+        userProfileData["next_cursor"] = userPosts[-1]["next_cursor"]
+    return userProfileData
+
 # Correct path
-def profile(request, userID):
+async def profile(request, userID):
     
     # Check if the user is logged in
-    if not request.user.is_authenticated:
+    user = await get_active_user(request)
+    if user is None:
         return HttpResponseRedirect(reverse("login"))
     
     #grab all the user's posts from the DB, and their follower and follows counts
     # and return them as JSON
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         page = request.GET.get('page', 1)
-        userPosts = get_posts(userID, request.user, page)
-        userName = User.objects.get(id=userID).username  
-        numFollowers = Follow.objects.filter(follows=userID).count()
-        numFollows = Follow.objects.filter(follower=userID).count()
-        activeUserFollows = Follow.objects.filter(follower=request.user, follows=userID).exists()
-
-        # Return data in structured format
-        userProfileData = {
-            "userName": userName,
-            "userPosts": userPosts,
-            "numFollowers": numFollowers,
-            "numFollows": numFollows,
-            "activeUserFollows": activeUserFollows,
-            "activeUser": request.user.username
-        }
+        cursor = request.GET.get('cursor')
+        compact = wants_compact(request)
+
+        try:
+            userProfileData = await load_profile_page(user, userID, page, cursor, compact=compact)
+        except InvalidCursor as e:
+            return JsonResponse({"error": str(e)}, status=400)
         
-        return JsonResponse(userProfileData, safe=False)
+        # answer with a 304 if the client already has this page
+        return await sync_to_async(conditional_json)(request, userProfileData, compact=compact, safe=False)
     
-    #If it's not an AJAX request, render the profile page
+    #If it's not an AJAX request, render the profile page, with its first page
+    # of posts in the compact format
     else:
-        return render(request, "network/profile.html", {"userID": userID})
+        context = {"userID": userID}
+        if ssr_enabled():
+            try:
+                context["initial_profile"] = await load_profile_page(user, userID, 1, "", compact=True)
+            except User.DoesNotExist:
+                pass
+        return await sync_to_async(render)(request, "network/profile.html", context)
     
 # Error path
 def no_user_profile(request):
@@ -227,16 +593,22 @@ def follow_user(request, userID):
     try:
         user_to_follow = User.objects.get(pk=userID)
 
-        # Check if the follow relationship already exists
-        existing_follow = Follow.objects.filter(follower=request.user, follows=user_to_follow)
-        
-        if existing_follow.exists():
+        # Create the follow relationship and count it in the same transaction;
+        # the unique constraint on (follower, follows) rejects a repeat follow
+        try:
+            with transaction.atomic():
+                Follow.objects.create(follower=request.user, follows=user_to_follow)
+                change_follow_counts(request.user.id, user_to_follow.id, 1)
+                profiles_changed([request.user.id, user_to_follow.id])
+                # Queue adding the followed user's recent posts to the active user's timeline
+                enqueue("backfill_timeline", owner=request.user.id, followed=user_to_follow.id)
+                enqueue("refresh_suggestions", user=request.user.id)
+        except IntegrityError:
             return JsonResponse({"error": "Profile already followed by active user"}, status=400)
-        
-        else:
-            # Create the follow relationship since it doesn't exist
-            Follow.objects.create(follower=request.user, follows=user_to_follow)
-            return JsonResponse({"activeUserFollows": True, "follower_count": Follow.objects.filter(follows=user_to_follow).count()}, status=201)
+
+        user_to_follow.refresh_from_db(fields=["followers_count"])
+
+        return JsonResponse({"activeUserFollows": True, "follower_count": user_to_follow.followers_count}, status=201)
     
     except User.DoesNotExist:
         return JsonResponse({"error": "User not found."}, status=404)
@@ -250,16 +622,21 @@ def unfollow_user(request, userID):
     try:
         user_to_unfollow = User.objects.get(pk=userID)
         
-        # Check if the follow already exists
-        existing_follow = Follow.objects.filter(follower=request.user, follows=user_to_unfollow)
-        
-        if not existing_follow.exists():
+        # Unfollow the user and count it in the same transaction;
+        # nothing is deleted if the follow does not exist
+        with transaction.atomic():
+            deleted, _ = Follow.objects.filter(follower=request.user, follows=user_to_unfollow).delete()
+            if deleted:
+                change_follow_counts(request.user.id, user_to_unfollow.id, -deleted)
+                profiles_changed([request.user.id, user_to_unfollow.id])
+                # Queue taking the unfollowed user's posts out of the active user's timeline
+                enqueue("remove_from_timeline", owner=request.user.id, unfollowed=user_to_unfollow.id)
+                enqueue("refresh_suggestions", user=request.user.id)
+        if not deleted:
             return JsonResponse({"error": "Profile already unfollowed by active user"}, status=400)
-        
-        else:
-            # Unfollow the user
-            existing_follow.delete()
-            return JsonResponse({"activeUserFollows": False, "follower_count": Follow.objects.filter(follows=user_to_unfollow).count()}, status=201)
+
+        user_to_unfollow.refresh_from_db(fields=["followers_count"])
+        return JsonResponse({"activeUserFollows": False, "follower_count": user_to_unfollow.followers_count}, status=201)
     except User.DoesNotExist:
         return JsonResponse({"error": "User not found."}, status=404)
     except Exception as e:
@@ -267,9 +644,49 @@ def unfollow_user(request, userID):
         return JsonResponse({"error": "Unable to unfollow profile."}, status=400)
 
     
+"""
+FOLLOW SUGGESTION FUNCTIONS
+
+    The "who to follow" list is precomputed from the follow graph (see
+    network/graph.py), so serving it is a single indexed query.
+"""
+@login_required
+def suggestions(request):
+    suggested = (
+        Suggestion.objects.filter(user=request.user)
+        .select_related("suggested")
+        .order_by("-score", "suggested")[:suggestions_per_user()]
+    )
+    return JsonResponse({"suggestions": [suggestion.serialize() for suggestion in suggested]})
+
+"""
+CACHE AND PERFORMANCE STATS FUNCTIONS
+"""
+# Show staff the feed cache hit/miss counters of this process
+@login_required
+def cache_stats(request):
+    if not request.user.is_staff:
+        return JsonResponse({"error": "Only staff can view cache stats."}, status=403)
+    return JsonResponse(cache_counters())
+
+# Show staff the per-view timings collected by PerformanceMiddleware in this process
+@login_required
+def perf_stats(request):
+    if not request.user.is_staff:
+        return JsonResponse({"error": "Only staff can view performance stats."}, status=403)
+    return JsonResponse(aggregate.snapshot())
+
+# Show staff the background job queue depth and lag, and this process' job counters
+@login_required
+def job_stats(request):
+    if not request.user.is_staff:
+        return JsonResponse({"error": "Only staff can view job stats."}, status=403)
+    return JsonResponse(job_counters())
+
 """
 LOGIN PAGE FUNCTION
 """
+@rate_limit("login", "10/m", key="ip")
 def login_view(request):
     if request.method == "POST":
 
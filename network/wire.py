@@ -0,0 +1,73 @@
+import json
+
+from django.http import HttpResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+"""
+COMPACT WIRE FORMAT
+
+    The feed JSON comes in two formats. The full format, the default, is a list
+    of Post.serialize() dicts followed by an {"activeUser": ...} entry. The
+    compact format (version 1) is asked for with ?format=compact or with
+    "Accept: application/vnd.network.v1+json", and is an envelope:
+
+        {
+            "v": 1,
+            "posts": [
+                {"id": 7, "user": 3, "body": "...", "ts": 1760000000000,
+                 "edited_ts": 1760000100000, "likes": 2, "liked": true},
+                ...
+            ],
+            "users": {"3": "alice"},
+            "me": "bob",
+            "next": "<cursor>"
+        }
+
+    - timestamps are epoch milliseconds (UTC), not formatted strings
+    - each poster's name is sent once, in "users", and posts refer to it by ID
+    - edited_ts, likes and liked are left out when the post is not edited,
+      has no likes, or is not liked by the viewer; next when there is no
+      next page
+    - posts are in feed order, newest first, so clients need not sort them
+
+    The profile response keeps its shape in both formats, with userPosts a
+    compact envelope in the compact one.
+
+    It is encoded with orjson when it is installed.
+
+"""
+WIRE_VERSION = 1
+COMPACT_MEDIA_TYPE = f"application/vnd.network.v{WIRE_VERSION}+json"
+
+
+def wants_compact(request):
+    return request.GET.get("format") == "compact" or COMPACT_MEDIA_TYPE in request.headers.get("Accept", "")
+
+
+# Build the compact envelope from Post.serialize_compact() dicts; liked_ids are
+# the IDs of the posts the viewer has liked
+def compact_envelope(compact_posts, liked_ids, active_username, next_cursor=None):
+    users = {}
+    for post in compact_posts:
+        users[post["user"]] = post.pop("name")
+        if post["id"] in liked_ids:
+            post["liked"] = True
+    envelope = {"v": WIRE_VERSION, "posts": compact_posts, "users": users, "me": active_username}
+    if next_cursor:
+        envelope["next"] = next_cursor
+    return envelope
+
+
+def dumps(data):
+    if orjson is not None:
+        # orjson refuses integer dict keys unless asked
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def compact_response(data, **kwargs):
+    return HttpResponse(dumps(data), content_type=COMPACT_MEDIA_TYPE, **kwargs)
@@ -41,11 +41,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'network.assets.StaticAssetMiddleware',
+    'network.middleware.PerformanceMiddleware',
+    'network.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'network.middleware.RateLimitMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -74,15 +78,124 @@ WSGI_APPLICATION = 'project4.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
+# NETWORK_SQLITE_PRODUCTION=1 turns on the production SQLite setup (see
+# network/sqlite.py): WAL and tuned pragmas on every connection, persistent
+# connections, BEGIN IMMEDIATE write transactions, and a read-only alias that
+# serves as a read replica. NETWORK_SQLITE_PATH moves the database file.
+
+NETWORK_SQLITE_PRODUCTION = os.environ.get('NETWORK_SQLITE_PRODUCTION') == '1'
+
+SQLITE_PATH = os.environ.get('NETWORK_SQLITE_PATH', os.path.join(BASE_DIR, 'db.sqlite3'))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'NAME': SQLITE_PATH,
     }
 }
 
+# Read replicas (see network/routers.py): the aliases the reads of GET requests
+# may go to. NETWORK_REPLICA_PATHS lists SQLite files, separated by commas, that
+# stand in for replicas locally; refresh them with the sync_replicas command.
+
+NETWORK_REPLICAS = []
+
+NETWORK_REPLICA_STICKY_SECONDS = 5
+
+DATABASE_ROUTERS = ['network.routers.ReplicaRouter']
+
+if NETWORK_SQLITE_PRODUCTION:
+    import django
+
+    DATABASES['default'].update({
+        # Keep connections open between requests (under WSGI; under ASGI each
+        # request runs on a new thread and cannot reuse one)
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        # How long sqlite3 waits for a lock, in seconds
+        'OPTIONS': {'timeout': 20},
+    })
+    if django.VERSION >= (5, 1):
+        DATABASES['default']['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
+
+    # A read-only connection to the same file; in WAL mode its reads never
+    # wait for the writer
+    DATABASES['readonly'] = {
+        **DATABASES['default'],
+        'NAME': f"file:{SQLITE_PATH}?mode=ro",
+        'OPTIONS': {'timeout': 20, 'uri': True},
+        # Tests use the default connection for it
+        'TEST': {'MIRROR': 'default'},
+    }
+    NETWORK_REPLICAS.append('readonly')
+
+for number, path in enumerate(filter(None, os.environ.get('NETWORK_REPLICA_PATHS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'NAME': path,
+        'TEST': {'MIRROR': 'default'},
+    }
+    NETWORK_REPLICAS.append(f'replica{number}')
+
 AUTH_USER_MODEL = "network.User"
 
+
+# Caches
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# NETWORK_CACHE_BACKEND picks the backend: "locmem" (the default, per process),
+# "file" or "redis"; NETWORK_CACHE_LOCATION is the directory or redis:// URL
+
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+
+CACHE_LOCATIONS = {
+    'locmem': 'network',
+    'file': os.path.join(BASE_DIR, '.cache'),
+    'redis': 'redis://127.0.0.1:6379/1',
+}
+
+NETWORK_CACHE_BACKEND = os.environ.get('NETWORK_CACHE_BACKEND', 'locmem')
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[NETWORK_CACHE_BACKEND],
+        'LOCATION': os.environ.get('NETWORK_CACHE_LOCATION', CACHE_LOCATIONS[NETWORK_CACHE_BACKEND]),
+        'OPTIONS': {'MAX_ENTRIES': 10000} if NETWORK_CACHE_BACKEND != 'redis' else {},
+    }
+}
+
+# The cache used for feed pages and profile headers (see network/caching.py)
+# and how many seconds entries are kept
+
+NETWORK_CACHE_ALIAS = 'default'
+
+NETWORK_CACHE_TIMEOUT = 300
+
+# Sessions and the logged in user
+# NETWORK_SESSION_ENGINE picks where sessions are kept: "db" (the default),
+# "cached_db" (the database, read through the cache) or "signed_cookies" (in
+# the browser, no storage at all). NETWORK_USER_CACHE_TIMEOUT caches
+# request.user for that many seconds (see network/auth.py); it defaults to
+# off with the per-process locmem cache. Both need a shared cache (file or
+# redis) to be safe with several processes.
+
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+
+SESSION_ENGINE = SESSION_ENGINES[os.environ.get('NETWORK_SESSION_ENGINE', 'db')]
+
+AUTHENTICATION_BACKENDS = ['network.auth.CachedModelBackend']
+
+NETWORK_USER_CACHE_TIMEOUT = int(os.environ.get(
+    'NETWORK_USER_CACHE_TIMEOUT', '0' if NETWORK_CACHE_BACKEND == 'locmem' else '300'
+))
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -120,3 +233,114 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# NETWORK_STATIC_PRODUCTION=1 serves static files the production way (see
+# network/assets.py): hashed, pre-compressed copies collected into STATIC_ROOT
+# by collectstatic, sent by the web process with far-future cache headers.
+# Unhashed names are cached for NETWORK_STATIC_MAX_AGE seconds.
+
+NETWORK_STATIC_PRODUCTION = os.environ.get('NETWORK_STATIC_PRODUCTION') == '1'
+
+STATIC_ROOT = os.environ.get('NETWORK_STATIC_ROOT', os.path.join(BASE_DIR, 'staticfiles'))
+
+NETWORK_STATIC_MAX_AGE = 60
+
+NETWORK_STATIC_MEMORY_LIMIT = 512 * 1024
+
+if NETWORK_STATIC_PRODUCTION:
+    STORAGES = {
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'network.assets.CompressedManifestStaticFilesStorage'},
+    }
+
+
+# Following feed timelines (see network/timeline.py)
+# Users with more followers than the threshold are merged into feeds on read
+# instead of being written into every follower's timeline
+
+NETWORK_FANOUT_THRESHOLD = 1000
+
+NETWORK_TIMELINE_LENGTH = 800
+
+# "Who to follow" suggestions kept per user (see network/graph.py)
+
+NETWORK_SUGGESTIONS_PER_USER = 10
+
+# Trending feed (see network/trending.py): how fast a like's weight halves,
+# and how old a post can be and still trend
+
+NETWORK_TRENDING_HALF_LIFE_HOURS = 6
+
+NETWORK_TRENDING_WINDOW_HOURS = 72
+
+
+# Per-request performance instrumentation (see network/middleware.py)
+# Set NETWORK_PERF=1 to profile a NETWORK_PERF_SAMPLE_RATE share of requests;
+# requests slower than NETWORK_PERF_SLOW_MS are logged with their SQL
+
+NETWORK_PERF_ENABLED = os.environ.get('NETWORK_PERF') == '1'
+
+NETWORK_PERF_SAMPLE_RATE = float(os.environ.get('NETWORK_PERF_SAMPLE_RATE', '0.05'))
+
+NETWORK_PERF_SLOW_MS = 500
+
+NETWORK_PERF_WINDOW = 1000
+
+# Live updates (see network/events.py): the broker that carries new post, like
+# and edit events to the open /events streams. LocalBroker only reaches the
+# streams served by this process.
+
+NETWORK_EVENT_BROKER = 'network.events.LocalBroker'
+
+# Run the independent lookups of the async profile view on separate threads and
+# database connections (see read_concurrently in network/views.py); on by
+# default, NETWORK_PARALLEL_READS=0 turns it off. Each lookup then reads on a
+# connection of its own, which only sees committed data, so turn it off for
+# views run inside a transaction (ATOMIC_REQUESTS, TestCase). With SQLite the
+# lookups only overlap for real in WAL mode (NETWORK_SQLITE_PRODUCTION), where
+# readers never wait on a writer; in the default journal mode a commit makes
+# them wait, and each lookup pays for opening a connection unless
+# CONN_MAX_AGE keeps it.
+
+NETWORK_PARALLEL_READS = os.environ.get('NETWORK_PARALLEL_READS', '1') == '1'
+
+# Embed the first page of the feed and profile pages in their HTML, so the
+# browser does not have to fetch it separately (see network/views.py)
+
+NETWORK_SSR_FIRST_PAGE = True
+
+# Rate limits for writes (see network/ratelimit.py), per user or, for anonymous
+# requests, per IP address: a rate such as "10/m" (bursts of up to 10), or a
+# dict with "rate", "burst" and "key" ("user" or "ip"). The buckets live in
+# NETWORK_RATE_LIMIT_CACHE, which must be shared (file or redis) for the limits
+# to hold across processes. Behind a proxy, set NETWORK_CLIENT_IP_HEADER.
+
+NETWORK_RATE_LIMITS = {
+    'new_post': '10/m',
+    'edit': '30/m',
+    'like_post': {'rate': '120/m', 'burst': 30},
+    'unlike_post': {'rate': '120/m', 'burst': 30},
+    'follow_user': {'rate': '60/m', 'burst': 20},
+    'unfollow_user': {'rate': '60/m', 'burst': 20},
+    'batch': {'rate': '60/m', 'burst': 20},
+    'register': {'rate': '5/h', 'key': 'ip'},
+}
+
+NETWORK_RATE_LIMIT_CACHE = NETWORK_CACHE_ALIAS
+
+NETWORK_CLIENT_IP_HEADER = os.environ.get('NETWORK_CLIENT_IP_HEADER') or None
+
+# Background jobs (see network/jobs.py): how the deferred side effects of
+# writes run. "thread" runs them in NETWORK_JOB_THREADS threads of the web
+# process, "worker" leaves them to the run_jobs command, "inline" runs them
+# right after the write commits.
+
+NETWORK_JOB_MODE = os.environ.get('NETWORK_JOB_MODE', 'thread')
+
+NETWORK_JOB_THREADS = 2
+
+NETWORK_JOB_BATCH_SIZE = 100
+
+NETWORK_JOB_MAX_ATTEMPTS = 5
+
+NETWORK_JOB_LEASE_SECONDS = 60